@@ -6,9 +6,13 @@ of these dependencies when this module is itself reloaded.
 
 import os
 import sys
+import time
 
 import sublime
 
+# Time the plugin load so slow startups show up in the console.
+_load_start = time.time()
+
 EXPECTED_PACKAGE_DIR = "RESTer HTTP Client"
 RELOADER_NAME = "rester.reloader"
 
@@ -45,7 +49,11 @@ if PACKAGE_DIR != EXPECTED_PACKAGE_DIR:
 reloader_name = RELOADER_NAME
 if ST_VERSION == 3:
     reloader_name = PACKAGE_DIR + "." + reloader_name
-    from imp import reload
+    try:
+        from importlib import reload
+    except ImportError:
+        # Python 3.3
+        from imp import reload
 if reloader_name in sys.modules:
     reload(sys.modules[reloader_name])
 
@@ -59,3 +67,11 @@ except ValueError:
     # Python 2
     from rester import reloader
     from rester.commands import *
+
+_load_elapsed = time.time() - _load_start
+
+
+def plugin_loaded():
+    # Modules for sending requests are imported on the first send, so this
+    # only accounts for the commands and their light dependencies.
+    print("RESTer loaded in %.1f ms" % (_load_elapsed * 1000))
@@ -0,0 +1,272 @@
+"""
+Benchmarks for RESTer's parsing, decoding, and transport hot paths
+
+Runs entirely against an in-process HTTP server on 127.0.0.1, so no network
+access is needed. Results are printed and can be written as JSON to compare
+across versions:
+
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --quick --only parse
+
+Requires Python 3. Each benchmark reports the minimum, median, and mean
+seconds per operation over a number of rounds.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import platform
+import shutil
+import socket
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from rester.form import encode_form  # noqa: E402
+from rester.http import HttpRequestThread  # noqa: E402
+from rester.http import get_request_thread_class  # noqa: E402
+from rester.message import Request  # noqa: E402
+from rester.message import Response  # noqa: E402
+from rester.parse import RequestParser  # noqa: E402
+from rester.resolver import DnsCache  # noqa: E402
+from rester.util import load_settings_file  # noqa: E402
+from rester.util import normalize_line_endings  # noqa: E402
+
+from http.client import HTTPConnection  # noqa: E402
+from http.server import BaseHTTPRequestHandler  # noqa: E402
+from http.server import HTTPServer  # noqa: E402
+from socketserver import ThreadingMixIn  # noqa: E402
+
+
+def _json_payload(size):
+    # Return a JSON array of roughly size bytes.
+    item = '{"id": %d, "name": "item-%d", "tags": ["a", "b", "c"]}'
+    items = []
+    total = 0
+    i = 0
+    while total < size:
+        text = item % (i, i)
+        items.append(text)
+        total += len(text) + 2
+        i += 1
+    return ("[" + ", ".join(items) + "]").encode("utf-8")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    payloads = {}
+
+    def do_GET(self):
+        body, headers = self.payloads.get(self.path, (b"", {}))
+        self.send_response(200 if self.path in self.payloads else 404)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 stalls the connection benchmarks.
+    request_queue_size = 128
+
+
+def start_server(large_size):
+    """Start the local server and return it. Its port is server_port."""
+    large = _json_payload(large_size)
+    _Handler.payloads = {
+        "/small": (b'{"ok": true}',
+                   {"Content-Type": "application/json; charset=utf-8"}),
+        "/large": (large,
+                   {"Content-Type": "application/json; charset=utf-8"}),
+        "/gzip": (gzip.compress(large),
+                  {"Content-Type": "application/json; charset=utf-8",
+                   "Content-Encoding": "gzip"}),
+    }
+    server = _Server(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def measure(fn, rounds, number=1):
+    """Return timing statistics for calling fn number times per round."""
+    times = []
+    for _ in range(rounds):
+        time_start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - time_start) / number)
+    times.sort()
+    return {
+        "rounds": rounds,
+        "number": number,
+        "min": times[0],
+        "median": times[len(times) // 2],
+        "mean": sum(times) / len(times),
+    }
+
+
+def _thread_for_decoding(settings, headers):
+    thread = HttpRequestThread(Request(), settings)
+    thread.response = Response()
+    thread.response.headers = headers
+    return thread
+
+
+def get_benchmarks(settings, server, sizes):
+    """Return a list of (name, fn, number) tuples."""
+    port = server.server_port
+    eol = "\n"
+    benchmarks = []
+
+    # Parsing
+    small_request = "GET http://127.0.0.1/small\nAccept: application/json\n"
+    header_lines = "\n".join("X-Header-%d: value %d" % (i, i)
+                             for i in range(200))
+    query_lines = "\n".join("&param%d = value %d" % (i, i)
+                            for i in range(200))
+    huge_request = "POST http://127.0.0.1/large\n%s\n%s\n\n%s" % (
+        header_lines, query_lines, _json_payload(sizes["body"]).decode())
+    benchmarks.append(("parse.small", lambda: RequestParser(
+        settings, eol).get_request(small_request), 1000))
+    benchmarks.append(("parse.huge", lambda: RequestParser(
+        settings, eol).get_request(huge_request), 5))
+
+    # Line endings
+    mixed = ("line one\r\nline two\rline three\n" * (sizes["body"] // 32))
+    benchmarks.append(("util.normalize_line_endings.lf",
+                       lambda: normalize_line_endings(mixed, "\n"), 5))
+    benchmarks.append(("util.normalize_line_endings.crlf",
+                       lambda: normalize_line_endings(mixed, "\r\n"), 5))
+
+    # Decoding
+    utf8_body = _json_payload(sizes["body"])
+    latin1_body = utf8_body.replace(b"item", b"\xe9t\xe9")
+    declared = _thread_for_decoding(
+        settings, [("Content-Type", "application/json; charset=utf-8")])
+    fallback = _thread_for_decoding(
+        settings, [("Content-Type", "application/json")])
+    benchmarks.append(("decode.declared_charset",
+                       lambda: declared._decode_body(utf8_body), 5))
+    benchmarks.append(("decode.charset_fallback",
+                       lambda: fallback._decode_body(latin1_body), 5))
+
+    # Decompression
+    gzip_body = gzip.compress(_json_payload(sizes["gzip"]))
+    gzipped = _thread_for_decoding(settings, [("Content-Encoding", "gzip")])
+    benchmarks.append(("decode.unzip_gzip",
+                       lambda: gzipped._unzip_body(gzip_body), 5))
+
+    # Form encoding
+    form_lines = ["field%d = value with spaces %d" % (i, i)
+                  for i in range(sizes["form_fields"])]
+    benchmarks.append(("form.encode_form",
+                       lambda: encode_form(form_lines, eol, '"""', '"""'),
+                       5))
+
+    # Clients
+    def client_request(client, path):
+        def fn():
+            request = RequestParser(settings, eol).get_request(
+                "GET http://127.0.0.1:%d%s" % (port, path))
+            # Decode the body in the request, as the request command does.
+            thread = get_request_thread_class(client)(request, settings,
+                                                      decode=True)
+            thread.run()
+            if not thread.success:
+                raise RuntimeError(thread.message)
+            thread.response.close()
+        return fn
+
+    clients = ["python"]
+    if shutil.which(settings.get("curl_command", "curl")):
+        clients.append("curl")
+    for client in clients:
+        for path in ("/small", "/large", "/gzip"):
+            number = 50 if path == "/small" else 5
+            benchmarks.append(("client.%s%s" % (client, path.replace(
+                "/", ".")), client_request(client, path), number))
+
+    # Connection setup
+    def connect_plain():
+        conn = HTTPConnection("localhost", port)
+        conn.connect()
+        conn.close()
+
+    cache = DnsCache()
+
+    def connect_cached():
+        conn = HTTPConnection("localhost", port)
+        conn._create_connection = cache.create_connection
+        conn.connect()
+        conn.close()
+
+    benchmarks.append(("connect.getaddrinfo", connect_plain, 100))
+    benchmarks.append(("connect.dns_cache", connect_cached, 100))
+
+    return benchmarks
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--output", metavar="PATH",
+                        help="Write results as JSON to this path.")
+    parser.add_argument("--rounds", type=int, default=7,
+                        help="Number of rounds per benchmark.")
+    parser.add_argument("--quick", action="store_true",
+                        help="Use small payloads and fewer rounds.")
+    parser.add_argument("--only", metavar="PREFIX",
+                        help="Only run benchmarks whose name starts with this.")
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        sizes = {"body": 2 ** 18, "gzip": 2 ** 20, "form_fields": 1000}
+        rounds = min(args.rounds, 3)
+    else:
+        sizes = {"body": 2 ** 22, "gzip": 2 ** 24, "form_fields": 10000}
+        rounds = args.rounds
+
+    settings = load_settings_file(os.path.join(ROOT,
+                                               "RESTer.sublime-settings"))
+    # Keep curl's progress meter out of the results.
+    settings["curl_options"] = ["--silent", "--show-error"]
+    server = start_server(sizes["body"])
+    results = {}
+    try:
+        for name, fn, number in get_benchmarks(settings, server, sizes):
+            if args.only and not name.startswith(args.only):
+                continue
+            fn()  # Warm up.
+            stats = measure(fn, rounds, number)
+            results[name] = stats
+            print("%-36s min %10.6f  median %10.6f  mean %10.6f" % (
+                name, stats["min"], stats["median"], stats["mean"]))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    if args.output:
+        with open(args.output, "w") as out:
+            json.dump({
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "hostname": socket.gethostname(),
+                "sizes": sizes,
+                "time": time.time(),
+                "results": results,
+            }, out, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+"""
+Recording responses to a cassette file and replaying them
+
+In "record" mode, every exchange is sent over the network and saved to the
+cassette. In "replay" mode, responses come from the cassette and nothing is
+sent; requests that were not recorded fail. "auto" replays recorded
+requests and records the rest.
+
+Requests match a recording when their method, URI (with the query sorted),
+selected headers, and a hash of the body are the same.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+try:
+    # Python 3
+    from urllib.parse import parse_qsl
+    from urllib.parse import urlencode
+    from urllib.parse import urlsplit
+except ImportError:
+    # Python 2
+    from urllib import urlencode
+    from urlparse import parse_qsl
+    from urlparse import urlsplit
+
+CASSETTE_VERSION = 1
+CASSETTE_MODES = ("auto", "record", "replay")
+
+# Request headers whose values are not written to the cassette.
+REDACTED_HEADERS = ("authorization", "cookie", "proxy-authorization")
+
+# Response headers whose values are not written to the cassette.
+REDACTED_RESPONSE_HEADERS = ("set-cookie", "set-cookie2")
+
+_cassettes = {}
+_cassettes_lock = threading.Lock()
+
+
+class CassetteError(Exception):
+    pass
+
+
+def get_cassette_settings(settings):
+    """Return the cassette path and mode to use, or (None, None) if off."""
+    path = settings.get("cassette", None)
+    if not path:
+        return None, None
+    mode = settings.get("cassette_mode", "auto")
+    if mode not in CASSETTE_MODES:
+        raise CassetteError("Unknown cassette_mode %s. Use one of %s." %
+                            (mode, ", ".join(CASSETTE_MODES)))
+    return os.path.abspath(os.path.expanduser(path)), mode
+
+
+def get_cassette(path):
+    """Return the shared Cassette saved at path, loading it on first use."""
+    with _cassettes_lock:
+        cassette = _cassettes.get(path)
+        if cassette is None:
+            cassette = Cassette(path)
+            _cassettes[path] = cassette
+        return cassette
+
+
+def normalize_uri(uri):
+    """Return uri with the scheme and host lowercase, the default port
+    removed, and the query parameters sorted."""
+    parts = urlsplit(uri)
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    default_port = {"http": ":80", "https": ":443"}.get(scheme)
+    if default_port and netloc.endswith(default_port):
+        netloc = netloc[:-len(default_port)]
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    normalized = "%s://%s%s" % (scheme, netloc, parts.path or "/")
+    if query:
+        normalized += "?" + query
+    return normalized
+
+
+def hash_body(request):
+    """Return the SHA-256 hex digest of the request's body or body file."""
+    digest = hashlib.sha256()
+    if request.body_file:
+        with open(request.body_file, "rb") as body_file:
+            while True:
+                chunk = body_file.read(65536)
+                if not chunk:
+                    break
+                digest.update(chunk)
+    elif request.body:
+        body = request.body
+        if not isinstance(body, bytes):
+            body = body.encode("utf-8")
+        digest.update(body)
+    return digest.hexdigest()
+
+
+def get_request_key(request, match_headers=()):
+    """Return the key that identifies recordings of request."""
+    headers = []
+    for name in match_headers:
+        value = request.get_header(name)
+        if value is not None:
+            headers.append([name.lower(), value.strip()])
+    parts = [request.method.upper(), normalize_uri(request.uri),
+             sorted(headers), hash_body(request)]
+    return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+
+class Cassette(object):
+    """Recorded exchanges saved in a JSON Lines file
+
+    The first line holds the version and each later line an interaction,
+    so recording an exchange appends one line instead of rewriting the
+    file. A key recorded again is replaced by its last line. Bodies that
+    were streamed to a download file are copied to a directory beside the
+    cassette rather than read into it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.body_directory = path + ".bodies"
+        self._interactions = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "rb") as cassette_file:
+                text = cassette_file.read().decode("utf-8")
+        except IOError as e:
+            raise CassetteError("Unable to read cassette %s: %s" %
+                                (self.path, e))
+        try:
+            # A cassette saved as a single JSON document.
+            data = json.loads(text)
+            interactions = data["interactions"]
+            rewrite = True
+        except (ValueError, KeyError, TypeError):
+            interactions = []
+            try:
+                for line in text.splitlines():
+                    if line.strip():
+                        interactions.append(json.loads(line))
+            except ValueError as e:
+                raise CassetteError("Unable to read cassette %s: %s" %
+                                    (self.path, e))
+            interactions = [interaction for interaction in interactions
+                            if "key" in interaction]
+            rewrite = False
+        for interaction in interactions:
+            self._interactions[interaction["key"]] = interaction
+        # Drop replaced recordings once they outnumber the current ones.
+        if rewrite or len(interactions) > 2 * len(self._interactions):
+            self._save()
+
+    def find(self, key):
+        """Return the recorded interaction for key, or None."""
+        with self._lock:
+            return self._interactions.get(key)
+
+    def record(self, key, request, response, body_bytes, elapsed,
+               decoded=False, body_file=None):
+        """Save an exchange, replacing any earlier recording of key.
+
+        body_bytes is the body as received, unless decoded is True, in
+        which case its content encoding has already been removed. If
+        body_file is given, the body is copied from that file instead.
+        """
+        interaction = {
+            "key": key,
+            "request": {
+                "method": request.method,
+                "uri": request.uri,
+                "headers": _redact(request.headers, REDACTED_HEADERS),
+            },
+            "response": {
+                "protocol": response.protocol,
+                "status": response.status,
+                "reason": response.reason,
+                "headers": _redact(response.headers,
+                                   REDACTED_RESPONSE_HEADERS),
+                "elapsed": elapsed,
+                "decoded": decoded,
+            },
+        }
+        if body_file:
+            if not os.path.isdir(self.body_directory):
+                os.makedirs(self.body_directory)
+            shutil.copyfile(body_file,
+                            os.path.join(self.body_directory, key + ".body"))
+            interaction["response"]["body_file"] = key + ".body"
+        else:
+            body_bytes = body_bytes or b""
+            try:
+                # Keep text bodies readable in the cassette.
+                interaction["response"]["body"] = body_bytes.decode("utf-8")
+            except UnicodeDecodeError:
+                interaction["response"]["body_base64"] = \
+                    base64.b64encode(body_bytes).decode("ascii")
+        with self._lock:
+            self._interactions[key] = interaction
+            self._append(interaction)
+
+    def get_body(self, interaction):
+        """Return the recorded response body bytes of an interaction."""
+        response = interaction["response"]
+        if "body_file" in response:
+            path = os.path.join(self.body_directory, response["body_file"])
+            try:
+                with open(path, "rb") as body_file:
+                    return body_file.read()
+            except IOError as e:
+                raise CassetteError("Unable to read recorded body %s: %s" %
+                                    (path, e))
+        if "body_base64" in response:
+            return base64.b64decode(response["body_base64"])
+        return response.get("body", "").encode("utf-8")
+
+    def _append(self, interaction):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        lines = []
+        if not os.path.exists(self.path):
+            lines.append(json.dumps({"version": CASSETTE_VERSION}))
+        lines.append(json.dumps(interaction, sort_keys=True))
+        with open(self.path, "ab") as cassette_file:
+            cassette_file.write(("\n".join(lines) + "\n").encode("utf-8"))
+
+    def _save(self):
+        # Write every interaction once. Write to a temporary file and
+        # rename it, so an interrupted save does not corrupt the cassette.
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        lines = [json.dumps({"version": CASSETTE_VERSION})]
+        for key in sorted(self._interactions):
+            lines.append(json.dumps(self._interactions[key], sort_keys=True))
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "wb") as cassette_file:
+            cassette_file.write(("\n".join(lines) + "\n").encode("utf-8"))
+        if os.name == "nt" and os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(temp_path, self.path)
+
+
+def _redact(headers, redacted):
+    # Return headers as lists, with the values of those in redacted hidden.
+    return [[name, "<redacted>"] if name.lower() in redacted
+            else [name, value] for name, value in headers]
@@ -0,0 +1,328 @@
+"""
+Command line interface for running request files outside of Sublime Text
+
+Usage:
+
+    python -m rester.cli run requests.http [more.http ...]
+    python -m rester.cli import-har traffic.har -o requests.http
+    python -m rester.cli replay-har traffic.har --timing original
+    python -m rester.cli load requests.http --requests 1000 --concurrency 20
+    python -m rester.cli load requests.http --rate 200 --duration 30
+
+Run from the package directory. Each ### block of each file is sent, and a
+summary line is printed per request. Blocks run in parallel unless they use
+a value another block captures (see pipeline.py). The exit status is 1 if
+any request failed or returned a 4xx or 5xx status.
+"""
+
+import argparse
+import codecs
+import json
+import os
+import sys
+import time
+
+from .constants import SETTINGS_FILE
+from .util import load_settings_file
+
+DEFAULT_SETTINGS_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    SETTINGS_FILE)
+
+
+def load_settings(paths=None, assignments=None):
+    """Return the default settings updated with settings files and values.
+
+    assignments is a list of "name=value" strings. Values are parsed as
+    JSON, or used as strings if they are not valid JSON.
+    """
+    settings = load_settings_file(DEFAULT_SETTINGS_PATH)
+    for path in paths or []:
+        settings.update(load_settings_file(path))
+    for assignment in assignments or []:
+        name, _, value = assignment.partition("=")
+        try:
+            settings[name.strip()] = json.loads(value)
+        except ValueError:
+            settings[name.strip()] = value
+    return settings
+
+
+def write_json(path, suites):
+    """Write results as JSON to path."""
+    data = []
+    for name, elapsed, results in suites:
+        data.append({
+            "file": name,
+            "elapsed": elapsed,
+            "results": [result.to_dict() for result in results],
+        })
+    with codecs.open(path, "w", encoding="UTF8") as out:
+        json.dump(data, out, indent=2)
+
+
+def write_junit(path, suites):
+    """Write results as a JUnit XML report to path."""
+    from xml.etree import ElementTree
+
+    root = ElementTree.Element("testsuites")
+    for name, elapsed, results in suites:
+        failures = [r for r in results if not r.passed]
+        suite = ElementTree.SubElement(root, "testsuite", {
+            "name": name,
+            "tests": str(len(results)),
+            "failures": str(len(failures)),
+            "errors": "0",
+            "time": "%.6f" % elapsed,
+        })
+        for result in results:
+            case = ElementTree.SubElement(suite, "testcase", {
+                "classname": name,
+                "name": result.name,
+                "time": "%.6f" % (result.elapsed or 0),
+            })
+            if not result.passed:
+                if result.response is not None:
+                    message = result.response.status_line
+                else:
+                    message = result.message or "Unable to make request."
+                failure = ElementTree.SubElement(case, "failure",
+                                                 {"message": message})
+                failure.text = message
+    ElementTree.ElementTree(root).write(path, encoding="utf-8",
+                                        xml_declaration=True)
+
+
+def run(args):
+    from .executor import Executor
+    from .pipeline import PipelineError
+    from .pipeline import run_pipeline
+
+    settings = load_settings(args.settings, args.set)
+    executor = Executor.from_settings(settings)
+    suites = []
+    for path in args.files:
+        with codecs.open(path, "r", encoding="UTF8") as request_file:
+            text = request_file.read()
+        time_start = time.time()
+        try:
+            results, _ = run_pipeline(text, settings, jobs=args.jobs,
+                                      executor=executor,
+                                      directory=os.path.dirname(path))
+        except PipelineError as e:
+            print("%s: %s" % (path, e))
+            return 1
+        elapsed = time.time() - time_start
+        suites.append((path, elapsed, results))
+        if not args.quiet:
+            for result in results:
+                print(result.summary())
+
+    if args.json:
+        write_json(args.json, suites)
+    if args.junit:
+        write_junit(args.junit, suites)
+
+    failed = sum(1 for suite in suites for r in suite[2] if not r.passed)
+    total = sum(len(suite[2]) for suite in suites)
+    print("%d requests, %d failed" % (total, failed))
+    return 1 if failed else 0
+
+
+def import_har_file(args):
+    from .har import HarError
+    from .har import import_har
+    from .har import load_har
+
+    try:
+        text = import_har(load_har(args.file), base_url=args.base_url)
+    except HarError as e:
+        print(e)
+        return 1
+    if args.output:
+        with codecs.open(args.output, "w", encoding="UTF8") as out:
+            out.write(text)
+    else:
+        sys.stdout.write(text)
+    return 0
+
+
+def replay_har_file(args):
+    from .executor import Executor
+    from .har import HarError
+    from .har import export_har
+    from .har import load_har
+    from .har import replay_har
+
+    settings = load_settings(args.settings, args.set)
+
+    def on_result(replayed):
+        if not args.quiet:
+            print(replayed.summary())
+
+    time_start = time.time()
+    try:
+        replayed = replay_har(load_har(args.file), settings,
+                              timing=args.timing, scale=args.scale,
+                              jobs=args.jobs, base_url=args.base_url,
+                              executor=Executor.from_settings(settings),
+                              on_result=on_result)
+    except HarError as e:
+        print(e)
+        return 1
+    elapsed = time.time() - time_start
+
+    if args.json:
+        with codecs.open(args.json, "w", encoding="UTF8") as out:
+            json.dump({"file": args.file, "elapsed": elapsed,
+                       "results": [item.to_dict() for item in replayed]},
+                      out, indent=2)
+    if args.export:
+        with codecs.open(args.export, "w", encoding="UTF8") as out:
+            json.dump(export_har(replayed), out, indent=2)
+
+    results = [item.result for item in replayed]
+    failed = sum(1 for result in results if not result.passed)
+    deltas = [item.delta for item in replayed if item.delta is not None]
+    line = "%d requests, %d failed in %.4f sec." % (len(results), failed,
+                                                   elapsed)
+    if deltas:
+        line += " Mean change vs recorded: %+.4f sec." % \
+            (sum(deltas) / len(deltas))
+    print(line)
+    return 1 if failed else 0
+
+
+def load(args):
+    from .load import LoadError
+    from .load import run_load
+    from .load import run_open_load
+
+    settings = load_settings(args.settings, args.set)
+    with codecs.open(args.file, "r", encoding="UTF8") as request_file:
+        text = request_file.read()
+    try:
+        if args.rate:
+            report = run_open_load(text, settings, args.rate, args.duration,
+                                   max_in_flight=args.max_in_flight,
+                                   processes=args.processes,
+                                   directory=os.path.dirname(args.file))
+        else:
+            report = run_load(text, settings, requests=args.requests,
+                              concurrency=args.concurrency,
+                              processes=args.processes,
+                              directory=os.path.dirname(args.file))
+    except LoadError as e:
+        print("%s: %s" % (args.file, e))
+        return 1
+    for line in report.format():
+        print(line)
+    if args.json:
+        with codecs.open(args.json, "w", encoding="UTF8") as out:
+            json.dump(report.to_dict(), out, indent=2)
+    return 1 if report.stats.failed else 0
+
+
+def _add_settings_arguments(parser):
+    parser.add_argument(
+        "-s", "--settings", action="append", metavar="PATH",
+        help="Settings file to apply over the defaults. May be repeated.")
+    parser.add_argument(
+        "--set", action="append", metavar="NAME=VALUE",
+        help="Override a setting. The value is parsed as JSON.")
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m rester.cli",
+        description="Run RESTer request files outside of Sublime Text.")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    run_parser = subparsers.add_parser(
+        "run", help="Send every ### block of request files.")
+    run_parser.add_argument("files", nargs="+", metavar="FILE")
+    _add_settings_arguments(run_parser)
+    run_parser.add_argument(
+        "-j", "--jobs", type=int, default=4,
+        help="Number of requests to send at the same time.")
+    run_parser.add_argument("--json", metavar="PATH",
+                            help="Write results as JSON.")
+    run_parser.add_argument("--junit", metavar="PATH",
+                            help="Write results as JUnit XML.")
+    run_parser.add_argument("-q", "--quiet", action="store_true",
+                            help="Only print the summary.")
+    run_parser.set_defaults(func=run)
+
+    import_parser = subparsers.add_parser(
+        "import-har", help="Convert the entries of a HAR file to requests.")
+    import_parser.add_argument("file", metavar="FILE")
+    import_parser.add_argument("-o", "--output", metavar="PATH",
+                               help="Write the requests to a file.")
+    import_parser.add_argument(
+        "--base-url", metavar="URL",
+        help="Replace the protocol, host, and port of each URL.")
+    import_parser.set_defaults(func=import_har_file)
+
+    replay_parser = subparsers.add_parser(
+        "replay-har", help="Send the requests of a HAR file again.")
+    replay_parser.add_argument("file", metavar="FILE")
+    _add_settings_arguments(replay_parser)
+    replay_parser.add_argument(
+        "--base-url", metavar="URL",
+        help="Replace the protocol, host, and port of each URL.")
+    replay_parser.add_argument(
+        "--timing", choices=["fast", "original"], default="fast",
+        help="Send as fast as possible, or at the recorded times.")
+    replay_parser.add_argument(
+        "--scale", type=float, default=1.0,
+        help="Multiply the recorded times between requests by this.")
+    replay_parser.add_argument(
+        "-j", "--jobs", type=int, default=4,
+        help="Number of requests to send at the same time.")
+    replay_parser.add_argument("--json", metavar="PATH",
+                               help="Write results as JSON.")
+    replay_parser.add_argument("--export", metavar="PATH",
+                               help="Write results as a HAR file.")
+    replay_parser.add_argument("-q", "--quiet", action="store_true",
+                               help="Only print the summary.")
+    replay_parser.set_defaults(func=replay_har_file)
+
+    load_parser = subparsers.add_parser(
+        "load", help="Send the requests of a file repeatedly from several "
+                     "processes and report throughput and latency.")
+    load_parser.add_argument("file", metavar="FILE")
+    _add_settings_arguments(load_parser)
+    load_parser.add_argument(
+        "-n", "--requests", type=int, default=100,
+        help="Total number of requests to send.")
+    load_parser.add_argument(
+        "-c", "--concurrency", type=int, default=10,
+        help="Total number of requests in flight at once.")
+    load_parser.add_argument(
+        "-r", "--rate", type=float, default=None,
+        help="Send requests at this many per second, whether or not "
+             "earlier ones have completed, instead of --requests.")
+    load_parser.add_argument(
+        "-d", "--duration", type=float, default=10,
+        help="Seconds to send requests for at --rate.")
+    load_parser.add_argument(
+        "--max-in-flight", type=int, default=100,
+        help="With --rate, drop requests due when this many are in "
+             "flight.")
+    load_parser.add_argument(
+        "-p", "--processes", type=int, default=None,
+        help="Number of worker processes. Defaults to the number of CPUs.")
+    load_parser.add_argument("--json", metavar="PATH",
+                             help="Write the report as JSON.")
+    load_parser.set_defaults(func=load)
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,23 @@
 from .auto_form_encode_command import AutoFormEncodeCommand
-from .http_request_command import ResterHttpRequestCommand, ResterHttpResponseCloseEvent
+from .diff_response_command import ResterDiffResponseCommand, ResterSaveBaselineCommand
+from .har_command import ResterImportHarCommand
+from .http_request_command import ResterCancelRequestCommand, ResterClearSessionCommand, ResterHttpDownloadCommand, ResterHttpRequestCommand, ResterHttpResponseCloseEvent
+from .pipeline_command import ResterRunPipelineCommand
+from .response_body_command import ResterResponseBodyCloseEvent, ResterResponseBodyCommand
 from .set_syntax_command import SetSyntaxCommand
 
 __all__ = [
     'AutoFormEncodeCommand',
+    'ResterCancelRequestCommand',
+    'ResterClearSessionCommand',
+    'ResterDiffResponseCommand',
+    'ResterHttpDownloadCommand',
     'ResterHttpRequestCommand',
     'ResterHttpResponseCloseEvent',
+    'ResterImportHarCommand',
+    'ResterResponseBodyCloseEvent',
+    'ResterResponseBodyCommand',
+    'ResterRunPipelineCommand',
+    'ResterSaveBaselineCommand',
     'SetSyntaxCommand'
 ]
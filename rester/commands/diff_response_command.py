@@ -0,0 +1,118 @@
+import os
+import threading
+
+from ..constants import SETTINGS_FILE
+from ..diff import diff_in_background
+from ..diff import get_baseline_path
+from ..diff import get_responses
+from ..diff import load_baseline
+from ..diff import normalize_response
+from ..diff import save_baseline
+import sublime
+import sublime_plugin
+
+DIFF_SYNTAX = "Packages/Diff/Diff.sublime-syntax"
+
+
+def _get_baseline_dir(settings):
+    directory = settings.get("baseline_dir", None)
+    if directory:
+        return os.path.expanduser(directory)
+    try:
+        cache = sublime.cache_path()
+    except AttributeError:
+        # ST2 has no cache path.
+        import tempfile
+        cache = tempfile.gettempdir()
+    return os.path.join(cache, "RESTer", "baselines")
+
+
+class ResterDiffResponseCommand(sublime_plugin.TextCommand):
+    """Compare the latest response to a request with the previous response
+    or the saved baseline, and show the differences in a new view."""
+
+    def run(self, edit, against="previous"):
+        key = self.view.settings().get("rester_response_key")
+        responses = get_responses(key)
+        if not responses:
+            sublime.status_message("RESTer: The response is no longer "
+                                   "available to compare.")
+            return
+
+        settings = sublime.load_settings(SETTINGS_FILE)
+        ignore = settings.get("diff_ignore_headers", [])
+        latest = responses[-1]
+
+        if against == "baseline":
+            directory = _get_baseline_dir(settings)
+            if not os.path.exists(get_baseline_path(directory, key)):
+                sublime.status_message("RESTer: No baseline saved for " +
+                                       key)
+                return
+            from_lines = lambda: load_baseline(directory, key)
+            from_name = "baseline"
+        else:
+            if len(responses) < 2:
+                sublime.status_message("RESTer: No previous response to "
+                                       "compare with.")
+                return
+            previous = responses[0]
+            from_lines = lambda: normalize_response(previous, ignore)
+            from_name = "previous"
+
+        window = self.view.window()
+        sublime.status_message("RESTer: Comparing responses...")
+
+        def on_diff(lines):
+            sublime.set_timeout(lambda: self._show_diff(window, key, lines),
+                                0)
+
+        diff_in_background(from_lines,
+                           lambda: normalize_response(latest, ignore),
+                           on_diff, from_name=from_name, to_name="current",
+                           context=settings.get("diff_context", 3))
+
+    def is_enabled(self):
+        return bool(self.view.settings().get("rester_response_key"))
+
+    def _show_diff(self, window, key, lines):
+        if not lines:
+            sublime.status_message("RESTer: No differences.")
+            return
+        view = window.new_file()
+        view.set_name("Diff: " + key)
+        view.set_scratch(True)
+        view.set_syntax_file(DIFF_SYNTAX)
+        view.run_command("append", {"characters": "\n".join(lines) + "\n"})
+        view.set_read_only(True)
+
+
+class ResterSaveBaselineCommand(sublime_plugin.TextCommand):
+    """Save the latest response to a request as its baseline."""
+
+    def run(self, edit):
+        key = self.view.settings().get("rester_response_key")
+        responses = get_responses(key)
+        if not responses:
+            sublime.status_message("RESTer: The response is no longer "
+                                   "available to save.")
+            return
+
+        settings = sublime.load_settings(SETTINGS_FILE)
+        ignore = settings.get("diff_ignore_headers", [])
+        directory = _get_baseline_dir(settings)
+        response = responses[-1]
+
+        def save():
+            save_baseline(directory, key,
+                          normalize_response(response, ignore))
+            sublime.set_timeout(lambda: sublime.status_message(
+                "RESTer: Saved baseline for " + key), 0)
+
+        # Normalizing a large body can take a while.
+        thread = threading.Thread(target=save)
+        thread.daemon = True
+        thread.start()
+
+    def is_enabled(self):
+        return bool(self.view.settings().get("rester_response_key"))
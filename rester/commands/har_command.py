@@ -0,0 +1,37 @@
+import os
+
+from ..constants import SYNTAX_FILE
+import sublime
+import sublime_plugin
+
+
+class ResterImportHarCommand(sublime_plugin.WindowCommand):
+    """Prompt for a HAR file and open its entries as a request file."""
+
+    def run(self, path=None, base_url=None):
+        if path:
+            self._import(path, base_url)
+            return
+
+        def on_done(path):
+            if path:
+                self._import(os.path.expanduser(path.strip()), base_url)
+        self.window.show_input_panel("Import HAR file:", "", on_done, None,
+                                     None)
+
+    def _import(self, path, base_url):
+        # Import here: har imports the HTTP clients, which are loaded only
+        # when they are first used.
+        from ..har import HarError
+        from ..har import import_har
+        from ..har import load_har
+
+        try:
+            text = import_har(load_har(path), base_url=base_url)
+        except HarError as e:
+            sublime.error_message("RESTer: " + str(e))
+            return
+        view = self.window.new_file()
+        view.set_name(os.path.splitext(os.path.basename(path))[0] + ".http")
+        view.set_syntax_file(SYNTAX_FILE)
+        view.run_command("append", {"characters": text})
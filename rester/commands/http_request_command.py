@@ -1,35 +1,66 @@
-import codecs
-import hashlib
-import json
 import os
-import re
-import tempfile
 import time
 
-from ..constants import SETTINGS_FILE, SYNTAX_FILE
-from ..http import CurlRequestThread
-from ..http import HttpClientRequestThread
-from ..message import Request
+from ..constants import MAX_REDIRECTS, SETTINGS_FILE, SYNTAX_FILE
+from ..diff import get_response_key
+from ..diff import record_response
+from ..executor import RetryPolicy
 from ..overrideable import OverrideableSettings
+from ..overrideable import SettingsSnapshot
+from ..parse import RE_VARIABLE
 from ..parse import RequestParser
+from ..parse import extract_variables
+from ..parse import get_redirect_request
+from ..parse import merge_variables
+from ..parse import parse_overrides
+from ..trace import Trace
+from .response_body_command import show_body_actions
 from ..util import get_end_of_line_character
+from ..util import format_size
 from ..util import normalize_line_endings
 import sublime
 import sublime_plugin
 
-try:
-    from urllib.parse import parse_qs
-    from urllib.parse import urljoin
-    from urllib.parse import urlparse
-except ImportError:
-    # Python 2
-    from urlparse import parse_qs
-    from urlparse import urlparse
-    from urlparse import urljoin
-
-MAX_REDIRECTS = 10
 MAX_GROUPS = 10
-RE_OVERRIDE = """^\s*@\s*([^\:]*)\s*:\s*(.*)$"""
+MAX_CACHED_SETTINGS = 64
+
+# Snapshot of the package settings, and settings with overrides applied,
+# keyed by the header section of the request they were parsed from.
+_settings_snapshot = None
+_settings_cache = {}
+
+# Request threads in flight, keyed by window id, so they can be cancelled.
+_active_threads = {}
+
+# Values captured from responses with @capture, keyed by window id.
+_captured_variables = {}
+
+
+def _get_settings_snapshot():
+    global _settings_snapshot
+    if _settings_snapshot is None:
+        _settings_snapshot = SettingsSnapshot(
+            sublime.load_settings(SETTINGS_FILE))
+    return _settings_snapshot
+
+
+def get_captured_variables(window):
+    """Return the dict of values captured from responses in the window."""
+    return _captured_variables.setdefault(window.id(), {})
+
+
+def get_package_settings():
+    """Return settings-like access to the package settings, with no
+    request overrides."""
+    return OverrideableSettings(settings=_get_settings_snapshot())
+
+
+def _cancel_threads(window, message="Request cancelled."):
+    # Cancel every request in flight in the window. Return the number.
+    threads = _active_threads.pop(window.id(), set())
+    for thread in threads:
+        thread.cancel(message)
+    return len(threads)
 
 
 def _normalize_command(command):
@@ -82,8 +113,18 @@ class ResterHttpRequestCommand(sublime_plugin.WindowCommand):
         self._requesting = False
         self._request_view_group = None
         self._request_view_index = None
+        self._trace = None
+        self._thread = None
+        self._attempt = 1
+        self._response_key = None
+        self._captures = []
+
+    def run(self, pos=None, download=None):
+        # A new request replaces any still in flight in this window.
+        _cancel_threads(self.window, "Request replaced by a new request.")
+        self._thread = None
+        self._trace = Trace()
 
-    def run(self, pos=None):
         # Store references.
         self.request_view = self.window.active_view()
         self._request_view_group, self._request_view_index = \
@@ -91,8 +132,15 @@ class ResterHttpRequestCommand(sublime_plugin.WindowCommand):
         self.response_view = None
         self.eol = get_end_of_line_character(self.request_view)
         self.settings = self._get_settings()
+        download = download or self.settings.get("download", None)
+        if download:
+            self.settings = OverrideableSettings(
+                settings=self.settings,
+                overrides={"download": self._get_file_path(download)})
+        self._trace.mark("settings")
         self._completed_message = "Done."
         self._redirect_count = 0
+        self._attempt = 1
         self._requesting = False
 
         # Determine the encoding of the editor starting the request.
@@ -125,30 +173,40 @@ class ResterHttpRequestCommand(sublime_plugin.WindowCommand):
         if text != originalText:
             for i in range(changes):
                 self.request_view.run_command("undo")
+        self._trace.mark("request_commands")
 
-        def replace(m):
-            return variables.get(m.group(1), '')
         view = self.request_view
         extractions = []
-        view.find_all(r'(?:(#)\s*)?@([_a-zA-Z][_a-zA-Z0-9]*)\s*=\s*(.*)', 0, r'\1\2=\3', extractions)
+        view.find_all(RE_VARIABLE, 0, r'\1\2=\3', extractions)
         variables = {}
         for var in extractions:
             var, _, val = var.partition('=')
             if var[0] != '#':
                 variables[var] = val.strip()
-        for var in re.findall(r'(?:(#)\s*)?@([_a-zA-Z][_a-zA-Z0-9]*)\s*=\s*(.*)', originalText):
-            if var[0] != '#':
-                var, val = var[1], var[2]
-                variables[var] = val.strip()
-        text = re.sub(r'\{\{\s*([_a-zA-Z][_a-zA-Z0-9]*)\s*\}\}', replace, text)
+        extract_variables(originalText, variables)
+        variables.update(get_captured_variables(self.window))
+        text = merge_variables(text, variables)
+        self._trace.mark("variables")
+
+        # Captures are applied when the response arrives. The pipeline
+        # module is imported here because it imports the HTTP clients.
+        from ..pipeline import parse_captures
+        self._captures = parse_captures(
+            normalize_line_endings(originalText, self.eol), self.eol)
 
         # Build a message.Request from the text.
         request_parser = RequestParser(self.settings, self.eol)
         request = request_parser.get_request(text)
+        if request.body_file:
+            request.body_file = self._get_file_path(request.body_file)
+        self._trace.name = request.request_line
+        self._trace.mark("parse")
 
         # Set the state to requesting.
         self._requesting = True
 
+        import hashlib
+
         # Create a new hash for this specific run of the command.
         command_hash = hashlib.sha1()
         command_hash.update(str(time.time()).encode("ascii"))
@@ -177,6 +235,12 @@ class ResterHttpRequestCommand(sublime_plugin.WindowCommand):
                 direction = 1
             i += direction
             message = "RESTer [%s=%s]" % (" " * before, " " * after)
+            if self._thread and self.settings.get("download", None):
+                downloaded, total = self._thread.get_download_progress()
+                message += " Downloading " + format_size(downloaded)
+                if total:
+                    message += " of %s (%d%%)" % (format_size(total),
+                                                  downloaded * 100 / total)
             self.request_view.set_status("rester", message)
             fn = lambda: self.check_if_requesting(command_hash, i, direction)
             sublime.set_timeout(fn, 100)
@@ -185,16 +249,22 @@ class ResterHttpRequestCommand(sublime_plugin.WindowCommand):
                 self._completed_message = "Done."
             self.request_view.set_status("rester", self._completed_message)
 
-    def handle_response_view(self, filepath, title, body_only):
+    def handle_response_view(self, filepath, title, body_only,
+                             response=None):
         if self.response_view.is_loading():
             fn = lambda: self.handle_response_view(filepath, title,
-                                                   body_only)
+                                                   body_only, response)
             sublime.set_timeout(fn, 100)
 
         else:
+            self._mark("view_load")
             view = self.response_view
             view.set_scratch(self.settings.get("response_scratch", True))
             view.set_name(title)
+            if self._response_key:
+                # Let the diff commands find the responses to this request.
+                view.settings().set("rester_response_key",
+                                    self._response_key)
 
             # Delete the temp file.
             os.remove(filepath)
@@ -213,8 +283,14 @@ class ResterHttpRequestCommand(sublime_plugin.WindowCommand):
                 view.sel().clear()
                 view.sel().add(selection)
 
-            # Run response commands and finish.
-            self._run_response_commands()
+            # Run response commands and finish. Large responses show only a
+            # preview, so leave them as they are and offer to load the rest.
+            # Binary responses show a summary, which commands do not apply to.
+            if response is not None and response.truncated:
+                show_body_actions(view, response)
+            elif response is None or not response.binary:
+                self._run_response_commands()
+            self._mark("response_commands")
             self._complete("Request complete. " + title)
 
             # Close all views in the response group other than the current
@@ -234,9 +310,31 @@ class ResterHttpRequestCommand(sublime_plugin.WindowCommand):
                 self.window.focus_view(self.request_view)
 
     def handle_thread(self, thread):
-        if thread.is_alive():
+        if thread is not self._thread:
+            # Stale: a newer request replaced this one.
+            return
+        if thread.is_alive() and not thread.cancelled:
             # Working...
             sublime.set_timeout(lambda: self.handle_thread(thread), 100)
+            return
+
+        # Send again after a failure or status the retry settings allow.
+        # The thread stays registered while waiting, so it can be cancelled.
+        delay = RetryPolicy.from_settings(self.settings).get_delay(
+            self._attempt, thread)
+        if delay is not None:
+            self._retry(thread, delay)
+            return
+        self._attempt = 1
+
+        threads = _active_threads.get(self.window.id())
+        if threads:
+            threads.discard(thread)
+
+        if thread.cancelled:
+            # Do not wait for a cancelled thread to wind down.
+            self._thread = None
+            self._complete(thread.cancel_message)
         elif thread.success:
             # Success.
             self._complete_thread(thread)
@@ -247,10 +345,41 @@ class ResterHttpRequestCommand(sublime_plugin.WindowCommand):
             else:
                 self._complete("Unable to make request.")
 
+    def _retry(self, thread, delay):
+        if thread.success:
+            reason = thread.response.status_line
+        else:
+            reason = thread.message
+        print("\n%s Retrying in %.2f sec. (attempt %d)" % (
+            reason, delay, self._attempt + 1))
+        self._attempt += 1
+
+        def retry():
+            # Skip if the request was replaced while waiting.
+            if thread is not self._thread:
+                return
+            threads = _active_threads.get(self.window.id())
+            if threads:
+                threads.discard(thread)
+            if thread.cancelled:
+                self._complete(thread.cancel_message)
+                return
+            self._mark("retry_wait")
+            self._start_request(thread.request)
+        sublime.set_timeout(retry, int(delay * 1000))
+
+    def _mark(self, name):
+        # Mark a step of the trace, unless the command already completed.
+        if self._trace:
+            self._trace.mark(name)
+
     def _complete(self, message):
         # End the command and display a message.
         self._requesting = False
         self._completed_message = message
+        if self._trace:
+            self._trace.emit(self.settings)
+            self._trace = None
 
     def _complete_thread(self, thread):
         response = thread.response
@@ -265,6 +394,10 @@ class ResterHttpRequestCommand(sublime_plugin.WindowCommand):
 
             if thread.elapsed:
                 print("\nResponse time:", thread.elapsed)
+            if thread.tls_resumed is not None:
+                print("TLS handshake:",
+                      "resumed" if thread.tls_resumed else "full",
+                      thread.tls_handshake_elapsed)
 
             print("\n[Response]")
 
@@ -276,11 +409,35 @@ class ResterHttpRequestCommand(sublime_plugin.WindowCommand):
                 print("")
 
             if output_body:
+                body = response.body
+                limit = self.settings.get("console_preview_size", None)
+                if limit and len(body) > limit:
+                    body = body[:limit]
                 try:
-                    print(response.body)
+                    print(body)
                 except UnicodeEncodeError:
                     # Python 2
-                    print(response.body.encode("UTF8"))
+                    print(body.encode("UTF8"))
+                if body is not response.body or response.truncated:
+                    print("\n[Body truncated. %d bytes total.%s]" % (
+                        response.body_size or len(response.body),
+                        " Full body: " + response.body_file
+                        if response.body_file else ""))
+
+        # Report the pages combined into the response.
+        if self.settings.get("paginate", None):
+            print("Combined %d pages, %d items in %.4f sec." % (
+                thread.pages, thread.items, thread.elapsed))
+
+        # Report what the filter kept.
+        if response.filter_error:
+            print(response.filter_error)
+        elif response.filter:
+            print("Filtered with %s: %s to %s in %.4f sec." % (
+                response.filter, format_size(response.unfiltered_size),
+                format_size(len(response.body.encode("UTF8"))),
+                response.filter_elapsed))
+        self._mark("console_output")
 
         # Redirect.
         follow = self.settings.get("follow_redirects", True)
@@ -289,11 +446,42 @@ class ResterHttpRequestCommand(sublime_plugin.WindowCommand):
             self._follow_redirect(response, thread.request)
             return
 
+        # Remember the response to compare with the next one.
+        self._response_key = get_response_key(thread.request)
+        record_response(self._response_key, response)
+
+        # Store values captured from the response for later requests.
+        if self._captures:
+            from ..pipeline import capture_value
+            captured = get_captured_variables(self.window)
+            for name, expression in self._captures:
+                value = capture_value(response, expression)
+                if value is None:
+                    print("Unable to capture %s from %s" % (name, expression))
+                else:
+                    captured[name] = value
+                    print("Captured %s = %s" % (name, value))
+
+        # Downloads are not opened in a view.
+        if response.download_file:
+            message = "Downloaded %s to %s" % (
+                format_size(response.body_size), response.download_file)
+            if thread.elapsed:
+                message += " in %.4f sec. (%s/s)" % (
+                    thread.elapsed,
+                    format_size(response.body_size / thread.elapsed))
+            print(message)
+            self._complete(status_line + ". " + message)
+            return
+
         # Stop now if the user does not want a response buffer.
         if not self.settings.get("response_buffer", True):
             self._complete("Request complete. " + status_line)
             return
 
+        import codecs
+        import tempfile
+
         # Open a temporary file to write the response to.
         # (Note: Using codecs to support Python 2.6)
         tmpfile = tempfile.NamedTemporaryFile("w", delete=False)
@@ -330,6 +518,7 @@ class ResterHttpRequestCommand(sublime_plugin.WindowCommand):
         # Close the file.
         tmpfile.close()
         filepath = tmpfile.name
+        self._mark("temp_file")
 
         # Open the file in a new view.
         title = status_line
@@ -349,7 +538,20 @@ class ResterHttpRequestCommand(sublime_plugin.WindowCommand):
             if not self.settings.get("request_focus", False):
                 # Set the focus to the response group.
                 self.window.focus_group(response_group)
-        self.handle_response_view(tmpfile.name, title, body_only)
+        self.handle_response_view(tmpfile.name, title, body_only, response)
+
+    def _get_file_path(self, path):
+        # Resolve a relative path from the request file's directory,
+        # or the home directory if the request is not saved.
+        path = os.path.expanduser(path)
+        if not os.path.isabs(path):
+            filename = self.request_view.file_name()
+            if filename:
+                directory = os.path.dirname(filename)
+            else:
+                directory = os.path.expanduser("~")
+            path = os.path.join(directory, path)
+        return path
 
     def _get_selection(self, pos=None):
         # Return a string of the selected text or the entire buffer.
@@ -386,19 +588,22 @@ class ResterHttpRequestCommand(sublime_plugin.WindowCommand):
 
         headers = text.split(self.eol * 2, 1)[0]
 
+        # Reuse the settings built for the same headers, as long as the
+        # package settings have not changed since.
+        snapshot = _get_settings_snapshot()
+        cached = _settings_cache.get(headers)
+        if cached and cached[0] == snapshot.generation:
+            return cached[1]
+
         # Build a dictionary of the overrides.
-        overrides = {}
-        for (name, value) in re.findall(RE_OVERRIDE, headers, re.MULTILINE):
-            try:
-                overrides[name] = json.loads(value)
-            except ValueError:
-                # If unable to parse as JSON, assume it's an un-quoted string.
-                overrides[name] = value
+        overrides = parse_overrides(headers)
 
         # Return an OverrideableSettings object.
-        return OverrideableSettings(
-            settings=sublime.load_settings(SETTINGS_FILE),
-            overrides=overrides)
+        settings = OverrideableSettings(settings=snapshot, overrides=overrides)
+        if len(_settings_cache) >= MAX_CACHED_SETTINGS:
+            _settings_cache.clear()
+        _settings_cache[headers] = (snapshot.generation, settings)
+        return settings
 
     def _follow_redirect(self, response, request):
         # Stop now in the event of an infinite loop.
@@ -414,33 +619,9 @@ class ResterHttpRequestCommand(sublime_plugin.WindowCommand):
             self._complete("Unable to redirect. No Location header found.")
             return
 
-        # Create a new request instance.
-        redirect = Request()
-
-        # Use GET unless the original request was HEAD.
-        if request.method == "HEAD":
-            redirect.method = "HEAD"
-
-        # Parse the Location URI
-        uri = urlparse(location)
-
-        if uri.netloc:
-            # If there is a netloc, it's an absolute path.
-            redirect.host = uri.netloc
-            if uri.scheme:
-                redirect.protocol = uri.scheme
-            if uri.path:
-                redirect.path = uri.path
-
-        elif uri.path:
-            # If no netloc, but there is a path, resolve from last.
-            redirect.host = request.host
-            redirect.path = urljoin(request.path, uri.path)
-
-        # Always add the query.
-        if uri.query:
-            redirect.query += parse_qs(uri.query)
+        redirect = get_redirect_request(request, location)
 
+        self._mark("redirect")
         print("\n[...redirecting...]")
         self._redirect_count += 1
         self._start_request(redirect)
@@ -465,13 +646,21 @@ class ResterHttpRequestCommand(sublime_plugin.WindowCommand):
 
     def _start_request(self, request):
         # Create, start, and handle a thread for the selection.
+        # The HTTP clients are imported here so that loading the plugin does
+        # not import them for sessions that never send a request.
+        from ..http import get_http_client_names
+        from ..http import get_request_thread_class
+
         if self.settings.get("output_request", True):
             print("\n[Request]")
             print(request.request_line)
             print("Host: %s" % request.host)
             for header in request.header_lines:
                 print(header)
-            if request.body:
+            if request.body_file:
+                print("")
+                print("< " + request.body_file)
+            elif request.body:
                 print("")
                 try:
                     print(request.body)
@@ -480,21 +669,58 @@ class ResterHttpRequestCommand(sublime_plugin.WindowCommand):
                     print(request.body.encode("UTF8"))
 
         client = self.settings.get("http_client", "python")
-        if client == "python":
-            thread_class = HttpClientRequestThread
-        elif client == "curl":
-            thread_class = CurlRequestThread
-        else:
-            message = "Invalid request_client. "
-            message += "Must be 'python' or 'curl'. Found " + client
+        thread_class = get_request_thread_class(client)
+        if thread_class is None:
+            message = "Invalid http_client. "
+            message += "Must be %s. Found %s" % (get_http_client_names(),
+                                                 client)
             self._complete(message)
             return
-
-        thread = thread_class(request, self.settings, encoding=self.encoding)
+        if self.settings.get("paginate", None):
+            # Send the pages from one thread that combines them.
+            from ..paginate import PaginationThread
+            thread_class = PaginationThread
+
+        thread = thread_class(request, self.settings, encoding=self.encoding,
+                              trace=self._trace, decode=True)
+        self._thread = thread
+        _active_threads.setdefault(self.window.id(), set()).add(thread)
         thread.start()
         self.handle_thread(thread)
 
 
+class ResterCancelRequestCommand(sublime_plugin.WindowCommand):
+    """Cancel the requests in flight in this window."""
+
+    def run(self):
+        if not _cancel_threads(self.window):
+            sublime.status_message("RESTer: No request to cancel.")
+
+    def is_enabled(self):
+        return bool(_active_threads.get(self.window.id()))
+
+
+class ResterClearSessionCommand(sublime_plugin.WindowCommand):
+    """Forget the saved cookies and cached OAuth2 tokens."""
+
+    def run(self):
+        from ..session import clear_sessions
+        clear_sessions()
+        sublime.status_message("RESTer: Cleared cookies and tokens.")
+
+
+class ResterHttpDownloadCommand(sublime_plugin.WindowCommand):
+    """Prompt for a file and send the request, saving the body to it."""
+
+    def run(self, pos=None):
+        def on_done(path):
+            if path:
+                self.window.run_command("rester_http_request",
+                                        {"pos": pos, "download": path})
+        self.window.show_input_panel("Save response body to:", "", on_done,
+                                     None, None)
+
+
 class ResterHttpResponseCloseEvent(sublime_plugin.ViewEventListener):
     @classmethod
     def is_applicable(cls, settings):
@@ -0,0 +1,93 @@
+import os
+import threading
+
+from .http_request_command import get_captured_variables
+from .http_request_command import get_package_settings
+import sublime
+import sublime_plugin
+
+
+class ResterRunPipelineCommand(sublime_plugin.WindowCommand):
+    """Send every request in the view as a pipeline, passing captured values
+    to the requests that use them, and show a report."""
+
+    def __init__(self, *args, **kwargs):
+        sublime_plugin.WindowCommand.__init__(self, *args, **kwargs)
+        self._running = False
+
+    def run(self):
+        view = self.window.active_view()
+        text = view.substr(sublime.Region(0, view.size()))
+        filename = view.file_name()
+        directory = os.path.dirname(filename) if filename else None
+        encoding = view.encoding()
+        if not encoding or encoding == "Undefined":
+            encoding = "UTF-8"
+
+        settings = get_package_settings()
+        variables = dict(get_captured_variables(self.window))
+        counts = {"done": 0}
+        self._running = True
+
+        def on_result(result):
+            counts["done"] += 1
+            message = "RESTer pipeline: %d done. %s" % (counts["done"],
+                                                        result.summary())
+            sublime.set_timeout(lambda: view.set_status("rester", message),
+                                0)
+
+        def run_pipeline_thread():
+            # The clients are imported here, off the main thread, so that
+            # loading the plugin does not import them.
+            from ..executor import Executor
+            from ..pipeline import PipelineError
+            from ..pipeline import run_pipeline
+            try:
+                results, captured = run_pipeline(
+                    text, settings, jobs=settings.get("pipeline_jobs", 4),
+                    encoding=encoding,
+                    executor=Executor.from_settings(settings),
+                    directory=directory, variables=variables,
+                    on_result=on_result)
+            except PipelineError as e:
+                results, captured, error = [], variables, str(e)
+            else:
+                error = None
+            sublime.set_timeout(
+                lambda: self._complete(view, results, captured, error), 0)
+
+        thread = threading.Thread(target=run_pipeline_thread)
+        thread.daemon = True
+        thread.start()
+
+    def is_enabled(self):
+        return not self._running and self.window.active_view() is not None
+
+    def _complete(self, view, results, captured, error):
+        self._running = False
+        if error:
+            view.set_status("rester", error)
+            return
+
+        failed = sum(1 for result in results if not result.passed)
+        lines = [result.summary() for result in results]
+        lines.append("")
+        lines.append("%d requests, %d failed" % (len(results), failed))
+
+        # Keep the captured values for requests sent later.
+        names = sorted(set(name for result in results
+                           for name, value in result.captured.items()
+                           if value is not None))
+        if names:
+            lines.append("")
+            lines.append("Captured:")
+            for name in names:
+                lines.append("    %s = %s" % (name, captured[name]))
+                get_captured_variables(self.window)[name] = captured[name]
+        view.set_status("rester", "RESTer pipeline: %d requests, %d failed" %
+                        (len(results), failed))
+
+        report = self.window.new_file()
+        report.set_name("RESTer Pipeline")
+        report.set_scratch(True)
+        report.run_command("append", {"characters": "\n".join(lines) + "\n"})
@@ -0,0 +1,115 @@
+import os
+
+from ..constants import SETTINGS_FILE
+from ..util import get_end_of_line_character
+from ..util import normalize_line_endings
+from ..util import trim_partial_character
+import sublime
+import sublime_plugin
+
+PLAIN_TEXT_SYNTAX = "Packages/Text/Plain text.tmLanguage"
+
+_phantom_sets = {}
+
+
+def show_body_actions(view, response):
+    """Remember the spooled body of a truncated response in its view and
+    show links to load more of it or open the raw file."""
+    settings = view.settings()
+    settings.set("rester_body_file", response.body_file)
+    settings.set("rester_body_offset", response.body_preview_size)
+    settings.set("rester_body_size", response.body_size)
+    settings.set("rester_body_encoding", response.encoding)
+    _update_body_actions(view)
+
+
+def _update_body_actions(view):
+    phantom_set = _phantom_sets.get(view.id())
+    if phantom_set is None:
+        phantom_set = sublime.PhantomSet(view, "rester_body")
+        _phantom_sets[view.id()] = phantom_set
+
+    settings = view.settings()
+    offset = settings.get("rester_body_offset", 0)
+    size = settings.get("rester_body_size", 0)
+    links = ['<a href="raw">Open raw file</a>']
+    if offset < size:
+        links.insert(0, '<a href="more">Load more</a>')
+    html = '<style>a{color:#999}</style><small>%d of %d bytes shown. ' \
+           '%s</small>' % (offset, size, " &nbsp; ".join(links))
+
+    def navigate(href):
+        view.run_command("rester_response_body", {"action": href})
+
+    phantom_set.update([sublime.Phantom(sublime.Region(view.size()), html,
+                                        sublime.LAYOUT_BLOCK, navigate)])
+
+
+class ResterResponseBodyCommand(sublime_plugin.TextCommand):
+    """Load more of a truncated response, or open its raw body file."""
+
+    def run(self, edit, action="more"):
+        body_file = self.view.settings().get("rester_body_file")
+        if not body_file or not os.path.exists(body_file):
+            sublime.status_message("The response body is no longer available.")
+            return
+        if action == "raw":
+            self._open_raw(body_file)
+        else:
+            self._load_more(edit, body_file)
+
+    def is_enabled(self):
+        return bool(self.view.settings().get("rester_body_file"))
+
+    def _load_more(self, edit, body_file):
+        settings = self.view.settings()
+        offset = settings.get("rester_body_offset", 0)
+        size = sublime.load_settings(SETTINGS_FILE).get(
+            "response_preview_size", 262144)
+        encoding = settings.get("rester_body_encoding") or "utf-8"
+
+        with open(body_file, "rb") as f:
+            f.seek(offset)
+            chunk = f.read(size)
+        if len(chunk) == size:
+            chunk = trim_partial_character(chunk)
+
+        text = chunk.decode(encoding, "replace")
+        text = normalize_line_endings(text,
+                                      get_end_of_line_character(self.view))
+        self.view.insert(edit, self.view.size(), text)
+        settings.set("rester_body_offset", offset + len(chunk))
+        _update_body_actions(self.view)
+
+    def _open_raw(self, body_file):
+        # Open the file as plain text so it is not highlighted.
+        window = self.view.window()
+        view = window.open_file(body_file)
+        view.set_syntax_file(PLAIN_TEXT_SYNTAX)
+        view.set_read_only(True)
+        view.settings().set("rester_raw_body_file", body_file)
+
+
+def _uses_body_file(view, body_file):
+    settings = view.settings()
+    return body_file in (settings.get("rester_body_file"),
+                         settings.get("rester_raw_body_file"))
+
+
+class ResterResponseBodyCloseEvent(sublime_plugin.EventListener):
+    """Delete the spooled body of a truncated response once neither its
+    response view nor the view of its raw file is open."""
+
+    def on_close(self, view):
+        _phantom_sets.pop(view.id(), None)
+        settings = view.settings()
+        body_file = settings.get("rester_body_file") or \
+            settings.get("rester_raw_body_file")
+        if not body_file or not os.path.exists(body_file):
+            return
+        for window in sublime.windows():
+            for other in window.views():
+                if other.id() != view.id() and \
+                        _uses_body_file(other, body_file):
+                    return
+        os.remove(body_file)
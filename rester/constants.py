@@ -1,2 +1,3 @@
 SETTINGS_FILE = "RESTer.sublime-settings"
 SYNTAX_FILE = "Packages/RESTer HTTP Client/http.tmLanguage"
+MAX_REDIRECTS = 10
@@ -0,0 +1,382 @@
+"""
+Comparing responses with each other and with saved baselines
+
+Responses are normalized to lines before comparing: headers are sorted and
+volatile ones dropped, and JSON bodies are re-serialized with sorted keys so
+formatting and key order do not show up as changes.
+"""
+
+import bisect
+import json
+import os
+import threading
+
+from collections import OrderedDict
+
+MAX_HISTORY = 32
+
+# Past this many edits between two anchors, stop searching for a minimal
+# diff and split the lines at the furthest point reached. Time grows with
+# the lines compared times this.
+MAX_EDITS = 512
+
+# The two most recent responses for each request, oldest first.
+_history = OrderedDict()
+_history_lock = threading.Lock()
+
+
+def get_response_key(request):
+    """Return the key that identifies responses to the same request."""
+    return "%s %s" % (request.method, request.uri)
+
+
+def record_response(key, response):
+    """Remember response as the latest for key."""
+    with _history_lock:
+        responses = _history.pop(key, [])
+        _history[key] = (responses + [response])[-2:]
+        while len(_history) > MAX_HISTORY:
+            _history.popitem(last=False)
+
+
+def get_responses(key):
+    """Return a list of the previous and latest responses for key."""
+    with _history_lock:
+        return list(_history.get(key, []))
+
+
+def normalize_response(response, ignore_headers=()):
+    """Return a list of lines representing response for comparison."""
+    ignore = set(header.lower() for header in ignore_headers)
+    lines = [response.status_line]
+    headers = [(key.lower(), value) for key, value in response.headers
+               if key.lower() not in ignore]
+    lines.extend("%s: %s" % header for header in sorted(headers))
+    lines.append("")
+    lines.extend(normalize_body(response.body or ""))
+    return lines
+
+
+def normalize_body(body):
+    """Return a list of lines of body, pretty printing JSON."""
+    stripped = body.strip()
+    if stripped[:1] in ("{", "["):
+        try:
+            data = json.loads(stripped)
+        except ValueError:
+            pass
+        else:
+            body = json.dumps(data, indent=2, sort_keys=True,
+                              ensure_ascii=False)
+    return body.splitlines()
+
+
+def get_opcodes(a, b):
+    """Return a list of (tag, i1, i2, j1, j2) changes from lines a to b.
+
+    tag is "equal", "delete", "insert", or "replace", as in difflib. After
+    trimming the common prefix and suffix, lines that occur once in each
+    of a and b anchor the diff, as in patience diff, and Myers' algorithm
+    compares the lines between anchors. Similar multi-megabyte bodies are
+    split into small pieces and diff quickly.
+    """
+    prefix = 0
+    limit = min(len(a), len(b))
+    while prefix < limit and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    limit -= prefix
+    while suffix < limit and a[-1 - suffix] == b[-1 - suffix]:
+        suffix += 1
+
+    # Compare lines as integers.
+    ids = {}
+    a_ids = [ids.setdefault(line, len(ids))
+             for line in a[prefix:len(a) - suffix]]
+    b_ids = [ids.setdefault(line, len(ids))
+             for line in b[prefix:len(b) - suffix]]
+
+    opcodes = []
+    _add_opcode(opcodes, "equal", 0, prefix, 0, prefix)
+    i = j = 0
+    for anchor_i, anchor_j in _get_anchors(a_ids, b_ids):
+        _myers(a_ids, b_ids, (i, anchor_i, j, anchor_j), prefix, opcodes)
+        line_i, line_j = anchor_i + prefix, anchor_j + prefix
+        _add_opcode(opcodes, "equal", line_i, line_i + 1, line_j, line_j + 1)
+        i, j = anchor_i + 1, anchor_j + 1
+    _myers(a_ids, b_ids, (i, len(a_ids), j, len(b_ids)), prefix, opcodes)
+    _add_opcode(opcodes, "equal", len(a) - suffix, len(a),
+                len(b) - suffix, len(b))
+    return opcodes
+
+
+def _get_anchors(a, b):
+    # Return the longest increasing list of (i, j) where a[i] == b[j] and
+    # the line occurs once in a and once in b.
+    # The index of each line in a, or -1 if it occurs more than once.
+    a_index = {}
+    for i, line in enumerate(a):
+        a_index[line] = -1 if line in a_index else i
+    b_index = {}
+    for j, line in enumerate(b):
+        if a_index.get(line, -1) >= 0:
+            b_index[line] = -1 if line in b_index else j
+    pairs = sorted((a_index[line], j) for line, j in b_index.items()
+                   if j >= 0)
+
+    # Patience sorting: tails[n] is the index in pairs of the smallest j
+    # ending an increasing run of n + 1 pairs.
+    tails = []
+    tail_js = []
+    previous = [None] * len(pairs)
+    for index, (_, j) in enumerate(pairs):
+        n = bisect.bisect_left(tail_js, j)
+        previous[index] = tails[n - 1] if n else None
+        if n == len(tails):
+            tails.append(index)
+            tail_js.append(j)
+        else:
+            tails[n] = index
+            tail_js[n] = j
+    anchors = []
+    index = tails[-1] if tails else None
+    while index is not None:
+        anchors.append(pairs[index])
+        index = previous[index]
+    anchors.reverse()
+    return anchors
+
+
+def _myers(a, b, bounds, shift, opcodes):
+    # Add opcodes for the shortest edit script from a[a_lo:a_hi] to
+    # b[b_lo:b_hi], with indexes moved by shift. This is the linear space
+    # variant of Myers' algorithm: find the middle of a shortest path, then
+    # solve the two halves on either side of it.
+    stack = [bounds]
+    while stack:
+        item = stack.pop()
+        if isinstance(item[0], str):
+            _add_opcode(opcodes, *item)
+            continue
+        a_lo, a_hi, b_lo, b_hi = item
+        start = a_lo
+        while a_lo < a_hi and b_lo < b_hi and a[a_lo] == b[b_lo]:
+            a_lo += 1
+            b_lo += 1
+        _add_opcode(opcodes, "equal", start + shift, a_lo + shift,
+                    b_lo - (a_lo - start) + shift, b_lo + shift)
+        end = a_hi
+        while a_lo < a_hi and b_lo < b_hi and a[a_hi - 1] == b[b_hi - 1]:
+            a_hi -= 1
+            b_hi -= 1
+        # The stack is last in, first out, so push in reverse order.
+        stack.append(("equal", a_hi + shift, end + shift,
+                      b_hi + shift, b_hi + (end - a_hi) + shift))
+        if a_lo == a_hi or b_lo == b_hi:
+            stack.append(("delete" if b_lo == b_hi else "insert",
+                          a_lo + shift, a_hi + shift,
+                          b_lo + shift, b_hi + shift))
+        elif not set(a[a_lo:a_hi]).intersection(b[b_lo:b_hi]):
+            stack.append(("replace", a_lo + shift, a_hi + shift,
+                          b_lo + shift, b_hi + shift))
+        else:
+            x, y = _middle_snake(a[a_lo:a_hi], b[b_lo:b_hi])
+            stack.append((a_lo + x, a_hi, b_lo + y, b_hi))
+            stack.append((a_lo, a_lo + x, b_lo, b_lo + y))
+
+
+def _middle_snake(a, b):
+    # Search forward from the start and backward from the end of a and b
+    # at once, and return the (x, y) where the paths meet, splitting a
+    # shortest edit script in two. a and b must differ at both ends. Past
+    # MAX_EDITS edits, return the point furthest along either path
+    # instead, as GNU diff does, giving up a minimal diff for speed.
+    n, m = len(a), len(b)
+    max_d = min((n + m + 1) // 2, (MAX_EDITS + 1) // 2)
+    offset = max_d + 1
+    size = 2 * offset + 1
+    forward = [-1] * size
+    backward = [-1] * size
+    forward[offset + 1] = 0
+    backward[offset + 1] = 0
+    delta = n - m
+    # With an odd delta, the paths meet while extending the forward one.
+    odd = delta % 2 != 0
+    # Diagonals that have run off the edges of a or b are skipped.
+    k1_start = k1_end = k2_start = k2_end = 0
+    for d in range(max_d + 1):
+        for k1 in range(-d + k1_start, d + 1 - k1_end, 2):
+            index = offset + k1
+            if k1 == -d or (k1 != d and forward[index - 1] <
+                            forward[index + 1]):
+                x1 = forward[index + 1]
+            else:
+                x1 = forward[index - 1] + 1
+            y1 = x1 - k1
+            while x1 < n and y1 < m and a[x1] == b[y1]:
+                x1 += 1
+                y1 += 1
+            forward[index] = x1
+            if x1 > n:
+                k1_end += 2
+            elif y1 > m:
+                k1_start += 2
+            elif odd:
+                index2 = offset + delta - k1
+                if 0 <= index2 < size and backward[index2] != -1 and \
+                        x1 >= n - backward[index2]:
+                    return x1, y1
+        for k2 in range(-d + k2_start, d + 1 - k2_end, 2):
+            index = offset + k2
+            if k2 == -d or (k2 != d and backward[index - 1] <
+                            backward[index + 1]):
+                x2 = backward[index + 1]
+            else:
+                x2 = backward[index - 1] + 1
+            y2 = x2 - k2
+            while x2 < n and y2 < m and a[n - x2 - 1] == b[m - y2 - 1]:
+                x2 += 1
+                y2 += 1
+            backward[index] = x2
+            if x2 > n:
+                k2_end += 2
+            elif y2 > m:
+                k2_start += 2
+            elif not odd:
+                index1 = offset + delta - k2
+                if 0 <= index1 < size and forward[index1] != -1:
+                    x1 = forward[index1]
+                    if x1 >= n - x2:
+                        return x1, x1 - (index1 - offset)
+
+    best = (-1, 0, 0)
+    for k in range(-max_d, max_d + 1):
+        x1 = forward[offset + k]
+        if 0 <= x1 <= n and 0 <= x1 - k <= m:
+            best = max(best, (x1 + x1 - k, x1, x1 - k))
+        x2 = backward[offset + k]
+        if 0 <= x2 <= n and 0 <= x2 - k <= m:
+            best = max(best, (x2 + x2 - k, n - x2, m - x2 + k))
+    return best[1], best[2]
+
+
+def _add_opcode(opcodes, tag, i1, i2, j1, j2):
+    # Add an opcode, joining it to the last one if they have the same tag,
+    # and deletes next to inserts into replaces.
+    if i1 == i2 and j1 == j2:
+        return
+    if opcodes:
+        last_tag, li1, li2, lj1, lj2 = opcodes[-1]
+        if last_tag == tag or (last_tag != "equal" and tag != "equal"):
+            if last_tag != tag:
+                tag = "replace"
+            opcodes[-1] = (tag, li1, i2, lj1, j2)
+            return
+    opcodes.append((tag, i1, i2, j1, j2))
+
+
+def unified_diff(a, b, from_name="previous", to_name="current", context=3):
+    """Return the lines of a unified diff from lines a to b."""
+    opcodes = get_opcodes(a, b)
+    if not any(tag != "equal" for tag, _, _, _, _ in opcodes):
+        return []
+
+    lines = ["--- " + from_name, "+++ " + to_name]
+    for group in _group_opcodes(opcodes, context):
+        i1, i2 = group[0][1], group[-1][2]
+        j1, j2 = group[0][3], group[-1][4]
+        lines.append("@@ -%s +%s @@" % (_format_range(i1, i2),
+                                        _format_range(j1, j2)))
+        for tag, ai1, ai2, bj1, bj2 in group:
+            if tag == "equal":
+                lines.extend(" " + line for line in a[ai1:ai2])
+                continue
+            lines.extend("-" + line for line in a[ai1:ai2])
+            lines.extend("+" + line for line in b[bj1:bj2])
+    return lines
+
+
+def _group_opcodes(opcodes, context):
+    # Split opcodes into hunks with up to context equal lines around each
+    # change, as difflib's get_grouped_opcodes() does.
+    opcodes = list(opcodes)
+    tag, i1, i2, j1, j2 = opcodes[0]
+    if tag == "equal":
+        opcodes[0] = (tag, max(i1, i2 - context), i2,
+                      max(j1, j2 - context), j2)
+    tag, i1, i2, j1, j2 = opcodes[-1]
+    if tag == "equal":
+        opcodes[-1] = (tag, i1, min(i2, i1 + context),
+                       j1, min(j2, j1 + context))
+
+    groups = []
+    group = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "equal" and i2 - i1 > context * 2:
+            group.append((tag, i1, min(i2, i1 + context),
+                          j1, min(j2, j1 + context)))
+            groups.append(group)
+            group = []
+            i1, j1 = max(i1, i2 - context), max(j1, j2 - context)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == "equal"):
+        groups.append(group)
+    return [group for group in groups
+            if any(op[0] != "equal" for op in group)]
+
+
+def _format_range(start, stop):
+    length = stop - start
+    if length == 1:
+        return str(start + 1)
+    if not length:
+        start -= 1
+    return "%d,%d" % (start + 1, length)
+
+
+def get_baseline_path(directory, key):
+    """Return the path of the baseline file for key."""
+    import hashlib
+    name = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return os.path.join(directory, name + ".txt")
+
+
+def save_baseline(directory, key, lines):
+    """Save normalized response lines as the baseline for key."""
+    import codecs
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path = get_baseline_path(directory, key)
+    with codecs.open(path, "w", encoding="UTF8") as baseline:
+        baseline.write(key + "\n")
+        baseline.write("\n".join(lines))
+    return path
+
+
+def load_baseline(directory, key):
+    """Return the baseline lines for key, or None if there is none."""
+    import codecs
+
+    path = get_baseline_path(directory, key)
+    if not os.path.exists(path):
+        return None
+    with codecs.open(path, "r", encoding="UTF8") as baseline:
+        return baseline.read().split("\n")[1:]
+
+
+def diff_in_background(a, b, callback, **kwargs):
+    """Compute unified_diff(a, b) in a new thread and pass it to callback.
+
+    a and b may be callables returning the lines, so normalizing large
+    responses also happens off the calling thread. callback is called in
+    the new thread.
+    """
+    def run():
+        a_lines = a() if callable(a) else a
+        b_lines = b() if callable(b) else b
+        callback(unified_diff(a_lines, b_lines, **kwargs))
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    return thread
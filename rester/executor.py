@@ -0,0 +1,186 @@
+"""
+Pacing and retrying requests for batch runs
+
+A TokenBucket limits how fast requests start, and an Executor also limits
+how many are in flight at once. A RetryPolicy decides whether a finished
+request thread should be sent again, and after how long.
+"""
+
+import random
+import threading
+import time
+
+_clock = getattr(time, "monotonic", time.time)
+
+
+class TokenBucket(object):
+    """Allows rate requests per second, with bursts of up to capacity"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = _clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, waiting until one is available."""
+        while True:
+            with self._lock:
+                now = _clock()
+                self._tokens = min(self.capacity, self._tokens +
+                                   (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def parse_retry_after(value):
+    """Return the seconds to wait for a Retry-After header value, or None.
+
+    The value may be a number of seconds or an HTTP date.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        from email.utils import mktime_tz
+        from email.utils import parsedate_tz
+        parsed = parsedate_tz(value)
+    except ImportError:
+        return None
+    if parsed is None:
+        return None
+    return max(0.0, mktime_tz(parsed) - time.time())
+
+
+class RetryPolicy(object):
+    """Decides when to send a request again
+
+    Requests are retried after failures of the kinds in errors (see
+    HttpRequestThread.failure) and responses with a status in statuses.
+    Delays grow exponentially from backoff with full jitter, up to
+    backoff_max. A Retry-After header on a retried response is honored,
+    also up to backoff_max.
+    """
+
+    def __init__(self, retries=0, backoff=0.5, backoff_max=30.0,
+                 statuses=(429, 503), errors=("connect", "timeout")):
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.statuses = tuple(statuses or ())
+        self.errors = tuple(errors or ())
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(retries=settings.get("retries", 0) or 0,
+                   backoff=settings.get("retry_backoff", 0.5),
+                   backoff_max=settings.get("retry_backoff_max", 30.0),
+                   statuses=settings.get("retry_statuses", [429, 503]),
+                   errors=settings.get("retry_on", ["connect", "timeout"]))
+
+    def get_delay(self, attempt, thread):
+        """Return the seconds to wait before sending again, or None.
+
+        attempt is the number of the attempt that thread made, from 1.
+        """
+        if attempt > self.retries or thread.cancelled:
+            return None
+        response = thread.response
+        if thread.success and response is not None:
+            if response.status not in self.statuses:
+                return None
+            retry_after = parse_retry_after(
+                response.get_header("Retry-After"))
+            if retry_after is not None:
+                return min(retry_after, self.backoff_max)
+        elif thread.failure not in self.errors:
+            return None
+        return random.uniform(0, min(self.backoff_max,
+                                     self.backoff * 2 ** (attempt - 1)))
+
+
+class Attempt(object):
+    """Timing and outcome of one attempt at sending a request"""
+
+    def __init__(self, number, started, elapsed, thread, delay=None):
+        self.number = number
+        self.started = started
+        self.elapsed = elapsed
+        self.success = thread.success
+        self.failure = thread.failure
+        self.message = thread.message
+        self.status = thread.response.status \
+            if thread.success and thread.response is not None else None
+        # Seconds waited before the next attempt, if there was one.
+        self.delay = delay
+
+    def to_dict(self):
+        return {
+            "number": self.number,
+            "started": self.started,
+            "elapsed": self.elapsed,
+            "success": self.success,
+            "failure": self.failure,
+            "message": self.message,
+            "status": self.status,
+            "delay": self.delay,
+        }
+
+
+class Executor(object):
+    """Sends request threads, pacing and limiting them across threads"""
+
+    def __init__(self, rate=None, burst=1, max_in_flight=None):
+        self._bucket = TokenBucket(rate, burst) if rate else None
+        self._in_flight = None
+        if max_in_flight:
+            self._in_flight = threading.BoundedSemaphore(max_in_flight)
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(rate=settings.get("rate_limit", None),
+                   burst=settings.get("rate_limit_burst", 1),
+                   max_in_flight=settings.get("max_in_flight", None))
+
+    def send(self, make_thread, policy=None, trace=None):
+        """Run threads from make_thread() until one should not be retried.
+
+        Each thread is run in the calling thread. Return the last thread
+        and a list of Attempts.
+        """
+        attempts = []
+        while True:
+            if self._bucket:
+                self._bucket.acquire()
+            if self._in_flight:
+                self._in_flight.acquire()
+            try:
+                thread = make_thread()
+                started = time.time()
+                time_start = _clock()
+                thread.run()
+                elapsed = _clock() - time_start
+            finally:
+                if self._in_flight:
+                    self._in_flight.release()
+
+            attempt = Attempt(len(attempts) + 1, started, elapsed, thread)
+            attempts.append(attempt)
+            delay = None
+            if policy is not None:
+                delay = policy.get_delay(attempt.number, thread)
+            if delay is None:
+                return thread, attempts
+            attempt.delay = delay
+            time.sleep(delay)
+            if trace is not None:
+                trace.mark("retry_wait")
@@ -0,0 +1,330 @@
+"""
+Importing, replaying, and exporting HAR (HTTP Archive) files
+
+Browsers and proxies save captured traffic as HAR. Entries can be turned
+into ### blocks of a request file, or replayed directly: as fast as
+possible with a number of requests in flight, or at the times they were
+originally sent, scaled by a factor. Replayed results can be exported as
+HAR again, with timings taken from each request's trace.
+"""
+
+import calendar
+import json
+import re
+import threading
+import time
+
+from .message import Request
+from .runner import run_request
+from .util import split_query_string
+
+try:
+    # Python 3
+    from urllib.parse import unquote
+    from urllib.parse import urlencode
+    from urllib.parse import urlsplit
+except ImportError:
+    # Python 2
+    from urllib import unquote
+    from urllib import urlencode
+    from urlparse import urlsplit
+
+HAR_VERSION = "1.2"
+
+# Headers that describe the original connection rather than the request.
+SKIPPED_HEADERS = ("connection", "content-length", "host", "keep-alive",
+                   "proxy-connection", "transfer-encoding")
+
+# The HAR timing each trace stage counts towards.
+TIMING_STAGES = {
+    "retry_wait": "blocked",
+    "token": "blocked",
+    "connect": "connect",
+    "send": "send",
+    "response_headers": "wait",
+    "curl": "wait",
+    "read": "receive",
+    "download": "receive",
+}
+
+RE_HAR_TIME = re.compile(
+    r"^(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(\.\d+)?"
+    r"(Z|([+-])(\d\d):?(\d\d))?$")
+
+
+class HarError(Exception):
+    pass
+
+
+def parse_har_time(value):
+    """Return an ISO 8601 startedDateTime as seconds since the epoch."""
+    match = RE_HAR_TIME.match(value or "")
+    if not match:
+        raise HarError("Unable to parse time " + str(value))
+    parts = [int(part) for part in match.groups()[:6]]
+    seconds = calendar.timegm(parts + [0, 0, 0])
+    if match.group(7):
+        seconds += float(match.group(7))
+    if match.group(9):
+        offset = int(match.group(10)) * 3600 + int(match.group(11)) * 60
+        seconds -= offset if match.group(9) == "+" else -offset
+    return seconds
+
+
+def format_har_time(seconds):
+    """Return seconds since the epoch as an ISO 8601 startedDateTime."""
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(seconds)) + \
+        ".%03dZ" % (int(seconds * 1000) % 1000)
+
+
+def load_har(path):
+    """Return the entries of the HAR file at path, in the order sent."""
+    import codecs
+    try:
+        with codecs.open(path, "r", encoding="utf-8-sig") as har_file:
+            data = json.load(har_file)
+        entries = data["log"]["entries"]
+    except (IOError, ValueError, KeyError, TypeError) as e:
+        raise HarError("Unable to read HAR file %s: %s" % (path, e))
+    return sorted(entries, key=lambda entry: entry.get("startedDateTime", ""))
+
+
+def entry_to_request(entry, base_url=None):
+    """Return a Request for a HAR entry.
+
+    base_url, for example https://staging.example.com, replaces the
+    protocol, host, and port of the recorded URL.
+    """
+    har_request = entry["request"]
+    uri = urlsplit(har_request["url"])
+    if base_url:
+        base = urlsplit(base_url)
+        uri = uri._replace(scheme=base.scheme or uri.scheme,
+                           netloc=base.netloc)
+
+    request = Request()
+    request.method = har_request.get("method", "GET").upper()
+    request.protocol = uri.scheme
+    request.host = uri.hostname
+    request.port = uri.port
+    request.path = uri.path or "/"
+    if uri.query:
+        # Keep the values as recorded, still percent-encoded.
+        request.query = split_query_string(uri.query)
+
+    for header in har_request.get("headers", []):
+        name = header["name"]
+        if name.startswith(":") or name.lower() in SKIPPED_HEADERS:
+            continue
+        request.headers.append((name, header["value"]))
+
+    post_data = har_request.get("postData")
+    if post_data:
+        if post_data.get("text"):
+            request.body = post_data["text"]
+        elif post_data.get("params"):
+            request.body = urlencode([(param["name"], param.get("value", ""))
+                                      for param in post_data["params"]])
+        if post_data.get("mimeType") and \
+                not request.get_header("Content-Type"):
+            request.headers.append(("Content-Type", post_data["mimeType"]))
+    return request
+
+
+def format_request(request, eol="\n"):
+    """Return the text of a request block for request."""
+    lines = ["%s %s" % (request.method, request.uri)]
+    lines.extend(request.header_lines)
+    text = eol.join(lines)
+    if request.body:
+        text += eol * 2 + request.body
+    return text
+
+
+def import_har(entries, base_url=None, eol="\n"):
+    """Return request file text with a ### block for each HAR entry."""
+    blocks = []
+    for entry in entries:
+        request = entry_to_request(entry, base_url)
+        comment = "# %s" % entry.get("startedDateTime", "")
+        blocks.append(comment + eol + format_request(request, eol))
+    return (eol * 2 + "###" + eol * 2).join(blocks) + eol
+
+
+class ReplayedEntry(object):
+    """The Result of replaying a HAR entry, with the recorded timing"""
+
+    def __init__(self, entry, result, scheduled=None, started=None):
+        self.entry = entry
+        self.result = result
+
+        # Seconds after the replay began that the request was due and sent.
+        self.scheduled = scheduled
+        self.started = started
+
+    @property
+    def recorded(self):
+        """Seconds the original request took, or None if unknown."""
+        recorded = self.entry.get("time")
+        if recorded is None or recorded < 0:
+            return None
+        return recorded / 1000.0
+
+    @property
+    def delta(self):
+        """Seconds the replayed request took longer than the original."""
+        if self.recorded is None or self.result.elapsed is None:
+            return None
+        return self.result.elapsed - self.recorded
+
+    @property
+    def lag(self):
+        """Seconds the request was sent after it was due."""
+        if self.scheduled is None or self.started is None:
+            return None
+        return self.started - self.scheduled
+
+    def summary(self):
+        line = self.result.summary()
+        if self.delta is not None:
+            line += " %+.4f sec. vs recorded" % self.delta
+        return line
+
+    def to_dict(self):
+        data = self.result.to_dict()
+        data["recorded"] = self.recorded
+        data["delta"] = self.delta
+        data["recorded_status"] = self.entry.get("response", {}).get("status")
+        data["scheduled"] = self.scheduled
+        data["lag"] = self.lag
+        return data
+
+
+def replay_har(entries, settings, timing="fast", scale=1.0, jobs=4,
+               base_url=None, encoding="UTF-8", executor=None,
+               on_result=None):
+    """Send the request of each HAR entry and return ReplayedEntries in
+    entry order.
+
+    With timing "fast", up to jobs requests are in flight at once. With
+    timing "original", each request is sent at its recorded offset from
+    the first, multiplied by scale (0.5 replays twice as fast); jobs still
+    limits the requests in flight, so a request may be sent late.
+
+    on_result, if given, is called with each ReplayedEntry as it completes.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if timing not in ("fast", "original"):
+        raise HarError("Unknown timing %s. Use fast or original." % timing)
+    offsets = [0.0] * len(entries)
+    if timing == "original" and entries:
+        times = [parse_har_time(entry.get("startedDateTime"))
+                 for entry in entries]
+        offsets = [(sent - times[0]) * scale for sent in times]
+
+    replayed = [None] * len(entries)
+    lock = threading.Lock()
+    time_start = time.time()
+
+    def replay(index):
+        started = time.time() - time_start
+        request = entry_to_request(entries[index], base_url)
+        result = run_request(request, settings, encoding=encoding,
+                             executor=executor)
+        replayed[index] = ReplayedEntry(
+            entries[index], result,
+            offsets[index] if timing == "original" else None, started)
+        if on_result:
+            with lock:
+                on_result(replayed[index])
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        futures = []
+        for index in range(len(entries)):
+            if timing == "original":
+                wait = offsets[index] - (time.time() - time_start)
+                if wait > 0:
+                    time.sleep(wait)
+            futures.append(pool.submit(replay, index))
+        for future in futures:
+            future.result()
+    return replayed
+
+
+def get_timings(trace):
+    """Return a HAR timings dict, in milliseconds, from a request's trace.
+    """
+    timings = {"blocked": -1, "dns": -1, "connect": -1, "ssl": -1,
+               "send": 0, "wait": 0, "receive": 0}
+    for stage, _, elapsed in trace.stages():
+        name = TIMING_STAGES.get(stage)
+        if name:
+            timings[name] = max(timings[name], 0) + elapsed * 1000
+    return timings
+
+
+def export_har(replayed):
+    """Return a HAR log dict for a list of ReplayedEntries or Results."""
+    entries = []
+    for item in replayed:
+        result = getattr(item, "result", item)
+        request = result.request
+        response = result.response
+        timings = get_timings(result.trace)
+        entry = {
+            "startedDateTime": format_har_time(result.trace.started),
+            "time": sum(value for value in timings.values() if value > 0),
+            "request": {
+                "method": request.method,
+                "url": request.uri if request.host else "",
+                "httpVersion": "HTTP/1.1",
+                "headers": [{"name": key, "value": str(value)}
+                            for key, value in request.headers],
+                "queryString": [{"name": unquote(name),
+                                 "value": unquote(value)}
+                                for name, values in request.query.items()
+                                for value in values],
+                "cookies": [],
+                "headersSize": -1,
+                "bodySize": len(request.body or ""),
+            },
+            "response": {
+                "status": response.status if response else 0,
+                "statusText": (response.reason or "") if response else "",
+                "httpVersion": response.protocol if response else "",
+                "headers": [{"name": key, "value": value}
+                            for key, value in response.headers]
+                if response else [],
+                "cookies": [],
+                "content": {
+                    "size": result.size,
+                    "mimeType": (response.get_header("Content-Type") or "")
+                    if response else "",
+                },
+                "redirectURL": (response.get_header("Location") or "")
+                if response else "",
+                "headersSize": -1,
+                "bodySize": result.size,
+            },
+            "cache": {},
+            "timings": timings,
+        }
+        if request.body:
+            entry["request"]["postData"] = {
+                "mimeType": request.get_header("Content-Type") or "",
+                "text": request.body,
+            }
+        if response is not None and response.body and \
+                not response.binary and not response.truncated:
+            entry["response"]["content"]["text"] = response.body
+        if not result.success and result.message:
+            entry["comment"] = result.message
+        entries.append(entry)
+    return {
+        "log": {
+            "version": HAR_VERSION,
+            "creator": {"name": "RESTer", "version": ""},
+            "entries": entries,
+        }
+    }
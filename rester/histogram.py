@@ -0,0 +1,118 @@
+"""
+A latency histogram with constant memory, in the style of HdrHistogram
+
+Values are counted in log-linear buckets: each power of two range is split
+into the same number of sub-buckets, so every value is recorded within a
+fixed relative precision (about 0.8% with the default 7 sub-bucket bits),
+and the memory used does not depend on how many values are recorded.
+Histograms from several threads or processes can be merged by adding their
+counts.
+"""
+
+import math
+
+
+class Histogram(object):
+    """Counts of latencies, in seconds, from resolution up to highest"""
+
+    def __init__(self, highest=3600.0, resolution=0.000001, sub_bucket_bits=7):
+        self.highest = highest
+        self.resolution = resolution
+        self._sub_bucket_bits = sub_bucket_bits
+        self._half_count = 1 << sub_bucket_bits
+        highest_units = int(math.ceil(highest / resolution))
+        self._counts = [0] * (self._get_index(highest_units) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def _get_index(self, units):
+        # Bucket 0 holds 0 to 2 * half_count - 1 with unit precision. Each
+        # later bucket covers the next power of two with half_count
+        # sub-buckets.
+        bucket = max(0, units.bit_length() - self._sub_bucket_bits - 1)
+        return (bucket << self._sub_bucket_bits) + (units >> bucket)
+
+    def _get_value(self, index):
+        # Return the midpoint of the values counted at index, in seconds.
+        bucket = max(0, (index >> self._sub_bucket_bits) - 1)
+        sub_bucket = index - (bucket << self._sub_bucket_bits)
+        low = sub_bucket << bucket
+        high = ((sub_bucket + 1) << bucket) - 1
+        return (low + high) / 2.0 * self.resolution
+
+    def record(self, seconds, count=1):
+        """Count a latency. Values above highest are counted as highest."""
+        seconds = max(0.0, seconds)
+        units = int(min(seconds, self.highest) / self.resolution)
+        self._counts[self._get_index(units)] += count
+        self.count += count
+        self.total += seconds * count
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        """Add the counts of another Histogram with the same layout."""
+        if len(other._counts) != len(self._counts):
+            raise ValueError("Histograms have different layouts.")
+        for index, count in enumerate(other._counts):
+            if count:
+                self._counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                if self.min is None or value < self.min:
+                    self.min = value
+                if self.max is None or value > self.max:
+                    self.max = value
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def get_percentile(self, percentile):
+        """Return the latency at or below which percentile percent of the
+        recorded latencies fall, or None if nothing was recorded."""
+        if not self.count:
+            return None
+        if percentile >= 100:
+            return self.max
+        target = max(1, int(math.ceil(percentile / 100.0 * self.count)))
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen >= target:
+                # Stay within the exact minimum and maximum.
+                return min(max(self._get_value(index), self.min), self.max)
+        return self.max
+
+    def to_dict(self):
+        """Return the histogram as a dict of its non-zero counts, for
+        passing between processes or saving."""
+        return {
+            "highest": self.highest,
+            "resolution": self.resolution,
+            "sub_bucket_bits": self._sub_bucket_bits,
+            "count": self.count,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max,
+            "counts": dict((str(index), count) for index, count in
+                           enumerate(self._counts) if count),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls(data["highest"], data["resolution"],
+                        data["sub_bucket_bits"])
+        for index, count in data["counts"].items():
+            histogram._counts[int(index)] = count
+        histogram.count = data["count"]
+        histogram.total = data["total"]
+        histogram.min = data["min"]
+        histogram.max = data["max"]
+        return histogram
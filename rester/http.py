@@ -6,62 +6,417 @@ import codecs
 import json
 import os
 import socket
-import subprocess
-import tempfile
 import threading
 import time
 import zlib
 import errno
 
+from . import tls
+from .cassette import CassetteError
+from .cassette import get_cassette
+from .cassette import get_cassette_settings
+from .cassette import get_request_key
+from .jsonpath import find_in_stream
+from .jsonpath import is_definite
 from .message import Response
+from .resolver import get_curl_resolve_args
+from .resolver import get_dns_cache
+from .session import SessionError
+from .session import add_cookie_header
+from .session import extract_cookies
+from .session import get_cookie_jar
+from .session import get_cookie_jar_path
+from .session import get_oauth2_token
+from .tls import SSLError
+from .tls import get_curl_tls_args
+from .tls import get_tls_profile
+from .trace import Trace
+from .trace import get_profile_path
+from .trace import profile_call
 from .util import normalize_line_endings
+from .util import replace_file
 from .util import scan_bytes_for_encoding
 from .util import scan_string_for_encoding
-import sublime
+from .util import sniff_binary
+from .util import summarize_binary
+from .util import trim_partial_character
 
 try:
     from http.client import HTTPConnection
-    try:
-        from http.client import HTTPSConnection
-    except ImportError:
-        # Linux with no SSL support.
-        pass
+    from http.client import HTTPException
 except ImportError:
     # Python 2
     from httplib import HTTPConnection
-    try:
-        from httplib import HTTPSConnection
-    except ImportError:
-        # Linux with no SSL support.
-        pass
+    from httplib import HTTPException
+
+
+DOWNLOAD_CHUNK_SIZE = 65536
+UPLOAD_CHUNK_SIZE = 65536
+
+# The request thread class for each http_client setting: its name, module,
+# and class.
+HTTP_CLIENTS = (
+    ("python", ".http", "HttpClientRequestThread"),
+    ("curl", ".http", "CurlRequestThread"),
+    ("http2", ".http2", "Http2RequestThread"),
+    ("selector", ".selector", "SelectorRequestThread"),
+)
 
 
 def decode(bytes_sequence, encodings):
     """Return the first successfully decoded string"""
+    return decode_with_encoding(bytes_sequence, encodings)[0]
+
+
+def decode_with_encoding(bytes_sequence, encodings):
+    """Return the first successfully decoded string and its encoding"""
     for encoding in encodings:
         try:
             decoded = bytes_sequence.decode(encoding)
-            return decoded
-        except UnicodeDecodeError:
+            return decoded, encoding
+        except (UnicodeDecodeError, LookupError):
             # Try the next in the list.
             pass
     raise DecodeError
 
 
+def get_request_thread_class(client):
+    """Return the HttpRequestThread subclass for an http_client setting."""
+    for name, module, class_name in HTTP_CLIENTS:
+        if client == name:
+            # Clients in other modules are imported on first use.
+            import importlib
+            module = importlib.import_module(
+                module, __name__.rsplit(".", 1)[0])
+            return getattr(module, class_name)
+    return None
+
+
+def get_http_client_names():
+    """Return the allowed http_client values, quoted, as a sentence."""
+    names = ["'%s'" % name for name, _, _ in HTTP_CLIENTS]
+    return ", ".join(names[:-1]) + ", or " + names[-1]
+
+
 class HttpRequestThread(threading.Thread):
-    def __init__(self, request, settings, encoding="UTF8", eol="\n"):
+    def __init__(self, request, settings, encoding="UTF8", eol="\n",
+                 trace=None, decode=False):
         threading.Thread.__init__(self)
         self.request = request
         self.response = None
         self.message = None
         self.success = False
         self.elapsed = None
+        self.tls_resumed = None
+        self.tls_handshake_elapsed = None
+        self.cancelled = False
+        self.cancel_message = None
+        self._cancel_event = threading.Event()
+
+        # "connect" or "timeout" for failures that are worth retrying.
+        self.failure = None
         self._encoding = encoding
         self._encodings = settings.get("default_response_encodings", [])
         self._eol = eol
         self._output_request = settings.get("output_request", True)
         self._output_response = settings.get("output_response", True)
         self._timeout = settings.get("timeout", None)
+        self._deadline = settings.get("deadline", None)
+        self._tls_profile = get_tls_profile(settings)
+        self._detect_binary = settings.get("detect_binary", True)
+        self._binary_preview_size = settings.get("binary_preview_size", 64)
+        self._large_response_size = settings.get("large_response_size", None)
+        self._response_preview_size = settings.get("response_preview_size",
+                                                   262144)
+        self._response_spool_size = settings.get("response_spool_size",
+                                                 1048576)
+        self.trace = trace or Trace()
+
+        # Stream the body to this file instead of decoding it.
+        self.bytes_downloaded = 0
+        self.download_size = None
+        self._download = settings.get("download", None)
+        self._download_part = None
+        if self._download:
+            self._download = os.path.abspath(
+                os.path.expanduser(self._download))
+            # Bodies are written here first and renamed to the download
+            # file once complete, so a failed request leaves it as it was.
+            self._download_part = self._download + ".part"
+        self._download_decompress = settings.get("download_decompress", True)
+
+        # Session state shared with other requests.
+        self._settings = settings
+        self._cookie_jar_path = get_cookie_jar_path(settings)
+        self._oauth2 = settings.get("oauth2", None)
+
+        # Record responses to, or replay them from, a cassette file.
+        self._body_bytes = None
+        self._body_decoded = False
+        self._cassette_match_headers = settings.get(
+            "cassette_match_headers", ["Accept", "Content-Type"])
+        self._cassette_latency = settings.get("cassette_latency", False)
+        self._cassette_error = None
+        try:
+            self._cassette_path, self._cassette_mode = \
+                get_cassette_settings(settings)
+        except CassetteError as e:
+            self._cassette_path, self._cassette_mode = None, None
+            self._cassette_error = str(e)
+        self.run = self._run_with_cassette(self.run)
+        self.run = self._run_with_session(self.run)
+
+        # Replace a JSON body with the values a JSON path selects from it.
+        self._filter = settings.get("filter", None)
+        self.run = self._run_with_filter(self.run)
+
+        # With decode, decode the body in this thread rather than on first
+        # use, so the thread that reads it does not wait on decoding.
+        self._decode_eagerly = decode
+        self.run = self._run_with_decode(self.run)
+
+        # Enforce the deadline and drop the work of a cancelled request.
+        self.run = self._run_cancellable(self.run)
+
+        # Run the request under cProfile when the profile setting is on.
+        self.profile_file = get_profile_path(settings)
+        if self.profile_file:
+            self.run = profile_call(self.run, self.profile_file)
+
+    def cancel(self, message="Request cancelled."):
+        """Abort the request from another thread.
+
+        The connection is closed (or the cURL process killed) so the thread
+        stops promptly, and the request fails with message.
+        """
+        if self.cancelled:
+            return
+        self.cancel_message = message
+        self.cancelled = True
+        self._cancel_event.set()
+        self._abort()
+
+    def _abort(self):
+        # Release whatever the request is blocked on. Subclasses override.
+        pass
+
+    def _run_with_session(self, run):
+        # Return run wrapped to send the session's cookies and OAuth2 token
+        # with the request, and to store the cookies the response sets.
+        def run_with_session():
+            jar = None
+            if self.request.host:
+                if self._cookie_jar_path:
+                    jar = get_cookie_jar(self._cookie_jar_path)
+                    add_cookie_header(jar, self.request)
+                if self._oauth2 and not self.request.get_header(
+                        "Authorization"):
+                    try:
+                        token = get_oauth2_token(self._oauth2,
+                                                 self._fetch_token)
+                    except (SessionError, KeyError) as e:
+                        self.message = "Unable to get an OAuth2 token. " + \
+                                       str(e)
+                        self.success = False
+                        return
+                    self.trace.mark("token")
+                    self.request.headers.append(("Authorization",
+                                                 "Bearer " + token))
+            run()
+            if jar is not None and self.response is not None:
+                extract_cookies(jar, self.request, self.response)
+        return run_with_session
+
+    def _run_with_cassette(self, run):
+        # Return run wrapped to replay the response from the cassette, or
+        # to send the request and record the response, as the mode says.
+        def run_with_cassette():
+            if self._cassette_error:
+                self.message = self._cassette_error
+                self.success = False
+                return
+            if not self._cassette_path:
+                run()
+                return
+            if not self._validate_request():
+                return
+            try:
+                cassette = get_cassette(self._cassette_path)
+            except CassetteError as e:
+                self.message = str(e)
+                self.success = False
+                return
+            key = get_request_key(self.request, self._cassette_match_headers)
+            interaction = None
+            if self._cassette_mode != "record":
+                interaction = cassette.find(key)
+            if interaction:
+                try:
+                    self._replay(cassette, interaction)
+                except CassetteError as e:
+                    self.message = str(e)
+                    self.success = False
+                return
+            if self._cassette_mode == "replay":
+                self.message = "No response recorded in the cassette for " + \
+                               self.request.method + " " + self.request.uri
+                self.success = False
+                return
+            run()
+            if self.success and self.response is not None:
+                self._record(cassette, key)
+        return run_with_cassette
+
+    def _run_with_filter(self, run):
+        # Return run wrapped to filter the body in this thread, reading the
+        # raw body a chunk at a time so it is never decoded in full.
+        def run_with_filter():
+            run()
+            if not self._filter or not self.success or \
+                    self.response is None or self.response.length is None:
+                return
+            time_start = time.time()
+            self.response.filter = self._filter
+            try:
+                self.response.body = self._filter_body()
+                self.response.body_size = None
+            except (ValueError, LookupError, zlib.error) as e:
+                self.response.filter_error = "Unable to filter with %s: %s" \
+                    % (self._filter, e)
+            self.response.filter_elapsed = time.time() - time_start
+            self.trace.mark("filter")
+        return run_with_filter
+
+    def _run_with_decode(self, run):
+        # Return run wrapped to decode the body and release the raw body
+        # once the response is complete.
+        def run_with_decode():
+            run()
+            if self._decode_eagerly and self.response is not None:
+                self.response.body
+                self.response.close()
+        return run_with_decode
+
+    def _filter_body(self):
+        # Return the values the filter selects from the raw body as JSON.
+        definite = is_definite(self._filter)
+        content_type = self.response.get_header("content-type") or ""
+        encoding = scan_string_for_encoding(content_type) or "utf-8"
+        if codecs.lookup(encoding).name == "utf-8":
+            # Drop a byte order mark.
+            encoding = "utf-8-sig"
+        decoder = codecs.getincrementaldecoder(encoding)()
+        decompressor = None
+        content_encoding = (self.response.get_header("content-encoding") or
+                            "").lower()
+        if not self._body_decoded and \
+                ("gzip" in content_encoding or "deflate" in content_encoding):
+            decompressor = zlib.decompressobj(15 + 32)
+
+        def read_text():
+            for chunk in self.response.iter_raw_body():
+                if decompressor:
+                    chunk = decompressor.decompress(chunk)
+                yield decoder.decode(chunk)
+            tail = decompressor.flush() if decompressor else b""
+            yield decoder.decode(tail, True)
+
+        matches = find_in_stream(read_text(), self._filter)
+        if definite:
+            # Stop reading at the only value the path can match.
+            matches = next(matches, None)
+        else:
+            matches = list(matches)
+        self.response.unfiltered_size = self.response.length
+        body = json.dumps(matches, indent=2, ensure_ascii=False)
+        return normalize_line_endings(body, self._eol)
+
+    def _replay(self, cassette, interaction):
+        # Build the response from a recorded interaction, without sending
+        # the request.
+        recorded = interaction["response"]
+        self.response = Response()
+        self.response.protocol = recorded["protocol"]
+        self.response.status = recorded["status"]
+        self.response.reason = recorded["reason"]
+        self.response.headers = [tuple(header)
+                                 for header in recorded["headers"]]
+        body_bytes = cassette.get_body(interaction)
+        self._body_decoded = recorded.get("decoded", False)
+        self.elapsed = 0.0
+        if self._cassette_latency and recorded.get("elapsed"):
+            # Wait as long as the recorded request took, unless cancelled.
+            self._cancel_event.wait(recorded["elapsed"])
+            self.elapsed = recorded["elapsed"]
+        self.trace.mark("replay")
+        if self._download:
+            self._write_download(body_bytes)
+        else:
+            self._store_body(body_bytes)
+        self.success = True
+
+    def _record(self, cassette, key):
+        # Save the exchange, using the body bytes as they were received.
+        body_bytes = self._body_bytes
+        decoded = False
+        body_file = None
+        if body_bytes is None:
+            body_bytes = self.response.raw_body
+        if body_bytes is None and self.response.download_file:
+            # The body was streamed to the download file. Copy the file
+            # rather than reading it into memory.
+            body_file = self.response.download_file
+            decoded = self._download_decompress
+        cassette.record(key, self.request, self.response, body_bytes,
+                        self.elapsed, decoded, body_file)
+        self.trace.mark("record")
+
+    def _fetch_token(self, url, body):
+        # Post body to the token endpoint with the same client, and return
+        # the status and body of the response.
+        from .parse import get_redirect_request
+        request = get_redirect_request(self.request, url)
+        request.method = "POST"
+        request.body = body
+        request.headers.append(("Content-Type",
+                                "application/x-www-form-urlencoded"))
+        thread = self.__class__(request, _TokenSettings(self._settings),
+                                encoding=self._encoding, eol=self._eol)
+        thread.run()
+        if not thread.success or thread.response is None:
+            raise SessionError(thread.message or "")
+        return thread.response.status, thread.response.body
+
+    def _run_cancellable(self, run):
+        # Return run wrapped with a timer that cancels the request when the
+        # deadline passes. Errors raised by an aborted request are dropped.
+        def run_cancellable():
+            timer = None
+            if self._deadline:
+                timer = threading.Timer(
+                    self._deadline, self.cancel,
+                    ["Request exceeded the deadline of %s sec." %
+                     self._deadline])
+                timer.daemon = True
+                timer.start()
+            try:
+                if not self.cancelled:
+                    run()
+            except Exception:
+                if not self.cancelled:
+                    raise
+            finally:
+                if timer:
+                    timer.cancel()
+            # Do not leave a partial download behind.
+            if self._download_part and os.path.exists(self._download_part):
+                os.remove(self._download_part)
+            if self.cancelled:
+                self.success = False
+                self.message = self.cancel_message
+                self.response = None
+                self.trace.mark("cancelled")
+        return run_cancellable
 
     def _decode_body(self, body_bytes):
 
@@ -88,30 +443,162 @@ class HttpRequestThread(threading.Thread):
 
         # Decoding using the encodings discovered.
         try:
-            body = decode(body_bytes, encodings)
+            body, self.response.encoding = \
+                decode_with_encoding(body_bytes, encodings)
         except DecodeError:
             body = "{Unable to decode body}"
 
         return body
 
+    def _store_body(self, body_bytes):
+        # Keep the body as received on the response, to be decoded by
+        # _read_body when it is first used. Status checks, redirects, and
+        # load tests never pay for decoding.
+        # This must be called AFTER the response headers are populated.
+        if not body_bytes:
+            self.response.body = None
+            return
+        self.response.set_raw_body(body_bytes, self._read_body,
+                                   self._response_spool_size)
+        self.trace.mark("store")
+
     def _read_body(self, body_bytes):
         # Decode the body from a list of bytes
         # This must be called AFTER the response headers are populated.
         if not body_bytes:
             return None
-        body_bytes = self._unzip_body(body_bytes)
+        # Decoding is deferred until the body is used, so end the time
+        # spent waiting for that before timing the decode stages.
+        self.trace.mark("body_access")
+        try:
+            if self._large_response_size and self._is_compressed():
+                body_bytes = self._unzip_large_body(body_bytes)
+            else:
+                body_bytes = self._unzip_body(body_bytes)
+        except zlib.error:
+            return "{Unable to decompress body}"
+        self.trace.mark("decompress")
+        if self._detect_binary:
+            description = sniff_binary(
+                self.response.get_header("content-type"), body_bytes)
+            if description:
+                # Summarize binary bodies instead of decoding them.
+                self.response.binary = description
+                self.response.body_size = len(body_bytes)
+                body = summarize_binary(description, body_bytes,
+                                        self._binary_preview_size)
+                self.trace.mark("summarize")
+                return normalize_line_endings(body, self._eol)
+        if self._large_response_size and self.response.body_file is None \
+                and len(body_bytes) > self._large_response_size:
+            body_bytes = self._spool_body(body_bytes)
+            self.trace.mark("spool")
         body = self._decode_body(body_bytes)
+        self.trace.mark("decode")
         body = normalize_line_endings(body, self._eol)
+        self.trace.mark("normalize_eol")
         return body
 
+    def _write_download(self, body_bytes):
+        # Write a body that was read into memory to the download file. An
+        # error response's body is kept in memory instead.
+        if self.response.status >= 400:
+            self._store_body(body_bytes)
+            return
+        self._body_bytes = body_bytes
+        if self._download_decompress:
+            body_bytes = self._unzip_body(body_bytes)
+        with open(self._download_part, "wb") as download:
+            download.write(body_bytes)
+        replace_file(self._download_part, self._download)
+        self.bytes_downloaded = len(body_bytes)
+        self.response.body_size = len(body_bytes)
+        self.response.download_file = self._download
+
+    def _spool_body(self, body_bytes):
+        # Write the full body to a temporary file without decoding it and
+        # return the bytes of the preview to decode in its place.
+        import tempfile
+        body_file = tempfile.NamedTemporaryFile("wb", suffix=".body",
+                                                delete=False)
+        with body_file:
+            body_file.write(body_bytes)
+        self.response.body_file = body_file.name
+        self.response.body_size = len(body_bytes)
+        preview = trim_partial_character(
+            body_bytes[:self._response_preview_size])
+        self.response.body_preview_size = len(preview)
+        return preview
+
+    def _unzip_large_body(self, body_bytes):
+        # Decompress a body a piece at a time. Once it is larger than
+        # large_response_size, write it to the spool file as it is
+        # decompressed and return only the preview, so the whole body is
+        # never held in memory. Binary bodies are decompressed in full to
+        # be summarized.
+        decompressor = zlib.decompressobj(15 + 32)
+        chunk = decompressor.decompress(body_bytes, DOWNLOAD_CHUNK_SIZE)
+        if self._detect_binary and sniff_binary(
+                self.response.get_header("content-type"), chunk):
+            return self._unzip_body(body_bytes)
+        pieces = []
+        size = 0
+        spool = None
+        try:
+            while True:
+                size += len(chunk)
+                if spool is not None:
+                    spool.write(chunk)
+                else:
+                    pieces.append(chunk)
+                    if size > self._large_response_size:
+                        import tempfile
+                        spool = tempfile.NamedTemporaryFile(
+                            "wb", suffix=".body", delete=False)
+                        self.response.body_file = spool.name
+                        pieces = [b"".join(pieces)]
+                        spool.write(pieces[0])
+                data = decompressor.unconsumed_tail
+                if not data:
+                    break
+                chunk = decompressor.decompress(data, DOWNLOAD_CHUNK_SIZE)
+            chunk = decompressor.flush()
+            if not getattr(decompressor, "eof", True):
+                raise zlib.error("incomplete or truncated stream")
+        except (zlib.error, IOError, OSError):
+            if spool is not None:
+                spool.close()
+                os.remove(spool.name)
+                self.response.body_file = None
+            raise
+        if spool is None:
+            return b"".join(pieces) + chunk
+        spool.write(chunk)
+        spool.close()
+        self.response.body_size = size + len(chunk)
+        preview = trim_partial_character(
+            pieces[0][:self._response_preview_size])
+        self.response.body_preview_size = len(preview)
+        return preview
+
+    def _is_compressed(self):
+        # Return True if the body is gzip or deflate compressed.
+        if self._body_decoded:
+            # A replayed body that was recorded after decompressing.
+            return False
+        content_encoding = (self.response.get_header("content-encoding") or
+                            "").lower()
+        return "gzip" in content_encoding or "deflate" in content_encoding
+
     def _unzip_body(self, body_bytes):
-        content_encoding = self.response.get_header("content-encoding")
-        if content_encoding:
-            content_encoding = content_encoding.lower()
-            if "gzip" in content_encoding or "deflate" in content_encoding:
-                body_bytes = zlib.decompress(body_bytes, 15 + 32)
+        if self._is_compressed():
+            body_bytes = zlib.decompress(body_bytes, 15 + 32)
         return body_bytes
 
+    def get_download_progress(self):
+        """Return the number of bytes downloaded and the total, if known."""
+        return self.bytes_downloaded, self.download_size
+
     def _validate_request(self):
 
         # Fail if the hostname is not set.
@@ -126,42 +613,102 @@ class HttpRequestThread(threading.Thread):
             self.success = False
             return False
 
+        if self.request.body_file and \
+                not os.access(self.request.body_file, os.R_OK):
+            self.message = "Unable to read body file " + \
+                           self.request.body_file
+            self.success = False
+            return False
+
         return True
 
+    def _get_body_file_size(self):
+        # Return the size of the body file to send as the Content-length, or
+        # None to send it with chunked transfer encoding. Chunked encoding is
+        # used when requested with a header, or when the file is not a
+        # regular file (for example, a named pipe) and has no known size.
+        transfer_encoding = self.request.get_header("Transfer-Encoding")
+        if transfer_encoding and "chunked" in transfer_encoding.lower():
+            return None
+        import stat
+        status = os.stat(self.request.body_file)
+        if not stat.S_ISREG(status.st_mode):
+            return None
+        return status.st_size
+
+    def _get_port(self):
+        # Return the port to connect to, using the protocol's default.
+        if self.request.port:
+            return int(self.request.port)
+        if self.request.protocol == "https":
+            return 443
+        return 80
+
 
 class HttpClientRequestThread(HttpRequestThread):
+    def __init__(self, request, settings, **kwargs):
+        HttpRequestThread.__init__(self, request, settings, **kwargs)
+        self._dns_cache = get_dns_cache(settings)
+        self._conn = None
+
+    def _abort(self):
+        # Shut down the socket to wake a blocked send or receive. Closing
+        # it alone does not interrupt another thread's recv().
+        sock = getattr(self._conn, "sock", None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except (OSError, socket.error):
+                pass
+
     def run(self):
         """Method to run when the thread is started."""
 
         if not self._validate_request():
             return
 
-        # Determine the class to use for the connection.
+        # Create the connection.
         if self.request.protocol == "https":
             try:
-                connection_class = HTTPSConnection
-            except NameError:
-                message = "Your Python interpreter does not have SSL. " \
-                          "If you have cURL installed, set the http_client " \
-                          "setting to \"curl\"."
-                sublime.error_message(message)
-                self.message = "Unable to make HTTPS requests."
+                connection_class = tls.ResumingHTTPSConnection
+            except AttributeError:
+                self.message = "Unable to make HTTPS requests. " \
+                               "Your Python interpreter does not have SSL. " \
+                               "If you have cURL installed, set the " \
+                               "http_client setting to \"curl\"."
                 self.success = False
                 return
+            conn = connection_class(self.request.host,
+                                    port=self.request.port,
+                                    timeout=self._timeout,
+                                    profile=self._tls_profile)
 
         else:
-            connection_class = HTTPConnection
+            conn = HTTPConnection(self.request.host,
+                                  port=self.request.port,
+                                  timeout=self._timeout)
 
-        # Create the connection.
-        conn = connection_class(self.request.host,
-                                port=self.request.port,
-                                timeout=self._timeout)
+        # Resolve the host through the shared cache.
+        if self._dns_cache:
+            conn._create_connection = self._dns_cache.create_connection
+        self._conn = conn
 
         try:
 
-            # Body: encode and add Content-length header
+            # Body: encode and add Content-length header, or stream the
+            # body file with its size or in chunks.
             body_bytes = None
-            if self.request.body:
+            chunked = False
+            if self.request.body_file:
+                size = self._get_body_file_size()
+                if size is None:
+                    chunked = True
+                    if not self.request.get_header("Transfer-Encoding"):
+                        self.request.headers.append(
+                            ("Transfer-Encoding", "chunked"))
+                elif not self.request.get_header("Content-length"):
+                    self.request.headers.append(("Content-length", size))
+            elif self.request.body:
                 body_bytes = self.request.body.encode(self._encoding)
                 if not self.request.get_header("Content-length"):
                     self.request.headers.append(("Content-length", len(body_bytes)))
@@ -179,8 +726,16 @@ class HttpClientRequestThread(HttpRequestThread):
             conn.endheaders()
 
             # Body
-            if body_bytes:
+            if self.request.body_file:
+                self._send_body_file(conn, chunked)
+            elif body_bytes:
                 conn.send(body_bytes)
+            self.trace.mark("send")
+
+            # The connection may have been made after a cancel.
+            if self.cancelled:
+                conn.close()
+                return
 
         except socket.gaierror:
             self.message = "Unable to make request. " \
@@ -189,10 +744,24 @@ class HttpClientRequestThread(HttpRequestThread):
             conn.close()
             return
 
+        except SSLError as e:
+            self.message = "TLS handshake failed. " + str(e)
+            self.success = False
+            conn.close()
+            return
+
+        except socket.timeout:
+            self.message = "Request timed out."
+            self.failure = "timeout"
+            self.success = False
+            conn.close()
+            return
+
         except OSError as e:
             if e.errno != errno.ECONNREFUSED:
                 raise
             self.message = "Connection refused."
+            self.failure = "connect"
             self.success = False
             conn.close()
             return
@@ -202,8 +771,16 @@ class HttpClientRequestThread(HttpRequestThread):
         try:
             time_start = time.time()
             resp = conn.getresponse()
+            self.trace.mark("response_headers")
         except socket.timeout:
             self.message = "Request timed out."
+            self.failure = "timeout"
+            self.success = False
+            conn.close()
+            return
+        except (socket.error, HTTPException) as e:
+            self.message = "Unable to read response. " + str(e)
+            self.failure = "connect"
             self.success = False
             conn.close()
             return
@@ -214,12 +791,50 @@ class HttpClientRequestThread(HttpRequestThread):
             return
 
         # Read the response
-        self._read_response(resp)
+        try:
+            self._read_response(resp)
+        except socket.timeout:
+            self.response = None
+            self.message = "Request timed out reading the response body."
+            self.failure = "timeout"
+            self.success = False
+            conn.close()
+            return
+        except (socket.error, HTTPException) as e:
+            self.response = None
+            self.message = "Unable to read response body. " + str(e)
+            self.failure = "connect"
+            self.success = False
+            conn.close()
+            return
         time_end = time.time()
         self.elapsed = time_end - time_start
+
+        # Keep the TLS session for the next connection to this host.
+        if self.request.protocol == "https":
+            self.tls_resumed = conn.session_reused
+            self.tls_handshake_elapsed = conn.handshake_elapsed
+            conn.store_session()
         conn.close()
         self.success = True
 
+    def _send_body_file(self, conn, chunked):
+        # Send the body file a chunk at a time, so it is never fully read
+        # into memory.
+        with open(self.request.body_file, "rb") as body_file:
+            while True:
+                chunk = body_file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if chunked:
+                    conn.send(("%x\r\n" % len(chunk)).encode("ascii"))
+                    conn.send(chunk)
+                    conn.send(b"\r\n")
+                else:
+                    conn.send(chunk)
+        if chunked:
+            conn.send(b"0\r\n\r\n")
+
     def _read_response(self, resp):
 
         # Read the HTTPResponse and populate the response member.
@@ -236,8 +851,43 @@ class HttpClientRequestThread(HttpRequestThread):
         # Headers
         self.response.headers = resp.getheaders()
 
-        # Body
-        self.response.body = self._read_body(resp.read())
+        # Body. An error response's body is read into memory, so that it
+        # does not replace the download file.
+        if self._download and resp.status < 400:
+            self._download_body(resp)
+            self.trace.mark("download")
+            return
+        body_bytes = resp.read()
+        self.trace.mark("read")
+        self._store_body(body_bytes)
+
+    def _download_body(self, resp):
+        # Stream the raw body to the download file, decompressing on the way
+        # if requested.
+        decompressor = None
+        content_encoding = (resp.getheader("content-encoding") or "").lower()
+        if self._download_decompress and \
+                ("gzip" in content_encoding or "deflate" in content_encoding):
+            decompressor = zlib.decompressobj(15 + 32)
+
+        length = resp.getheader("content-length")
+        if length and length.isdigit():
+            self.download_size = int(length)
+
+        with open(self._download_part, "wb") as download:
+            while True:
+                chunk = resp.read(DOWNLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                self.bytes_downloaded += len(chunk)
+                if decompressor:
+                    chunk = decompressor.decompress(chunk)
+                download.write(chunk)
+            if decompressor:
+                download.write(decompressor.flush())
+            self.response.body_size = download.tell()
+        replace_file(self._download_part, self._download)
+        self.response.download_file = self._download
 
 
 class CurlRequestThread(HttpRequestThread):
@@ -245,18 +895,56 @@ class CurlRequestThread(HttpRequestThread):
         HttpRequestThread.__init__(self, request, settings, **kwargs)
         self._curl_command = settings.get("curl_command", "curl")
         self._curl_options = settings.get("curl_options", [])
+        self._resolve = settings.get("resolve", {})
         self._request_body_file = None
+        self._header_file = None
+        self._curl = None
+        self._curl_lock = threading.Lock()
+
+    def _abort(self):
+        with self._curl_lock:
+            if self._curl is not None and self._curl.poll() is None:
+                self._curl.kill()
+
+    def get_download_progress(self):
+        # cURL writes the download itself, so check the size of the file.
+        if self._download and os.path.exists(self._download_part):
+            try:
+                return os.path.getsize(self._download_part), None
+            except OSError:
+                pass
+        return 0, None
 
     def run(self):
 
         if not self._validate_request():
             return
 
-        # Build the list of arguments to run cURL.
-        curl = subprocess.Popen(self._get_args(), stdout=subprocess.PIPE)
+        import subprocess
+
+        # Build the list of arguments to run cURL. Hold the lock so a cancel
+        # either prevents the process or sees it and kills it.
+        args = self._get_args()
+        with self._curl_lock:
+            if self.cancelled:
+                self._remove_header_file()
+                if self._request_body_file:
+                    os.remove(self._request_body_file)
+                return
+            stdin = None
+            if self.request.body_file:
+                stdin = open(self.request.body_file, "rb")
+            try:
+                curl = subprocess.Popen(args, stdin=stdin,
+                                        stdout=subprocess.PIPE)
+            finally:
+                if stdin is not None:
+                    stdin.close()
+            self._curl = curl
         time_start = time.time()
         output = curl.communicate()[0]
         time_end = time.time()
+        self.trace.mark("curl")
         self.elapsed = time_end - time_start
         returncode = curl.returncode
 
@@ -265,11 +953,18 @@ class CurlRequestThread(HttpRequestThread):
             os.remove(self._request_body_file)
 
         if returncode != 0:
+            self._remove_header_file()
             self._read_curl_error(returncode)
             self.success = False
             return
 
         self._read_response(output)
+        self._remove_header_file()
+
+    def _remove_header_file(self):
+        if self._header_file:
+            os.remove(self._header_file)
+            self._header_file = None
 
     def _get_args(self):
 
@@ -282,7 +977,21 @@ class CurlRequestThread(HttpRequestThread):
         extra += "\"size_download\": %{size_download}"
         extra += "}"
 
-        args = [self._curl_command, "--include", "--write-out", extra]
+        args = [self._curl_command, "--write-out", extra]
+
+        # Write the body to stdout following the headers, or stream it to the
+        # download file and write the headers to a temporary file.
+        if self._download:
+            import tempfile
+            header_file = tempfile.NamedTemporaryFile(delete=False)
+            header_file.close()
+            self._header_file = header_file.name
+            args += ["--dump-header", self._header_file,
+                     "--output", self._download_part]
+            if self._download_decompress:
+                args.append("--compressed")
+        else:
+            args.append("--include")
 
         if self._timeout:
             args += ["--max-time", str(self._timeout)]
@@ -302,9 +1011,34 @@ class CurlRequestThread(HttpRequestThread):
             args += ['--header', header]
 
         # Body
-        if self.request.method in ("POST", "PUT", "PATCH") and \
+        if self.request.body_file:
+
+            # Let cURL stream the file from stdin. Naming the file instead
+            # would append its name to URIs that end in a slash. Give the
+            # file's size as the Content-length, unless the request is
+            # chunked.
+            size = self._get_body_file_size()
+            if self.request.get_header("Transfer-Encoding"):
+                pass
+            elif size is None:
+                args += ["--header", "Transfer-Encoding: chunked"]
+            else:
+                # cURL sends stdin chunked unless told not to.
+                if not self.request.get_header("Content-length"):
+                    args += ["--header", "Content-length: %d" % size]
+                args += ["--header", "Transfer-Encoding:"]
+            args += ["--upload-file", "-"]
+
+            # --upload-file implies PUT, so always give the method.
+            if "--request" not in args:
+                args += ["--request", self.request.method]
+
+        elif self.request.method in ("POST", "PUT", "PATCH") and \
                 self.request.body:
 
+            import codecs
+            import tempfile
+
             # Open a temporary file to write the request body to.
             # (Note: Using codecs to support Python 2.6)
             tmpfile = tempfile.NamedTemporaryFile("w", delete=False)
@@ -320,6 +1054,14 @@ class CurlRequestThread(HttpRequestThread):
             # Store the temporary file's filename for later deletion.
             self._request_body_file = filename
 
+        # TLS options
+        if self.request.protocol == "https":
+            args += get_curl_tls_args(self._tls_profile)
+
+        # Manual host overrides
+        args += get_curl_resolve_args(self._resolve, self.request.host,
+                                      self._get_port())
+
         args += self._curl_options
 
         # URI
@@ -339,8 +1081,13 @@ class CurlRequestThread(HttpRequestThread):
         size_download = meta["size_download"]
 
         # Extract the headers and body
-        headers = curl_output[0:size_header]
-        body = curl_output[size_header:size_header + size_download]
+        if self._download:
+            with open(self._header_file, "rb") as header_file:
+                headers = header_file.read()
+            body = None
+        else:
+            headers = curl_output[0:size_header]
+            body = curl_output[size_header:size_header + size_download]
 
         # Parse the headers as ASCII
         headers = headers.decode("ascii")
@@ -374,8 +1121,19 @@ class CurlRequestThread(HttpRequestThread):
                 (key, value) = header.split(":", 1)
                 self.response.headers.append((key.strip(), value.strip()))
 
-        # Read the body
-        self.response.body = self._read_body(body)
+        # Read the body. Keep the download only for a successful response.
+        # cURL does not create the file for an empty body.
+        if self._download and not os.path.exists(self._download_part):
+            open(self._download_part, "wb").close()
+        if self._download and self.response.status < 400:
+            replace_file(self._download_part, self._download)
+            self.response.download_file = self._download
+            self.response.body_size = os.path.getsize(self._download)
+        elif self._download:
+            with open(self._download_part, "rb") as download:
+                self._store_body(download.read())
+        else:
+            self._store_body(body)
         self.success = True
 
     def _read_curl_error(self, code):
@@ -390,12 +1148,30 @@ class CurlRequestThread(HttpRequestThread):
         # CURLE_COULDNT_RESOLVE_HOST
         elif code == 7:
             self.message = "Unable to connect."
+            self.failure = "connect"
         # CURLE_COULDNT_RESOLVE_HOST
         elif code == 28:
             self.message = "Operation timed out."
+            self.failure = "timeout"
         else:
             self.message = "cURL exited with error code " + str(code)
 
 
+class _TokenSettings(object):
+    # Settings for fetching a token on behalf of a request, without the
+    # options that apply only to the request itself.
+
+    IGNORE = ("cookies", "deadline", "download", "filter", "oauth2",
+              "profile")
+
+    def __init__(self, settings):
+        self._settings = settings
+
+    def get(self, key, default=None):
+        if key in self.IGNORE:
+            return default
+        return self._settings.get(key, default)
+
+
 class DecodeError(Exception):
     pass
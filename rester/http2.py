@@ -0,0 +1,423 @@
+"""
+HTTP/2 client that multiplexes requests to the same host over one connection
+
+Requires the h2 package. Connections are negotiated with ALPN; servers that
+do not select h2 (and all plain http requests) fall back to HTTP/1.1 using
+the http.client based client.
+"""
+
+import io
+import socket
+import threading
+import time
+
+from .http import HttpClientRequestThread
+from .message import Response
+from .tls import SSLError
+from .tls import get_session
+from .tls import get_ssl_context
+from .tls import store_session
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.events
+except ImportError:
+    h2 = None
+
+try:
+    from http.client import responses
+except ImportError:
+    # Python 2
+    from httplib import responses
+
+ALPN_PROTOCOLS = ("h2", "http/1.1")
+
+# Headers that must not be sent on an HTTP/2 connection.
+CONNECTION_HEADERS = ("connection", "host", "keep-alive", "proxy-connection",
+                      "transfer-encoding", "upgrade")
+
+# Seconds a thread waits for another to read frames before checking again.
+WAIT_INTERVAL = 1.0
+
+_connections = {}
+_http11_hosts = set()
+_pool_lock = threading.Lock()
+
+# Held while connecting to a key, so that other hosts are not held up by a
+# slow connect or handshake.
+_key_locks = {}
+
+_warned_no_h2 = False
+
+
+class _Stream(object):
+    def __init__(self):
+        self.headers = None
+        self.data = []
+        self.ended = False
+        self.error = None
+
+
+class Http2Connection(object):
+    """A TLS connection carrying any number of concurrent request streams
+
+    Any thread may send a request and wait for its response. While one
+    thread reads from the socket, the others wait on a condition; frames for
+    every stream are dispatched as they arrive, so responses complete in
+    whatever order the server sends them.
+    """
+
+    def __init__(self, host, port, timeout, profile, create_connection=None):
+        self.host = host
+        self.port = port
+        self.closed = False
+        self.session_reused = None
+        self.handshake_elapsed = None
+
+        create_connection = create_connection or socket.create_connection
+        sock = create_connection((host, port), timeout)
+        context = get_ssl_context(profile, ALPN_PROTOCOLS)
+        session_key = (profile, host, port, "h2")
+        kwargs = {"server_hostname": host}
+        session = get_session(session_key)
+        if session is not None:
+            kwargs["session"] = session
+        time_start = time.time()
+        try:
+            self._sock = context.wrap_socket(sock, **kwargs)
+        except Exception:
+            sock.close()
+            raise
+        self.handshake_elapsed = time.time() - time_start
+        self.session_reused = self._sock.session_reused
+        self._session_key = session_key
+        self.protocol = self._sock.selected_alpn_protocol()
+
+        self._cond = threading.Condition()
+        self._reading = False
+        self._streams = {}
+        if self.protocol == "h2":
+            config = h2.config.H2Configuration(client_side=True,
+                                               header_encoding="utf-8")
+            self._conn = h2.connection.H2Connection(config=config)
+            self._conn.initiate_connection()
+            self._flush()
+
+    def close(self):
+        with self._cond:
+            self._fail(ConnectionError("Connection closed."))
+            self._cond.notify_all()
+
+    def request(self, method, authority, path, headers, body=None):
+        """Send a request on a new stream and return the stream id.
+
+        body may be bytes or a file object opened for binary reading.
+        """
+        pseudo = [(":method", method), (":scheme", "https"),
+                  (":authority", authority), (":path", path)]
+        fields = [(str(key).lower(), str(value)) for key, value in headers
+                  if str(key).lower() not in CONNECTION_HEADERS]
+        with self._cond:
+            if self.closed:
+                raise ConnectionError("Connection closed.")
+            stream_id = self._conn.get_next_available_stream_id()
+            self._streams[stream_id] = _Stream()
+            self._conn.send_headers(stream_id, pseudo + fields,
+                                    end_stream=not body)
+            self._flush()
+            if body:
+                if isinstance(body, bytes):
+                    body = io.BytesIO(body)
+                self._send_body(stream_id, body)
+        return stream_id
+
+    def get_response(self, stream_id):
+        """Block until the stream ends. Return (headers, body_bytes)."""
+        with self._cond:
+            stream = self._streams[stream_id]
+            while not stream.ended:
+                if self._reading:
+                    self._cond.wait(WAIT_INTERVAL)
+                    continue
+                self._read_once()
+            del self._streams[stream_id]
+        if stream.error:
+            raise stream.error
+        return stream.headers, b"".join(stream.data)
+
+    def reset_stream(self, stream_id):
+        """Cancel a stream, waking the thread waiting for its response."""
+        with self._cond:
+            stream = self._streams.get(stream_id)
+            if stream is None or stream.ended:
+                return
+            stream.error = ConnectionError("Stream cancelled.")
+            stream.ended = True
+            if not self.closed:
+                # The ping's acknowledgement wakes a thread blocked reading
+                # the socket, so it sees the stream has ended.
+                try:
+                    self._conn.reset_stream(stream_id)
+                    self._conn.ping(b"rester\x00\x00")
+                    self._flush()
+                except Exception:
+                    pass
+            self._cond.notify_all()
+
+    def store_session(self):
+        session = getattr(self._sock, "session", None)
+        if session is not None:
+            store_session(self._session_key, session)
+
+    def _send_body(self, stream_id, body):
+        # Send the body in frames that fit the flow-control window, reading
+        # from the socket to receive window updates when it is exhausted.
+        while True:
+            window = min(self._conn.local_flow_control_window(stream_id),
+                         self._conn.max_outbound_frame_size)
+            if window <= 0:
+                if self._reading:
+                    self._cond.wait(WAIT_INTERVAL)
+                else:
+                    self._read_once()
+                if self._streams[stream_id].ended:
+                    return
+                continue
+            chunk = body.read(window)
+            if not chunk:
+                self._conn.end_stream(stream_id)
+                self._flush()
+                return
+            self._conn.send_data(stream_id, chunk)
+            self._flush()
+
+    def _read_once(self):
+        # Read from the socket without holding the lock, then dispatch the
+        # frames while holding it. Must be called with the lock held.
+        self._reading = True
+        self._cond.release()
+        error = None
+        try:
+            data = self._sock.recv(65535)
+        except (socket.error, socket.timeout) as e:
+            data, error = None, e
+        finally:
+            self._cond.acquire()
+            self._reading = False
+        try:
+            if data:
+                self._receive(data)
+            else:
+                self._fail(error or ConnectionError("Connection closed."))
+        except Exception as e:
+            # A protocol error leaves the connection unusable.
+            self._fail(ConnectionError("HTTP/2 error. " + str(e)))
+            raise
+        finally:
+            self._cond.notify_all()
+
+    def _receive(self, data):
+        for event in self._conn.receive_data(data):
+            stream = self._streams.get(getattr(event, "stream_id", None))
+            if isinstance(event, h2.events.ResponseReceived) and stream:
+                stream.headers = event.headers
+            elif isinstance(event, h2.events.DataReceived):
+                self._conn.acknowledge_received_data(
+                    event.flow_controlled_length, event.stream_id)
+                if stream:
+                    stream.data.append(event.data)
+            elif isinstance(event, h2.events.StreamEnded) and stream:
+                stream.ended = True
+            elif isinstance(event, h2.events.StreamReset) and stream:
+                stream.error = ConnectionError(
+                    "Stream reset with error code %d." % event.error_code)
+                stream.ended = True
+            elif isinstance(event, h2.events.ConnectionTerminated):
+                self._fail(ConnectionError("Connection terminated by server."))
+        self._flush()
+
+    def _fail(self, error):
+        # Close the connection and end every stream with the error.
+        self.closed = True
+        for stream in self._streams.values():
+            if not stream.ended:
+                stream.error = error
+                stream.ended = True
+        try:
+            self._sock.close()
+        except socket.error:
+            pass
+
+    def _flush(self):
+        if self.closed:
+            return
+        data = self._conn.data_to_send()
+        if data:
+            self._sock.sendall(data)
+
+
+def _get_connection(key, timeout, profile, create_connection):
+    # Return an open Http2Connection for the key, or None for hosts that do
+    # not speak HTTP/2.
+    with _pool_lock:
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+    with key_lock:
+        with _pool_lock:
+            if key in _http11_hosts:
+                return None, False
+            conn = _connections.get(key)
+            if conn is not None and not conn.closed:
+                return conn, False
+        host, port = key[0], key[1]
+        conn = Http2Connection(host, port, timeout, profile, create_connection)
+        with _pool_lock:
+            if conn.protocol != "h2":
+                conn._sock.close()
+                _http11_hosts.add(key)
+                return None, False
+            _connections[key] = conn
+        return conn, True
+
+
+def close_connections():
+    """Close every pooled HTTP/2 connection."""
+    with _pool_lock:
+        for conn in _connections.values():
+            conn.close()
+        _connections.clear()
+        _http11_hosts.clear()
+
+
+class Http2RequestThread(HttpClientRequestThread):
+    """Request thread that uses a pooled HTTP/2 connection when possible"""
+
+    def __init__(self, request, settings, **kwargs):
+        HttpClientRequestThread.__init__(self, request, settings, **kwargs)
+        self._stream = None
+
+    def _abort(self):
+        # Reset only this request's stream. The connection stays open for
+        # the other streams.
+        if self._stream is not None:
+            conn, stream_id = self._stream
+            conn.reset_stream(stream_id)
+        else:
+            HttpClientRequestThread._abort(self)
+
+    def run(self):
+        global _warned_no_h2
+
+        if not self._validate_request():
+            return
+
+        # HTTP/2 is negotiated with ALPN, so only HTTPS can use it.
+        if h2 is None or self.request.protocol != "https":
+            if h2 is None and not _warned_no_h2:
+                _warned_no_h2 = True
+                print("The h2 package is not installed. Using HTTP/1.1.")
+            HttpClientRequestThread.run(self)
+            return
+
+        port = self._get_port()
+        key = (self.request.host, port, self._tls_profile)
+        create_connection = None
+        if self._dns_cache:
+            create_connection = self._dns_cache.create_connection
+
+        try:
+            conn, created = _get_connection(key, self._timeout,
+                                            self._tls_profile,
+                                            create_connection)
+        except socket.gaierror:
+            self.message = "Unable to make request. " \
+                           "Make sure the hostname is valid."
+            self.success = False
+            return
+        except SSLError as e:
+            self.message = "TLS handshake failed. " + str(e)
+            self.success = False
+            return
+        except socket.timeout:
+            self.message = "Request timed out."
+            self.failure = "timeout"
+            self.success = False
+            return
+        except socket.error:
+            self.message = "Connection refused."
+            self.failure = "connect"
+            self.success = False
+            return
+
+        if conn is None:
+            # ALPN selected HTTP/1.1.
+            HttpClientRequestThread.run(self)
+            return
+
+        self.trace.mark("connect")
+        if created:
+            self.tls_resumed = conn.session_reused
+            self.tls_handshake_elapsed = conn.handshake_elapsed
+
+        body = body_file = None
+        if self.request.body_file:
+            size = self._get_body_file_size()
+            if size is not None and \
+                    not self.request.get_header("Content-length"):
+                self.request.headers.append(("Content-length", size))
+            body = body_file = open(self.request.body_file, "rb")
+        elif self.request.body:
+            body = self.request.body.encode(self._encoding)
+
+        authority = self.request.get_header("host") or self.request.host
+        if self.request.port:
+            authority = "%s:%s" % (self.request.host, self.request.port)
+
+        try:
+            time_start = time.time()
+            stream_id = conn.request(self.request.method, authority,
+                                     self.request.full_path,
+                                     self.request.headers, body)
+            self._stream = (conn, stream_id)
+            if self.cancelled:
+                conn.reset_stream(stream_id)
+            self.trace.mark("send")
+            headers, body = conn.get_response(stream_id)
+            self.trace.mark("read")
+        except socket.timeout:
+            self.message = "Request timed out."
+            self.failure = "timeout"
+            self.success = False
+            return
+        except socket.error as e:
+            self.message = "Unable to read response. " + str(e)
+            self.failure = "connect"
+            self.success = False
+            return
+        except Exception:
+            self.message = "Unexpected error making request."
+            self.success = False
+            return
+        finally:
+            if body_file:
+                body_file.close()
+
+        self._read_h2_response(headers, body)
+        self.elapsed = time.time() - time_start
+        if created:
+            conn.store_session()
+        self.success = True
+
+    def _read_h2_response(self, headers, body):
+        self.response = Response()
+        self.response.protocol = "HTTP/2"
+        for key, value in headers or []:
+            if key == ":status":
+                self.response.status = int(value)
+                self.response.reason = responses.get(int(value), "")
+            elif not key.startswith(":"):
+                self.response.headers.append((key, value))
+        if self._download:
+            self._write_download(body)
+            return
+        self._store_body(body)
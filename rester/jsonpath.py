@@ -0,0 +1,345 @@
+"""
+A small JSONPath evaluator for capturing values from responses
+
+Supports the root ($), child names (.name or ['name']), array indexes
+([0], [-1]), wildcards (.* or [*]), and recursive descent (..name).
+
+find_in_stream() evaluates a path over JSON text read a chunk at a time.
+Only the values the path matches are built; everything else is scanned
+past, so a filter over a large response needs little memory.
+"""
+
+import json
+import re
+
+from collections import deque
+
+RE_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+# Characters that may follow a complete value.
+DELIMITERS = " \t\n\r,:]}"
+
+RE_TOKEN = re.compile(r"""
+    \.\.(?P<descend>[_a-zA-Z0-9\-]+|\*)   # ..name
+    | \.(?P<name>[_a-zA-Z0-9\-]+|\*)      # .name
+    | \[\s*(?P<index>-?\d+)\s*\]          # [0]
+    | \[\s*(?P<quote>['"])(?P<key>.*?)(?P=quote)\s*\]  # ['name']
+    | \[\s*(?P<star>\*)\s*\]              # [*]
+""", re.VERBOSE)
+
+
+class JsonPathError(ValueError):
+    pass
+
+
+def parse(path):
+    """Return a list of (operation, argument) steps for a path.
+
+    operation is "child", "index", "wildcard", or "descend".
+    """
+    path = path.strip()
+    if not path.startswith("$"):
+        raise JsonPathError("JSON paths must start with $: " + path)
+    steps = []
+    position = 1
+    while position < len(path):
+        match = RE_TOKEN.match(path, position)
+        if not match:
+            raise JsonPathError("Unable to parse JSON path %s at %d" %
+                                (path, position))
+        if match.group("descend"):
+            steps.append(("descend", match.group("descend")))
+        elif match.group("name") == "*" or match.group("star"):
+            steps.append(("wildcard", None))
+        elif match.group("name"):
+            steps.append(("child", match.group("name")))
+        elif match.group("index") is not None:
+            steps.append(("index", int(match.group("index"))))
+        else:
+            steps.append(("child", match.group("key")))
+        position = match.end()
+    return steps
+
+
+def find(data, path):
+    """Return a list of the values in data that path matches."""
+    matches = [data]
+    for operation, argument in parse(path):
+        found = []
+        for value in matches:
+            if operation == "child":
+                if isinstance(value, dict) and argument in value:
+                    found.append(value[argument])
+            elif operation == "index":
+                if isinstance(value, list) and \
+                        -len(value) <= argument < len(value):
+                    found.append(value[argument])
+            elif operation == "wildcard":
+                found.extend(_children(value))
+            else:
+                found.extend(_descend(value, argument))
+        matches = found
+    return matches
+
+
+def first(data, path, default=None):
+    """Return the first value in data that path matches, or default."""
+    matches = find(data, path)
+    return matches[0] if matches else default
+
+
+def _children(value):
+    if isinstance(value, dict):
+        return list(value.values())
+    if isinstance(value, list):
+        return list(value)
+    return []
+
+
+def _descend(value, name):
+    # Return the values named name (or all values for *) at any depth.
+    found = []
+    queue = deque([value])
+    while queue:
+        current = queue.popleft()
+        if isinstance(current, dict):
+            if name == "*":
+                found.extend(current.values())
+            elif name in current:
+                found.append(current[name])
+        queue.extend(_children(current))
+    return found
+
+
+def is_definite(path):
+    """True if path matches at most one value (no wildcards, recursive
+    descent, or negative indexes)."""
+    return all(operation == "child" or
+               (operation == "index" and argument >= 0)
+               for operation, argument in parse(path))
+
+
+def _advance(steps, states, key):
+    # Return the states reached by stepping into the child key (a str for
+    # an object member, an int for an array element) from states, where
+    # each state is the number of steps matched so far.
+    reached = set()
+    for state in states:
+        if state == len(steps):
+            continue
+        operation, argument = steps[state]
+        if operation == "child":
+            if key == argument:
+                reached.add(state + 1)
+        elif operation == "index":
+            if key == argument:
+                reached.add(state + 1)
+        elif operation == "wildcard":
+            reached.add(state + 1)
+        else:
+            if not isinstance(key, int) and argument in ("*", key):
+                reached.add(state + 1)
+            # Recursive descent also matches deeper down.
+            reached.add(state)
+    return reached
+
+
+def _walk(value, steps, states):
+    # Yield the values below value that states lead to, in document order.
+    if len(states) == 1:
+        state = next(iter(states))
+        operation, argument = steps[state]
+        if operation != "descend":
+            # Without recursive descent only one state is ever reached, so
+            # look the child up instead of stepping into every member.
+            if operation == "wildcard":
+                children = _children(value)
+            elif operation == "child":
+                children = [value[argument]] if isinstance(value, dict) and \
+                    argument in value else []
+            else:
+                children = [value[argument]] if isinstance(value, list) and \
+                    argument < len(value) else []
+            for child in children:
+                if state + 1 == len(steps):
+                    yield child
+                else:
+                    for match in _walk(child, steps, set([state + 1])):
+                        yield match
+            return
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list):
+        items = enumerate(value)
+    else:
+        return
+    for key, child in items:
+        reached = _advance(steps, states, key)
+        if len(steps) in reached:
+            yield child
+        if reached - set([len(steps)]):
+            for match in _walk(child, steps, reached):
+                yield match
+
+
+class _Scanner(object):
+    """Reads JSON values from text arriving in chunks"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = ""
+        self._position = 0
+        self._done = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self, size=1):
+        # Read chunks until at least size characters are buffered past the
+        # position. Return False at the end of the text.
+        if self._position:
+            self._buffer = self._buffer[self._position:]
+            self._position = 0
+        pieces = [self._buffer]
+        length = len(self._buffer)
+        while length < size and not self._done:
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                self._done = True
+                break
+            pieces.append(chunk)
+            length += len(chunk)
+        self._buffer = "".join(pieces)
+        return len(self._buffer) >= size
+
+    def peek(self):
+        """Return the next character that is not whitespace, or ""."""
+        while True:
+            self._position = RE_WHITESPACE.match(
+                self._buffer, self._position).end()
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+            if not self._fill():
+                return ""
+
+    def expect(self, characters):
+        character = self.peek()
+        if not character or character not in characters:
+            raise ValueError("Expected %s at %r" % (
+                " or ".join(characters), self._buffer[self._position:
+                                                      self._position + 20]))
+        self._position += 1
+        return character
+
+    def _ends_at(self, end):
+        # Return True if a value decoded up to end is complete. A number
+        # cut at a chunk boundary ("-3000" of "-300000.5") still decodes,
+        # so a value must be followed by a delimiter or the end of the text.
+        if self._done or self._buffer[end - 1] in "\"]}":
+            return True
+        return end < len(self._buffer) and self._buffer[end] in DELIMITERS
+
+    def read_buffered_value(self):
+        """Build the next value if it ends within the text already read.
+        Return (True, value), or (False, None) without moving."""
+        self.peek()
+        try:
+            value, end = self._decoder.raw_decode(self._buffer,
+                                                  self._position)
+        except ValueError:
+            return False, None
+        if not self._ends_at(end):
+            return False, None
+        self._position = end
+        return True, value
+
+    def read_value(self):
+        """Build the next value. Values not followed by a delimiter are
+        read again with more text, since a number may continue."""
+        self.peek()
+        size = len(self._buffer) - self._position
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer,
+                                                      self._position)
+            except ValueError:
+                if self._done:
+                    raise
+                end = None
+            if end is not None and self._ends_at(end):
+                self._position = end
+                return value
+            # Double what is buffered, so a large value is not parsed
+            # over and over.
+            size *= 2
+            self._fill(size)
+
+
+def _match(scanner, steps, states):
+    # Yield the matches in the value at the scanner's position. Containers
+    # that end within the text already read are built with the json module
+    # and matched in memory; larger ones are scanned a member at a time.
+    if len(steps) in states:
+        value = scanner.read_value()
+        yield value
+        states = states - set([len(steps)])
+        if states:
+            for match in _walk(value, steps, states):
+                yield match
+        return
+    if scanner.peek() not in ("{", "["):
+        scanner.read_value()
+        return
+    complete, value = scanner.read_buffered_value()
+    if complete:
+        if states:
+            for match in _walk(value, steps, states):
+                yield match
+        return
+    # Scan even a container nothing in can match, so that it is never
+    # held in memory whole.
+    for match in _scan(scanner, steps, states):
+        yield match
+
+
+def _scan(scanner, steps, states):
+    # Yield the matches in the container at the scanner's position.
+    opening = scanner.expect("{[")
+    closing = "}" if opening == "{" else "]"
+    index = 0
+    if scanner.peek() == closing:
+        scanner.expect(closing)
+        return
+    while True:
+        if opening == "{":
+            if scanner.peek() != '"':
+                raise ValueError("Expected an object key.")
+            key = scanner.read_value()
+            scanner.expect(":")
+        else:
+            key = index
+            index += 1
+        for match in _match(scanner, steps, _advance(steps, states, key)):
+            yield match
+        if scanner.expect("," + closing) == closing:
+            return
+
+
+def find_in_stream(chunks, path):
+    """Yield the values path matches in JSON text read from chunks, in
+    document order.
+
+    chunks is an iterable of str. Raises ValueError if the text is not
+    valid JSON. Negative indexes need the length of an array, so paths
+    with them are evaluated after reading the whole value.
+    """
+    steps = parse(path)
+    scanner = _Scanner(chunks)
+    if any(operation == "index" and argument < 0
+           for operation, argument in steps):
+        for match in find(scanner.read_value(), path):
+            yield match
+    else:
+        for match in _match(scanner, steps, set([0])):
+            yield match
+    if scanner.peek():
+        raise ValueError("Extra data after the JSON value.")
@@ -0,0 +1,386 @@
+"""
+Load testing with a pool of worker processes
+
+Reading, decompressing, and decoding responses is CPU-bound, so threads in
+one interpreter are limited to one core. Here the requests of a file are
+sent from several worker processes, each running the parser and HTTP client
+with its own threads. Each worker counts its results in a LoadStats, with
+latencies in a Histogram, so its memory does not grow with the number of
+requests. The workers' stats are merged into one LoadReport.
+
+There are two ways to apply load:
+
+- Closed loop: a fixed number of requests, with a fixed number in flight.
+  Each request is sent when a previous one completes, so a server that
+  stalls also slows the load, and the stall barely shows in the latencies.
+- Open loop: requests are due at a constant rate for a duration, whether or
+  not earlier ones have completed. Latency is measured from when each
+  request was due, so time spent waiting to be sent counts too. Requests
+  due when max_in_flight are already in flight are dropped and counted.
+
+Workers are started with multiprocessing, so this runs from the command
+line (see cli.py) rather than inside the Sublime Text plugin host.
+"""
+
+import threading
+import time
+
+from .histogram import Histogram
+from .parse import extract_variables
+from .parse import split_blocks
+from .runner import prepare_request
+from .runner import run_request
+from .util import normalize_line_endings
+
+PERCENTILES = (50, 90, 95, 99, 99.9, 99.99, 100)
+
+# Use a monotonic clock for latencies when the interpreter has one.
+_clock = getattr(time, "monotonic", time.time)
+
+
+class LoadError(Exception):
+    pass
+
+
+def split_evenly(total, parts):
+    """Return a list of parts integers that add up to total."""
+    return [total // parts + (1 if i < total % parts else 0)
+            for i in range(parts)]
+
+
+class LoadStats(object):
+    """Counts and latencies of the requests sent by a load test"""
+
+    def __init__(self):
+        self.histogram = Histogram()
+        self.count = 0
+        self.errors = 0
+        self.failed = 0
+        self.bytes = 0
+        self.statuses = {}
+        self.sent = 0
+        self.dropped = 0
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def add(self, latency, status, size, message=None):
+        """Count a completed request."""
+        with self._lock:
+            self.histogram.record(latency)
+            self.count += 1
+            self.bytes += size
+            if message is not None:
+                self.errors += 1
+                self.failed += 1
+            else:
+                self.statuses[status] = self.statuses.get(status, 0) + 1
+                if status >= 400:
+                    self.failed += 1
+
+    def merge(self, other):
+        """Add the counts of another LoadStats."""
+        self.histogram.merge(other.histogram)
+        self.count += other.count
+        self.errors += other.errors
+        self.failed += other.failed
+        self.bytes += other.bytes
+        self.sent += other.sent
+        self.dropped += other.dropped
+        for status, count in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+        if other.started is not None and \
+                (self.started is None or other.started < self.started):
+            self.started = other.started
+        if other.finished is not None and \
+                (self.finished is None or other.finished > self.finished):
+            self.finished = other.finished
+
+    def to_dict(self):
+        # Stats pass between processes as plain dicts.
+        return {
+            "histogram": self.histogram.to_dict(),
+            "count": self.count,
+            "errors": self.errors,
+            "failed": self.failed,
+            "bytes": self.bytes,
+            "statuses": self.statuses,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.histogram = Histogram.from_dict(data["histogram"])
+        for name in ("count", "errors", "failed", "bytes", "statuses",
+                     "sent", "dropped", "started", "finished"):
+            setattr(stats, name, data[name])
+        return stats
+
+
+def _prepare_sender(text, settings, encoding, eol, directory, stats):
+    # Return a function that sends the request of the next block of text
+    # and counts the result, with latency measured from its due time.
+    from .executor import Executor
+
+    variables = extract_variables(text)
+    blocks = split_blocks(text)
+    executor = Executor()
+
+    def send(index, due):
+        block_settings, request = prepare_request(
+            blocks[index % len(blocks)], settings, eol, variables, directory)
+        result = run_request(request, block_settings, encoding=encoding,
+                             eol=eol, executor=executor)
+        response = result.response
+        stats.add(_clock() - due,
+                  response.status if response is not None else None,
+                  result.size,
+                  None if result.success else (result.message or "Failed"))
+    return send
+
+
+def _run_closed_worker(text, settings, count, concurrency, encoding, eol,
+                       directory):
+    # Send count requests from concurrency threads in this process, taking
+    # the blocks of text in turn, and return the stats as a dict. This runs
+    # in a worker process, so its arguments and result must be picklable.
+    stats = LoadStats()
+    send = _prepare_sender(text, settings, encoding, eol, directory, stats)
+    lock = threading.Lock()
+    counter = [0]
+
+    def run():
+        while True:
+            with lock:
+                index = counter[0]
+                if index >= count:
+                    return
+                counter[0] += 1
+            send(index, _clock())
+
+    threads = [threading.Thread(target=run)
+               for _ in range(min(concurrency, count))]
+    stats.started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats.finished = time.time()
+    stats.sent = count
+    return stats.to_dict()
+
+
+def _run_open_worker(text, settings, rate, duration, max_in_flight,
+                     encoding, eol, directory):
+    # Send requests at rate per second for duration seconds from up to
+    # max_in_flight threads, and return the stats as a dict.
+    try:
+        from queue import Queue
+    except ImportError:
+        # Python 2
+        from Queue import Queue
+
+    stats = LoadStats()
+    send = _prepare_sender(text, settings, encoding, eol, directory, stats)
+    free = threading.Semaphore(max_in_flight)
+    queue = Queue()
+
+    def run():
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            try:
+                send(*item)
+            finally:
+                free.release()
+
+    threads = [threading.Thread(target=run) for _ in range(max_in_flight)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    stats.started = time.time()
+    start = _clock()
+    total = int(rate * duration)
+    for index in range(total):
+        due = start + index / float(rate)
+        wait = due - _clock()
+        if wait > 0:
+            time.sleep(wait)
+        # Do not wait for a free thread; that would delay every request
+        # due after this one.
+        if free.acquire(False):
+            stats.sent += 1
+            queue.put((index, due))
+        else:
+            stats.dropped += 1
+    for _ in threads:
+        queue.put(None)
+    for thread in threads:
+        thread.join()
+    stats.finished = time.time()
+    return stats.to_dict()
+
+
+class LoadReport(object):
+    """Merged results of a load test"""
+
+    def __init__(self, stats, processes, concurrency=None, rate=None,
+                 duration=None):
+        self.stats = stats
+        self.processes = processes
+        self.concurrency = concurrency
+        self.rate = rate
+        self.duration = duration
+
+    @property
+    def elapsed(self):
+        """Seconds from the first send to the last response."""
+        if self.stats.started is None or self.stats.finished is None:
+            return 0.0
+        return self.stats.finished - self.stats.started
+
+    @property
+    def throughput(self):
+        """Requests completed per second."""
+        return self.stats.count / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def achieved_rate(self):
+        """Requests sent per second of the open loop's duration."""
+        if not self.duration:
+            return None
+        return self.stats.sent / float(self.duration)
+
+    def get_percentiles(self):
+        """Return a list of (percentile, seconds) latencies."""
+        if not self.stats.count:
+            return []
+        return [(percentile, self.stats.histogram.get_percentile(percentile))
+                for percentile in PERCENTILES]
+
+    def format(self):
+        """Return the report as lines of text."""
+        stats = self.stats
+        if self.rate:
+            lines = ["%d requests in %.4f sec. from %d processes at a "
+                     "target of %g/sec." % (stats.count, self.elapsed,
+                                            self.processes, self.rate),
+                     "Sent %.2f/sec., %d dropped" % (self.achieved_rate,
+                                                     stats.dropped)]
+        else:
+            lines = ["%d requests in %.4f sec. from %d processes, "
+                     "%d concurrent" % (stats.count, self.elapsed,
+                                        self.processes, self.concurrency)]
+        lines.append("%.2f requests/sec., %d bytes received" %
+                     (self.throughput, stats.bytes))
+        lines.append("%d failed, %d errors" % (stats.failed, stats.errors))
+        if stats.statuses:
+            lines.append("Statuses: " + ", ".join(
+                "%d: %d" % item for item in sorted(stats.statuses.items())))
+        if stats.count:
+            lines.append("Latency: min %.4f, mean %.4f, max %.4f sec." %
+                         (stats.histogram.min, stats.histogram.mean,
+                          stats.histogram.max))
+        for percentile, latency in self.get_percentiles():
+            lines.append("  p%-6s %10.4f sec." % (percentile, latency))
+        return lines
+
+    def to_dict(self):
+        stats = self.stats
+        return {
+            "count": stats.count,
+            "elapsed": self.elapsed,
+            "processes": self.processes,
+            "concurrency": self.concurrency,
+            "rate": self.rate,
+            "achieved_rate": self.achieved_rate,
+            "duration": self.duration,
+            "sent": stats.sent,
+            "dropped": stats.dropped,
+            "throughput": self.throughput,
+            "bytes": stats.bytes,
+            "failed": stats.failed,
+            "errors": stats.errors,
+            "statuses": dict((str(status), count) for status, count in
+                             stats.statuses.items()),
+            "latency": {
+                "min": stats.histogram.min,
+                "mean": stats.histogram.mean,
+                "max": stats.histogram.max,
+            },
+            "percentiles": dict(("p%s" % percentile, latency)
+                                for percentile, latency in
+                                self.get_percentiles()),
+            "histogram": stats.histogram.to_dict(),
+        }
+
+
+def _run_workers(worker, processes, arguments):
+    # Run worker in processes processes, each with its own arguments, and
+    # return the merged LoadStats.
+    from concurrent.futures import ProcessPoolExecutor
+
+    stats = LoadStats()
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = [pool.submit(worker, *arguments[i])
+                   for i in range(processes)]
+        for future in futures:
+            stats.merge(LoadStats.from_dict(future.result()))
+    return stats
+
+
+def _get_processes(processes, limit):
+    import multiprocessing
+    processes = processes or multiprocessing.cpu_count()
+    return max(1, min(processes, limit))
+
+
+def run_load(text, settings, requests=100, concurrency=10, processes=None,
+             encoding="UTF-8", eol="\n", directory=None):
+    """Send requests requests from the blocks of text in a closed loop,
+    split across worker processes, and return a LoadReport.
+
+    concurrency is the total number of requests in flight, divided among
+    the processes. settings must be a picklable dict. processes defaults
+    to the number of CPUs.
+    """
+    text = normalize_line_endings(text, eol)
+    if not split_blocks(text):
+        raise LoadError("No requests to send.")
+    processes = _get_processes(processes, min(requests, concurrency))
+    counts = split_evenly(requests, processes)
+    threads = split_evenly(concurrency, processes)
+    stats = _run_workers(_run_closed_worker, processes, [
+        (text, settings, counts[i], threads[i], encoding, eol, directory)
+        for i in range(processes)])
+    return LoadReport(stats, processes, concurrency=concurrency)
+
+
+def run_open_load(text, settings, rate, duration, max_in_flight=100,
+                  processes=None, encoding="UTF-8", eol="\n",
+                  directory=None):
+    """Send requests from the blocks of text at rate per second for
+    duration seconds, split across worker processes, and return a
+    LoadReport.
+
+    max_in_flight is the total number of requests in flight, divided among
+    the processes. A request due when a process has its share in flight is
+    dropped.
+    """
+    text = normalize_line_endings(text, eol)
+    if not split_blocks(text):
+        raise LoadError("No requests to send.")
+    if rate <= 0 or duration <= 0:
+        raise LoadError("The rate and duration must be greater than 0.")
+    processes = _get_processes(processes, max_in_flight)
+    threads = split_evenly(max_in_flight, processes)
+    stats = _run_workers(_run_open_worker, processes, [
+        (text, settings, float(rate) / processes, duration, threads[i],
+         encoding, eol, directory) for i in range(processes)])
+    return LoadReport(stats, processes, rate=rate, duration=duration)
@@ -1,5 +1,10 @@
+import threading
+
 from . import util
 
+# Size of the chunks raw bodies are read from their spool in.
+RAW_CHUNK_SIZE = 65536
+
 
 class Message(object):
     """Base class for HTTP messages"""
@@ -35,6 +40,9 @@ class Request(Message):
         self.port = None
         self.query = {}
 
+        # Path of a file to stream as the body instead of body.
+        self.body_file = None
+
     @property
     def full_path(self):
         """Path + query string for the request."""
@@ -66,6 +74,127 @@ class Response(Message):
         self.protocol = "HTTP/1.1"
         self.status = 500
         self.reason = None
+        self.encoding = None
+
+        # For large responses, the full body is written undecoded to
+        # body_file and body holds only a preview of the first
+        # body_preview_size bytes.
+        self.body_file = None
+        self.body_size = None
+        self.body_preview_size = None
+
+        # For binary bodies, a description of the format. The body holds a
+        # summary instead of the decoded content.
+        self.binary = None
+
+        # For downloads, the body is written to download_file instead.
+        self.download_file = None
+
+        # For bodies replaced by the values the filter JSON path selects,
+        # the size of the body as received and the time filtering took.
+        self.filter = None
+        self.filter_error = None
+        self.filter_elapsed = None
+        self.unfiltered_size = None
+
+        # The body as received, kept in memory up to the spool size and in
+        # a temporary file above it, and decoded on first access of body.
+        self._raw_body = None
+        self._raw_length = None
+        self._raw_hash = None
+        self._decode = None
+        self._decode_lock = threading.Lock()
+
+    @property
+    def body(self):
+        if self._decode is not None:
+            with self._decode_lock:
+                if self._decode is not None:
+                    self._body = self._decode(self.raw_body)
+                    self._decode = None
+        return self._body
+
+    @body.setter
+    def body(self, body):
+        self._body = body
+        self._decode = None
+
+    def set_raw_body(self, body_bytes, decode, spool_size=None):
+        """Keep the body as received and decode it with decode(body_bytes)
+        the first time body is read.
+
+        Bodies larger than spool_size bytes are written to a temporary
+        file instead of being held in memory.
+        """
+        self._raw_length = len(body_bytes)
+        self._raw_hash = None
+        if spool_size is not None and len(body_bytes) > spool_size:
+            import tempfile
+            spool = tempfile.SpooledTemporaryFile(max_size=spool_size)
+            spool.write(body_bytes)
+            self._raw_body = spool
+        else:
+            self._raw_body = bytes(body_bytes)
+        self._body = None
+        self._decode = decode
+
+    def close(self):
+        """Release the raw body, closing its temporary file if it was
+        spooled. A body not decoded yet can no longer be decoded."""
+        raw_body, self._raw_body = self._raw_body, None
+        if raw_body is not None and not isinstance(raw_body, bytes):
+            raw_body.close()
+
+    @property
+    def decoded(self):
+        """False until the raw body has been decoded into body."""
+        return self._decode is None
+
+    @property
+    def raw_body(self):
+        """The body as received, before decompressing and decoding, or
+        None if it was not kept."""
+        if self._raw_body is None or isinstance(self._raw_body, bytes):
+            return self._raw_body
+        self._raw_body.seek(0)
+        return self._raw_body.read()
+
+    def iter_raw_body(self, chunk_size=RAW_CHUNK_SIZE):
+        """Yield the raw body in chunks, without reading a spooled body
+        into memory all at once."""
+        if self._raw_body is None:
+            return
+        if isinstance(self._raw_body, bytes):
+            for start in range(0, len(self._raw_body), chunk_size):
+                yield self._raw_body[start:start + chunk_size]
+            return
+        self._raw_body.seek(0)
+        while True:
+            chunk = self._raw_body.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    @property
+    def length(self):
+        """Number of bytes in the raw body, or None if it was not kept."""
+        return self._raw_length
+
+    @property
+    def hash(self):
+        """SHA-256 hex digest of the raw body, or None if it was not kept.
+        """
+        if self._raw_hash is None and self._raw_body is not None:
+            import hashlib
+            digest = hashlib.sha256()
+            for chunk in self.iter_raw_body():
+                digest.update(chunk)
+            self._raw_hash = digest.hexdigest()
+        return self._raw_hash
+
+    @property
+    def truncated(self):
+        return self.body_file is not None
 
     @property
     def status_line(self):
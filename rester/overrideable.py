@@ -1,3 +1,63 @@
+class SettingsSnapshot():
+    """
+    Read-only, flattened copy of a Settings object
+
+    Values are copied into a plain dictionary the first time they are needed
+    and served from there until the underlying settings change. When the
+    Settings object can export itself (to_dict), it is flattened in one call;
+    otherwise each setting is copied the first time it is read.
+    """
+
+    def __init__(self, settings, on_change_key="rester_settings_snapshot"):
+        self._settings = settings
+        self._values = None
+        self._complete = False
+        self.generation = 0
+        if hasattr(settings, "add_on_change"):
+            settings.clear_on_change(on_change_key)
+            settings.add_on_change(on_change_key, self.refresh)
+
+    def refresh(self):
+        """Discard the copied values. Called when the settings change."""
+        self._values = None
+        self._complete = False
+        self.generation += 1
+
+    def to_dict(self):
+        """Return the dictionary of copied values.
+
+        The dictionary is complete only if is_complete() returns True.
+        """
+        if self._values is None:
+            try:
+                self._values = dict(self._settings.to_dict())
+                self._complete = True
+            except AttributeError:
+                self._values = {}
+        return self._values
+
+    def is_complete(self):
+        self.to_dict()
+        return self._complete
+
+    def get(self, setting, default=None):
+        values = self.to_dict()
+        if setting in values:
+            return values[setting]
+        if self._complete:
+            return default
+        if hasattr(self._settings, "has"):
+            if not self._settings.has(setting):
+                return default
+            value = self._settings.get(setting)
+        else:
+            value = self._settings.get(setting, None)
+            if value is None:
+                return default
+        values[setting] = value
+        return value
+
+
 class OverrideableSettings():
     """
     Class for adding a layer of overrides on top of a Settings object
@@ -5,22 +65,40 @@ class OverrideableSettings():
     The class is read-only. If a dictionary-like _overrides member is present,
     the get() method will look there first for a setting before reading from
     the _settings member.
+
+    When the settings are a SettingsSnapshot, the snapshot and the overrides
+    are merged into one dictionary so that get() is a single lookup.
     """
 
     def __init__(self, settings=None, overrides=None):
         self._settings = settings
         self._overrides = overrides
+        self._values = None
+        self._merge()
 
     def set_settings(self, settings):
         self._settings = settings
+        self._merge()
 
     def set_overrides(self, overrides):
         self._overrides = overrides
+        self._merge()
 
     def get(self, setting, default=None):
+        if self._values is not None:
+            return self._values.get(setting, default)
         if self._overrides and setting in self._overrides:
             return self._overrides[setting]
         elif self._settings:
             return self._settings.get(setting, default)
         else:
             return default
+
+    def _merge(self):
+        self._values = None
+        if isinstance(self._settings, SettingsSnapshot) and \
+                self._settings.is_complete():
+            values = dict(self._settings.to_dict())
+            if self._overrides:
+                values.update(self._overrides)
+            self._values = values
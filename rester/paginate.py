@@ -0,0 +1,391 @@
+"""
+Following paginated responses
+
+With the paginate setting, a request is sent again for each page of results
+and the pages are combined into one response:
+
+- "link" follows the Link: <...>; rel="next" header of each page.
+- {"next": "$.links.next"} follows the URL at a JSON path in each page.
+- {"cursor": "$.next_cursor", "param": "cursor"} sends the value at a JSON
+  path of each page as a query parameter of the next request.
+- {"param": "page", "start": 1, "step": 1} sends the page number (or
+  offset) as a query parameter. These URIs are known in advance, so up to
+  paginate_jobs pages are requested at once.
+
+Pages are fetched until there is no next page, a page has no items, or
+paginate_limit pages have been fetched. If paginate_items is a JSON path,
+the values it selects from each page are combined into one JSON array.
+Otherwise pages that are JSON arrays are combined, and other pages are
+joined with blank lines. The combined body is kept in memory, or written
+to the download file a page at a time.
+"""
+
+import codecs
+import io
+import json
+import os
+import re
+import threading
+import time
+
+from collections import deque
+
+from .executor import Executor
+from .jsonpath import JsonPathError
+from .jsonpath import find
+from .jsonpath import first
+from .message import Response
+from .overrideable import OverrideableSettings
+from .parse import get_redirect_request
+from .runner import run_request
+from .trace import Trace
+from .util import replace_file
+from .util import split_query_string
+
+try:
+    # Python 3
+    from urllib.parse import quote
+except ImportError:
+    # Python 2
+    from urllib import quote
+
+RE_LINK = re.compile(r'<([^>]*)>([^,]*)')
+RE_LINK_REL = re.compile(r';\s*rel\s*=\s*"?([^";]*)"?')
+
+# Headers of the first page that do not describe the combined body.
+SKIPPED_HEADERS = ("content-encoding", "content-length", "link",
+                   "transfer-encoding")
+
+
+class PaginateError(Exception):
+    pass
+
+
+def get_pagination(settings):
+    """Return the paginate setting as a dict with a "type" of "link",
+    "next", "cursor", or "offset", or None if pagination is off."""
+    value = settings.get("paginate", None)
+    if not value:
+        return None
+    if value == "link":
+        return {"type": "link"}
+    if not isinstance(value, dict):
+        raise PaginateError("Unknown paginate mode %s. Use \"link\" or an "
+                            "object." % json.dumps(value))
+    pagination = dict(value)
+    if "next" in pagination:
+        pagination["type"] = "next"
+    elif "cursor" in pagination:
+        if not pagination.get("param"):
+            raise PaginateError("Cursor pagination needs a \"param\".")
+        pagination["type"] = "cursor"
+    elif pagination.get("param"):
+        pagination["type"] = "offset"
+        pagination.setdefault("start", 1)
+        pagination.setdefault("step", 1)
+    else:
+        raise PaginateError("Set \"next\", \"cursor\", or \"param\" to "
+                            "paginate.")
+    return pagination
+
+
+def get_next_link(response):
+    """Return the URI of the Link header's rel="next" link, or None."""
+    header = response.get_header("Link")
+    if not header:
+        return None
+    for uri, params in RE_LINK.findall(header):
+        match = RE_LINK_REL.search(params)
+        if match and "next" in match.group(1).lower().split():
+            return uri.strip()
+    return None
+
+
+def get_page_request(request, location=None, query=None):
+    """Return a copy of request for another page, at location if given,
+    with its headers and body and the query parameters in query added.
+
+    request must not have been sent: the clients add headers such as
+    Content-length and Authorization to the requests they send.
+    """
+    if location is None:
+        page = get_redirect_request(request, request.path)
+        page.query = dict((name, list(values))
+                          for name, values in request.query.items())
+    else:
+        # Keep the query of the location as it is, still percent-encoded.
+        location, _, query_string = location.split("#", 1)[0].partition("?")
+        page = get_redirect_request(request, location or request.path)
+        page.query = split_query_string(query_string)
+    page.method = request.method
+    page.headers = list(request.headers)
+    if (page.host, page.port) != (request.host, request.port):
+        # A Host header names the first page's host, not this one.
+        page.headers = [(key, value) for key, value in page.headers
+                        if key.lower() != "host"]
+    page.body = request.body
+    page.body_file = request.body_file
+    for name, value in (query or {}).items():
+        page.query[name] = [quote(str(value))]
+    return page
+
+
+def get_next_request(pagination, request, response):
+    """Return the Request for the page after response, or None if it was
+    the last page. For link, next, and cursor pagination."""
+    if pagination["type"] == "link":
+        location = get_next_link(response)
+        return get_page_request(request, location) if location else None
+    try:
+        value = first(json.loads(response.body or "null"),
+                      pagination.get("next") or pagination["cursor"])
+    except (ValueError, JsonPathError):
+        return None
+    if value in (None, "") or isinstance(value, (dict, list, bool)):
+        return None
+    if pagination["type"] == "next":
+        return get_page_request(request, value)
+    return get_page_request(request, query={pagination["param"]: value})
+
+
+class Aggregate(object):
+    """Combines the bodies of pages into one, written to out"""
+
+    def __init__(self, out, items=None, eol="\n"):
+        self.out = out
+        self.items = items
+        self.eol = eol
+        self.count = 0
+        self.pages = 0
+        self._array = None
+
+    def add(self, body):
+        """Add the body of a page. Return the number of items it had."""
+        values = None
+        if self.items or self._array is not False:
+            try:
+                data = json.loads(body or "null")
+            except ValueError:
+                data = None
+            if self.items:
+                values = []
+                for value in find(data, self.items) if data is not None \
+                        else []:
+                    values.extend(value if isinstance(value, list)
+                                  else [value])
+            elif isinstance(data, list):
+                values = data
+            elif self._array and data is not None:
+                values = [data]
+        if self._array is None:
+            self._array = values is not None
+            if self._array:
+                self.out.write("[")
+        self.pages += 1
+        if self._array:
+            values = values or []
+            for value in values:
+                self.out.write("," if self.count else "")
+                text = json.dumps(value, indent=2, ensure_ascii=False)
+                self.out.write(self.eol + "  " +
+                               text.replace("\n", self.eol + "  "))
+                self.count += 1
+            return len(values)
+        if not body:
+            return 0
+        if self.count:
+            self.out.write(self.eol * 2)
+        self.out.write(body)
+        self.count += 1
+        return 1
+
+    def close(self):
+        if self._array:
+            self.out.write(self.eol + "]" if self.count else "]")
+            self.out.write(self.eol)
+
+
+class PaginationThread(threading.Thread):
+    """Sends the pages of a request and combines them into one Response
+
+    It has the attributes of the HTTP request threads that the request
+    command reads, so it is handled the same way.
+    """
+
+    def __init__(self, request, settings, encoding="UTF8", eol="\n",
+                 trace=None, decode=False):
+        threading.Thread.__init__(self)
+        self.request = request
+        self.response = None
+        self.message = None
+        self.success = False
+        self.elapsed = None
+        self.failure = None
+        self.tls_resumed = None
+        self.tls_handshake_elapsed = None
+        self.cancelled = False
+        self.cancel_message = None
+        self.pages = 0
+        self.items = 0
+        self.trace = trace or Trace()
+        # decode is accepted as by the request threads. The combined body
+        # is always built, and so decoded, in this thread.
+        # Pages are copied from this, taken before any page is sent.
+        self._request = get_page_request(request)
+        self._encoding = encoding
+        self._eol = eol
+        try:
+            self._pagination = get_pagination(settings)
+        except PaginateError as e:
+            self._pagination = None
+            self.message = str(e)
+        self._limit = settings.get("paginate_limit", 10)
+        self._items = settings.get("paginate_items", None)
+        self._jobs = settings.get("paginate_jobs", 4)
+        self._download = settings.get("download", None)
+        self._executor = Executor.from_settings(settings)
+        self._out = None
+
+        # Each page is an ordinary request, read into memory and unfiltered.
+        self._page_settings = OverrideableSettings(
+            settings=settings, overrides={"download": None, "filter": None,
+                                          "paginate": None})
+
+    def cancel(self, message="Request cancelled."):
+        """Stop after the pages in flight."""
+        self.cancel_message = message
+        self.cancelled = True
+
+    def get_download_progress(self):
+        if self._download and self._out is not None:
+            return self._out.tell(), None
+        return 0, None
+
+    def run(self):
+        if self._pagination is None:
+            return
+        time_start = time.time()
+        if self._download:
+            # Write to another file and rename it once every page is in,
+            # so a failed page leaves the download file as it was.
+            part = self._download + ".part"
+            out = codecs.open(part, "w", encoding="UTF8")
+        else:
+            out = io.StringIO()
+        self._out = out
+        aggregate = Aggregate(out, self._items, self._eol)
+        try:
+            if self._pagination["type"] == "offset":
+                first_page = self._fetch_offset_pages(aggregate)
+            else:
+                first_page = self._follow_pages(aggregate)
+            aggregate.close()
+        finally:
+            if self._download:
+                out.close()
+        self.elapsed = time.time() - time_start
+        self.pages = aggregate.pages
+        self.items = aggregate.count
+        if first_page is None or self.cancelled:
+            if self._download:
+                os.remove(part)
+            return
+        if self._download:
+            replace_file(part, self._download)
+
+        self.response = Response()
+        self.response.protocol = first_page.protocol
+        self.response.status = first_page.status
+        self.response.reason = first_page.reason
+        self.response.headers = [(key, value) for key, value in
+                                 first_page.headers
+                                 if key.lower() not in SKIPPED_HEADERS]
+        if self._download:
+            self.response.download_file = self._download
+            self.response.body_size = os.path.getsize(self._download)
+        else:
+            self.response.body = out.getvalue()
+        self.success = True
+
+    def _fetch(self, request):
+        # Send a copy of one page, so that request stays as it was for
+        # making the next page's request. Return its Result.
+        return run_request(get_page_request(request), self._page_settings,
+                           encoding=self._encoding, eol=self._eol,
+                           executor=self._executor)
+
+    def _check(self, number, result):
+        # Return True if the page succeeded, or set the message.
+        if result.passed:
+            return True
+        if result.response is not None:
+            self.message = "Page %d returned %s" % (
+                number, result.response.status_line)
+        else:
+            self.message = "Page %d failed. %s" % (
+                number, result.message or "Unable to make request.")
+        return False
+
+    def _follow_pages(self, aggregate):
+        # Fetch pages one after another, each from the one before. Return
+        # the first page's response, or None if a page failed.
+        request = self._request
+        seen = set()
+        first_page = None
+        while request is not None and aggregate.pages < self._limit and \
+                not self.cancelled:
+            seen.add(request.uri)
+            result = self._fetch(request)
+            self.trace.mark("page")
+            if not self._check(aggregate.pages + 1, result):
+                return None
+            first_page = first_page or result.response
+            count = aggregate.add(result.response.body)
+            if count:
+                request = get_next_request(self._pagination, request,
+                                           result.response)
+            result.response.close()
+            if not count:
+                break
+            if request is not None and request.uri in seen:
+                # The next link points back at a page already fetched.
+                break
+        return first_page
+
+    def _fetch_offset_pages(self, aggregate):
+        # Fetch pages with known URIs, up to jobs at a time, and combine
+        # them in order. Stop at the first page with no items.
+        from concurrent.futures import ThreadPoolExecutor
+
+        pagination = self._pagination
+        param = pagination["param"]
+        pending = deque()
+        number = 0
+        first_page = None
+        pool = ThreadPoolExecutor(max_workers=max(1, self._jobs))
+        try:
+            while not self.cancelled:
+                while len(pending) < max(1, self._jobs) and \
+                        number < self._limit:
+                    value = pagination["start"] + number * pagination["step"]
+                    request = get_page_request(self._request,
+                                               query={param: value})
+                    pending.append(pool.submit(self._fetch, request))
+                    number += 1
+                if not pending:
+                    break
+                result = pending.popleft().result()
+                self.trace.mark("page")
+                if not self._check(aggregate.pages + 1, result):
+                    return None
+                first_page = first_page or result.response
+                count = aggregate.add(result.response.body)
+                result.response.close()
+                if not count:
+                    break
+        finally:
+            # Drop the pages not started yet.
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=False)
+        return first_page
@@ -1,19 +1,118 @@
+import json
 import re
 
 from .message import Request
 from .util import normalize_line_endings
+from .util import split_query_string
 
 try:
     # Python 3
     from urllib.parse import urlparse
     from urllib.parse import parse_qs
     from urllib.parse import quote
+    from urllib.parse import urljoin
 except ImportError:
     # Python 2
     from urlparse import urlparse
     from urlparse import parse_qs
+    from urlparse import urljoin
     from urllib import quote
 
+RE_OVERRIDE = """^\s*@\s*([^\:]*)\s*:\s*(.*)$"""
+RE_VARIABLE = r'(?:(#)\s*)?@([_a-zA-Z][_a-zA-Z0-9]*)\s*=\s*(.*)'
+RE_PLACEHOLDER = r'\{\{\s*([_a-zA-Z][_a-zA-Z0-9]*)\s*\}\}'
+RE_BLOCK_SEPARATOR = r'\n(?=###)'
+# "<", whitespace, and a path. "<" alone does not start a file reference, so
+# XML and HTML bodies are sent as written.
+RE_BODY_FILE = r'^<[ \t]+(\S[^\n]*?)\s*$'
+
+
+def split_blocks(text):
+    """Return a list of the request blocks in text, separated by ### lines.
+
+    Blocks without a request line (for example, blocks containing only
+    comments and variable definitions) are omitted.
+    """
+    blocks = []
+    for block in re.split(RE_BLOCK_SEPARATOR, text):
+        for line in block.splitlines():
+            line = line.strip()
+            if line and line[0] not in ("#", "@"):
+                blocks.append(block)
+                break
+    return blocks
+
+
+def parse_overrides(headers):
+    """Return a dictionary of @name: value settings overrides in headers."""
+    overrides = {}
+    for (name, value) in re.findall(RE_OVERRIDE, headers, re.MULTILINE):
+        try:
+            overrides[name] = json.loads(value)
+        except ValueError:
+            # If unable to parse as JSON, assume it's an un-quoted string.
+            overrides[name] = value
+    return overrides
+
+
+def extract_variables(text, variables=None):
+    """Add the @name = value definitions in text to a dictionary.
+
+    Definitions in comments (# @name = value) are ignored. Later definitions
+    replace earlier ones.
+    """
+    if variables is None:
+        variables = {}
+    for var in re.findall(RE_VARIABLE, text):
+        if var[0] != '#':
+            variables[var[1]] = var[2].strip()
+    return variables
+
+
+def merge_variables(text, variables):
+    """Replace {{name}} placeholders in text with values from variables."""
+    def replace(m):
+        return variables.get(m.group(1), '')
+    return re.sub(RE_PLACEHOLDER, replace, text)
+
+
+def get_redirect_request(request, location):
+    """Return a new Request for following a redirect to location."""
+
+    # Create a new request instance.
+    redirect = Request()
+
+    # Use GET unless the original request was HEAD.
+    if request.method == "HEAD":
+        redirect.method = "HEAD"
+
+    # Parse the Location URI
+    uri = urlparse(location)
+
+    if uri.netloc:
+        # If there is a netloc, it's an absolute path.
+        redirect.host = uri.netloc
+        if uri.port:
+            redirect.host = uri.hostname
+            redirect.port = uri.port
+        if uri.scheme:
+            redirect.protocol = uri.scheme
+        if uri.path:
+            redirect.path = uri.path
+
+    elif uri.path:
+        # If no netloc, but there is a path, resolve from last.
+        redirect.protocol = request.protocol
+        redirect.host = request.host
+        redirect.port = request.port
+        redirect.path = urljoin(request.path, uri.path)
+
+    # Always add the query.
+    if uri.query:
+        redirect.query.update(parse_qs(uri.query))
+
+    return redirect
+
 
 def _read_request_line_dict(line):
     """Return a dict containing the method and uri for a request line"""
@@ -99,6 +198,14 @@ class RequestParser:
         else:
             header_lines = lines[1:]
 
+        # A body of the form "< path" is streamed from the file when sent.
+        self.request.body_file = self.settings.get("body_file", None)
+        if self.request.body:
+            match = re.match(RE_BODY_FILE, self.request.body.strip())
+            if match:
+                self.request.body_file = match.group(1)
+                self.request.body = ""
+
         # Make a dictionary of headers.
         self._parse_header_lines(header_lines)
 
@@ -197,7 +304,8 @@ class RequestParser:
         if uri.path:
             self.request.path = uri.path
         if uri.query:
-            query = parse_qs(uri.query)
+            # Keep the values as written, still percent-encoded.
+            query = split_query_string(uri.query)
             for key in query:
                 self.request.query[key] = query[key]
 
@@ -0,0 +1,209 @@
+"""
+Running the requests of a file as a pipeline
+
+A block can capture values from its response into variables:
+
+    @capture token = $.access_token
+    @capture location = header.Location
+
+Blocks that use a captured {{variable}} depend on the block that captures
+it. Independent blocks run in parallel, and each dependent block starts as
+soon as the blocks it depends on have finished.
+"""
+
+import json
+import re
+
+from .jsonpath import JsonPathError
+from .jsonpath import first
+from .parse import RE_PLACEHOLDER
+from .parse import extract_variables
+from .parse import split_blocks
+from .runner import Result
+from .runner import prepare_request
+from .runner import run_request
+from .util import normalize_line_endings
+
+RE_CAPTURE = r'^\s*@capture\s+([_a-zA-Z][_a-zA-Z0-9]*)\s*=\s*(.*?)\s*$'
+
+
+class PipelineError(Exception):
+    pass
+
+
+def parse_captures(block, eol="\n"):
+    """Return a list of (name, expression) captures in the block's headers."""
+    headers = block.lstrip().split(eol * 2, 1)[0]
+    return re.findall(RE_CAPTURE, headers, re.MULTILINE)
+
+
+def capture_value(response, expression):
+    """Return the string value expression selects from response, or None.
+
+    expression is a JSON path starting with $, header.Name, status, or
+    body.
+    """
+    if response is None:
+        return None
+    if expression == "status":
+        return str(response.status)
+    if expression == "body":
+        return response.body
+    for prefix in ("header.", "headers."):
+        if expression.startswith(prefix):
+            return response.get_header(expression[len(prefix):])
+    if expression.startswith("$"):
+        try:
+            data = json.loads(response.body)
+            value = first(data, expression)
+        except (ValueError, JsonPathError):
+            return None
+        if value is None:
+            return None
+        if isinstance(value, (dict, list, bool)):
+            return json.dumps(value)
+        return value if isinstance(value, str) else str(value)
+    return None
+
+
+class Step(object):
+    """One block of a pipeline and the blocks it depends on"""
+
+    def __init__(self, index, block, eol="\n"):
+        self.index = index
+        self.block = block
+        self.uses = set(re.findall(RE_PLACEHOLDER, block))
+        self.captures = parse_captures(block, eol)
+        self.depends = set()
+        self.dependents = set()
+
+
+def build_graph(blocks, eol="\n"):
+    """Return a list of Steps for blocks with their dependencies set.
+
+    A block depends on the nearest earlier block that captures a variable
+    it uses, or on the first later one if no earlier block does. Raises
+    PipelineError if the dependencies are circular.
+    """
+    steps = [Step(index, block, eol) for index, block in enumerate(blocks)]
+    providers = {}
+    for step in steps:
+        for name, _ in step.captures:
+            providers.setdefault(name, []).append(step.index)
+
+    for step in steps:
+        for name in step.uses:
+            indexes = [i for i in providers.get(name, []) if i != step.index]
+            if not indexes:
+                continue
+            earlier = [i for i in indexes if i < step.index]
+            provider = earlier[-1] if earlier else indexes[0]
+            step.depends.add(provider)
+            steps[provider].dependents.add(step.index)
+
+    # Check for cycles by removing steps with no remaining dependencies.
+    remaining = dict((step.index, set(step.depends)) for step in steps)
+    ready = [index for index, depends in remaining.items() if not depends]
+    while ready:
+        index = ready.pop()
+        del remaining[index]
+        for dependent in steps[index].dependents:
+            depends = remaining.get(dependent)
+            if depends is not None:
+                depends.discard(index)
+                if not depends:
+                    ready.append(dependent)
+    if remaining:
+        raise PipelineError("Circular dependency between requests %s." %
+                            ", ".join(str(i + 1) for i in sorted(remaining)))
+    return steps
+
+
+def run_pipeline(text, settings, eol="\n", jobs=4, encoding="UTF-8",
+                 executor=None, directory=None, variables=None,
+                 on_result=None):
+    """Run the blocks of text in dependency order, in parallel where they
+    are independent. Return a list of Results in block order and the dict
+    of variables, including those captured.
+
+    on_result, if given, is called with each Result as it completes.
+    """
+    from concurrent.futures import FIRST_COMPLETED
+    from concurrent.futures import ThreadPoolExecutor
+    from concurrent.futures import wait
+
+    text = normalize_line_endings(text, eol)
+    variables = extract_variables(text, dict(variables or {}))
+    steps = build_graph(split_blocks(text), eol)
+    results = [None] * len(steps)
+    waiting = dict((step.index, set(step.depends)) for step in steps)
+    missing = {}
+
+    def run_step(step, step_variables):
+        block_settings, request = prepare_request(
+            step.block, settings, eol, step_variables, directory)
+        result = run_request(request, block_settings, encoding=encoding,
+                             eol=eol, executor=executor)
+        for name, expression in step.captures:
+            result.captured[name] = capture_value(result.response,
+                                                  expression)
+        if result.response is not None:
+            result.response.close()
+        return result
+
+    def skip(step, message):
+        _, request = prepare_request(step.block, settings, eol, variables,
+                                     directory)
+        result = Result(request.request_line, request)
+        if request.host:
+            result.name = "%s %s" % (request.method, request.uri)
+        result.message = message
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        futures = {}
+
+        def start_ready():
+            # Skipping a step can make others ready, so repeat until none
+            # are.
+            ready = [index for index in sorted(waiting) if not waiting[index]]
+            while ready:
+                for index in ready:
+                    del waiting[index]
+                    step = steps[index]
+                    unresolved = sorted(name for name in step.uses
+                                        if name in missing)
+                    if unresolved:
+                        results[index] = skip(
+                            step, "Skipped because %s was not captured." %
+                            missing[unresolved[0]])
+                        finish(step, results[index])
+                    else:
+                        futures[pool.submit(run_step, step,
+                                            dict(variables))] = step
+                ready = [index for index in sorted(waiting)
+                         if not waiting[index]]
+
+        def finish(step, result):
+            for name, _ in step.captures:
+                value = result.captured.get(name)
+                if value is None:
+                    missing[name] = "{{%s}}" % name
+                else:
+                    variables[name] = value
+                    missing.pop(name, None)
+            for dependent in step.dependents:
+                if dependent in waiting:
+                    waiting[dependent].discard(step.index)
+            if on_result:
+                on_result(result)
+
+        start_ready()
+        while futures:
+            done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+            for future in done:
+                step = futures.pop(future)
+                results[step.index] = future.result()
+                finish(step, results[step.index])
+            start_ready()
+    return results, variables
@@ -8,30 +8,58 @@ import sys
 import sublime
 
 MODULE_PREFIX = "rester"
-PACKAGE_DIRECTORY = "rester-sublime-http-client"
 
 ST_VERSION = 2
 if int(sublime.version()) > 3000:
     ST_VERSION = 3
 
 if ST_VERSION == 3:
-    from imp import reload
+    try:
+        from importlib import reload
+    except ImportError:
+        # Python 3.3
+        from imp import reload
 
 mod_prefix = MODULE_PREFIX
 if ST_VERSION == 3:
-    mod_prefix = PACKAGE_DIRECTORY + "." + mod_prefix
+    # The package directory is the first component of this module's name.
+    mod_prefix = __name__.split(".")[0] + "." + mod_prefix
 
 # Reload modules in this order.
 # Modules with dependencies must be loaded after the dependencies.
+# Modules that are imported lazily (such as .http, which is imported on the
+# first request) are only reloaded if they have already been imported.
 mods_load_order = [
+    '.constants',
     '.overrideable',
     '.util',
+    '.form',
     '.message',
+    '.resolver',
+    '.tls',
+    '.trace',
+    '.session',
+    '.cassette',
+    '.executor',
+    '.diff',
+    '.jsonpath',
     '.http',
+    '.http2',
+    '.selector',
     '.parse',
+    '.runner',
+    '.pipeline',
+    '.paginate',
+    '.har',
     '.commands.auto_form_encode_command',
+    '.commands.diff_response_command',
+    '.commands.har_command',
+    '.commands.response_body_command',
     '.commands.http_request_command',
+    '.commands.pipeline_command',
+    '.commands.set_syntax_command',
     '.commands',
+    '.phantoms',
 ]
 
 for suffix in mods_load_order:
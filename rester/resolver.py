@@ -0,0 +1,144 @@
+"""
+In-process DNS cache and manual host overrides for the HTTP clients
+"""
+
+import socket
+import threading
+import time
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    # Python 2.6
+    OrderedDict = dict
+
+# Use a monotonic clock for expiry when the interpreter has one.
+_clock = getattr(time, "monotonic", time.time)
+
+
+def get_resolve_override(overrides, host, port):
+    """Return the address to use for host and port, or None.
+
+    overrides is a dictionary in the spirit of curl's --resolve option. Keys
+    are either "host:port" or "host" (any port) and values are addresses.
+    """
+    if not overrides:
+        return None
+    key = "%s:%s" % (host, port)
+    if key in overrides:
+        return overrides[key]
+    if host in overrides:
+        return overrides[host]
+    return None
+
+
+def get_curl_resolve_args(overrides, host, port):
+    """Return a list of --resolve arguments for curl for the host and port."""
+    address = get_resolve_override(overrides, host, port)
+    if not address:
+        return []
+    return ["--resolve", "%s:%s:%s" % (host, port, address)]
+
+
+class DnsCache(object):
+    """Thread-safe cache of getaddrinfo results with a TTL and a maximum size
+
+    Entries are evicted least-recently-used first once max_size is reached.
+    Addresses from the overrides dictionary bypass the resolver entirely.
+    """
+
+    def __init__(self, ttl=60, max_size=256, overrides=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.overrides = overrides or {}
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def resolve(self, host, port):
+        """Return a list of getaddrinfo tuples for a TCP connection."""
+
+        address = get_resolve_override(self.overrides, host, port)
+        if address:
+            host = address
+
+        key = (host, port)
+        now = _clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self.hits += 1
+                # Move to the end to mark as recently used.
+                del self._entries[key]
+                self._entries[key] = entry
+                return entry[1]
+            self.misses += 1
+
+        infos = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+
+        if self.ttl and self.max_size:
+            with self._lock:
+                self._entries.pop(key, None)
+                while len(self._entries) >= self.max_size:
+                    oldest = next(iter(self._entries))
+                    del self._entries[oldest]
+                self._entries[key] = (now + self.ttl, infos)
+        return infos
+
+    def create_connection(self, address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT,
+                          source_address=None):
+        """Drop-in replacement for socket.create_connection"""
+
+        host, port = address
+        error = None
+        for family, socktype, proto, _, sockaddr in self.resolve(host, port):
+            sock = None
+            try:
+                sock = socket.socket(family, socktype, proto)
+                if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                    sock.settimeout(timeout)
+                if source_address:
+                    sock.bind(source_address)
+                sock.connect(sockaddr)
+                return sock
+            except socket.error as e:
+                error = e
+                if sock is not None:
+                    sock.close()
+        if error is not None:
+            raise error
+        raise socket.error("getaddrinfo returns an empty list")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_dns_cache(settings):
+    """Return the shared DnsCache configured from settings, or None.
+
+    The cache is rebuilt when the TTL, size, or overrides change so that
+    stale entries are not served after the user edits the settings.
+    """
+    global _cache
+
+    overrides = settings.get("resolve", {}) or {}
+    if settings.get("dns_cache", True):
+        ttl = settings.get("dns_cache_ttl", 60)
+        max_size = settings.get("dns_cache_size", 256)
+    elif overrides:
+        # Honor the overrides without caching any lookups.
+        ttl, max_size = 0, 0
+    else:
+        return None
+
+    with _cache_lock:
+        if _cache is None or _cache.ttl != ttl or \
+                _cache.max_size != max_size or _cache.overrides != overrides:
+            _cache = DnsCache(ttl=ttl, max_size=max_size, overrides=overrides)
+        return _cache
@@ -0,0 +1,228 @@
+"""
+Running request files without Sublime Text
+
+The functions here apply the same variable, override, and default header
+handling as the rester_http_request command, so a request file behaves the
+same in the editor and on the command line.
+"""
+
+import os
+import time
+
+from .constants import MAX_REDIRECTS
+from .executor import Executor
+from .executor import RetryPolicy
+from .form import auto_form_encode
+from .http import get_http_client_names
+from .http import get_request_thread_class
+from .overrideable import OverrideableSettings
+from .parse import RequestParser
+from .parse import extract_variables
+from .parse import get_redirect_request
+from .parse import merge_variables
+from .parse import parse_overrides
+from .parse import split_blocks
+from .trace import Trace
+from .util import normalize_line_endings
+
+
+class Result(object):
+    """Outcome of running one request, including any redirects"""
+
+    def __init__(self, name, request):
+        self.name = name
+        self.request = request
+        self.response = None
+        self.success = False
+        self.message = None
+        self.elapsed = None
+        self.redirects = 0
+        self.attempts = []
+        self.captured = {}
+        self.trace = Trace(name)
+
+    @property
+    def passed(self):
+        """True if the request completed with a non-error status."""
+        return self.success and self.response is not None and \
+            self.response.status < 400
+
+    @property
+    def retries(self):
+        """Number of times a request was sent again, over all redirects.
+
+        attempts has an attempt for each redirect as well, numbered from 1.
+        """
+        return len([attempt for attempt in self.attempts
+                    if attempt.number > 1])
+
+    @property
+    def size(self):
+        """Size of the response body as received, or as downloaded."""
+        response = self.response
+        if response is None:
+            return 0
+        # Use the raw length so the body is not decoded just to measure it.
+        if response.length is not None:
+            return response.length
+        if response.body_size is not None:
+            return response.body_size
+        return len(response.body) if response.body else 0
+
+    def summary(self):
+        """Return a one line summary, for example PASS 200 GET http://..."""
+        if self.response is not None:
+            status = str(self.response.status)
+        else:
+            status = "---"
+        line = "%s %s %s" % ("PASS" if self.passed else "FAIL", status,
+                             self.name)
+        if self.elapsed is not None:
+            line += " (%.4f sec.)" % self.elapsed
+        if self.retries:
+            line += " [%d %s]" % (self.retries, "retry"
+                                  if self.retries == 1 else "retries")
+        if not self.success and self.message:
+            line += " " + self.message
+        return line
+
+    def to_dict(self):
+        response = self.response
+        return {
+            "name": self.name,
+            "method": self.request.method,
+            "uri": self.request.uri if self.request.host else None,
+            "success": self.success,
+            "passed": self.passed,
+            "message": self.message,
+            "status": response.status if response else None,
+            "elapsed": self.elapsed,
+            "redirects": self.redirects,
+            "retries": self.retries,
+            "size": self.size,
+            "attempts": [attempt.to_dict() for attempt in self.attempts],
+            "captured": self.captured,
+            "trace": self.trace.to_dict(),
+        }
+
+
+def _get_command_names(settings, setting):
+    names = []
+    for command in settings.get(setting, []) or []:
+        if isinstance(command, dict):
+            command = command.get("name")
+        names.append(command)
+    return names
+
+
+def prepare_request(block, settings, eol="\n", variables=None,
+                    directory=None):
+    """Return (settings, Request) for one block of a request file.
+
+    settings is the settings-like object shared by all blocks. The block
+    gets its own OverrideableSettings with the block's @overrides applied.
+    Relative body file paths are resolved from directory, if given.
+    """
+    headers = block.lstrip().split(eol * 2, 1)[0]
+    block_settings = OverrideableSettings(
+        settings=settings, overrides=parse_overrides(headers))
+    if "auto_form_encode" in \
+            _get_command_names(settings, "request_commands"):
+        encoded = auto_form_encode(
+            block, eol,
+            block_settings.get("form_field_start", None),
+            block_settings.get("form_field_end", None))
+        if encoded is not None:
+            block = encoded
+    block = merge_variables(block, variables or {})
+    request = RequestParser(block_settings, eol).get_request(block)
+    if request.body_file:
+        request.body_file = os.path.expanduser(request.body_file)
+        if directory:
+            request.body_file = os.path.join(directory, request.body_file)
+    return block_settings, request
+
+
+def prepare_requests(text, settings, eol="\n", directory=None):
+    """Return a list of (settings, Request) for each ### block of text."""
+    text = normalize_line_endings(text, eol)
+    variables = extract_variables(text)
+    return [prepare_request(block, settings, eol, variables, directory)
+            for block in split_blocks(text)]
+
+
+def run_request(request, settings, encoding="UTF-8", eol="\n",
+                executor=None):
+    """Make the request in the current thread and return a Result.
+
+    Redirects are followed according to the follow_redirects settings.
+    Each request, including redirects, is sent through executor and retried
+    according to the retry settings.
+    """
+    client = settings.get("http_client", "python")
+    thread_class = get_request_thread_class(client)
+    name = request.request_line
+    if request.host:
+        name = "%s %s" % (request.method, request.uri)
+    result = Result(name, request)
+    if thread_class is None:
+        result.message = "Invalid http_client %s. Must be %s." % (
+            client, get_http_client_names())
+        return result
+
+    follow = settings.get("follow_redirects", True)
+    follow_codes = settings.get("follow_redirect_status_codes", [])
+    if executor is None:
+        executor = Executor()
+    policy = RetryPolicy.from_settings(settings)
+
+    time_start = time.time()
+    while True:
+        def make_thread():
+            return thread_class(request, settings, encoding=encoding,
+                                eol=eol, trace=result.trace)
+        try:
+            thread, attempts = executor.send(make_thread, policy,
+                                             result.trace)
+        except Exception as e:
+            # Report the request as failed rather than stop the requests
+            # run with it.
+            result.success = False
+            result.response = None
+            result.message = "Unexpected error making request. %s: %s" % (
+                type(e).__name__, e)
+            break
+        result.attempts.extend(attempts)
+        result.success = thread.success
+        result.message = thread.message
+        result.response = thread.response
+        if not thread.success or not follow or \
+                thread.response.status not in follow_codes:
+            break
+        location = thread.response.get_header("Location")
+        if not location or result.redirects >= MAX_REDIRECTS:
+            break
+        request = get_redirect_request(request, location)
+        result.redirects += 1
+        result.trace.mark("redirect")
+    result.elapsed = time.time() - time_start
+    return result
+
+
+def run_requests(prepared, jobs=1, encoding="UTF-8", eol="\n",
+                 executor=None):
+    """Run prepared (settings, Request) pairs and return Results in order.
+
+    Up to jobs requests are in flight at the same time. executor, shared by
+    all requests, may limit this further and pace them.
+    """
+    def run(item):
+        return run_request(item[1], item[0], encoding=encoding, eol=eol,
+                           executor=executor)
+
+    if jobs <= 1 or len(prepared) <= 1:
+        return [run(item) for item in prepared]
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(run, prepared))
@@ -0,0 +1,847 @@
+"""
+Non-blocking HTTP/1.1 client that runs every connection on one event loop
+
+The other clients tie up a thread (or a cURL process) for the whole of each
+request. Here a single loop thread drives all connections with selectors:
+it connects, does the TLS handshake, sends, and reads for each request
+without blocking, so thousands of requests can be in flight at once.
+
+Responses are read with recv_into() into a preallocated buffer and parsed
+in place. A body with a Content-Length is read straight into a bytearray of
+that size. Connections are kept alive and reused for the same host.
+"""
+
+import errno
+import re
+import socket
+import threading
+import time
+
+from .http import HttpClientRequestThread
+from .http import UPLOAD_CHUNK_SIZE
+from .message import Response
+from .tls import SSLError
+from .tls import get_session
+from .tls import get_ssl_context
+from .tls import store_session
+
+try:
+    import selectors
+except ImportError:
+    # Python 2
+    selectors = None
+
+try:
+    import ssl
+except ImportError:
+    ssl = None
+
+READ_BUFFER_SIZE = 65536
+
+# Responses with headers larger than this are refused.
+MAX_HEADER_SIZE = 1048576
+
+# Idle keep-alive connections kept per host.
+MAX_IDLE_CONNECTIONS = 16
+
+# Seconds between checks that the engine is still running.
+ENGINE_POLL_INTERVAL = 1.0
+
+RE_CONTENT_LENGTH = re.compile(r"^[0-9]+$")
+
+_clock = getattr(time, "monotonic", time.time)
+
+# Errors that mean a non-blocking socket is not ready.
+try:
+    _WOULD_BLOCK = (BlockingIOError, InterruptedError)
+except NameError:
+    # Python 2, which has no selectors module, so this client is not used.
+    _WOULD_BLOCK = ()
+if ssl is not None:
+    _WOULD_BLOCK += (ssl.SSLWantReadError, ssl.SSLWantWriteError)
+
+# Errors sending on, or reading from, a kept-alive connection that the
+# server has already closed.
+RETRY_ERRNOS = (errno.EPIPE, errno.ECONNRESET, errno.ECONNABORTED)
+
+
+class ExchangeError(Exception):
+    """An exchange failed. failure is "connect", "timeout", or None."""
+
+    def __init__(self, message, failure=None):
+        Exception.__init__(self, message)
+        self.failure = failure
+
+
+class Exchange(object):
+    """One request and its response, driven by the SelectorEngine
+
+    Submit it to the engine and wait on done. When done is set, either
+    error is set or status, reason, version, headers, and body are.
+    """
+
+    def __init__(self, key, addresses, head, body=None, chunked=False,
+                 method="GET", timeout=None, context=None,
+                 server_hostname=None, trace=None):
+        self.key = key
+        self.addresses = addresses
+        self.head = head
+        self.body = body
+        self.chunked = chunked
+        self.method = method
+        self.timeout = timeout
+        self.context = context
+        self.server_hostname = server_hostname
+        self.trace = trace
+
+        self.done = threading.Event()
+        self.error = None
+        self.status = None
+        self.reason = None
+        self.version = None
+        self.headers = []
+        self.response_body = None
+        self.tls_resumed = None
+        self.tls_handshake_elapsed = None
+        self.retried = False
+        self._connection = None
+
+    def mark(self, stage):
+        if self.trace is not None:
+            self.trace.mark(stage)
+
+    def can_retry(self):
+        # A request may be resent on a new connection if its body can be
+        # read again. This rewinds a file body.
+        if self.retried:
+            return False
+        if self.body is None or isinstance(self.body, bytes):
+            return True
+        try:
+            self.body.seek(0)
+            return True
+        except (AttributeError, IOError, OSError, ValueError):
+            return False
+
+
+class _Connection(object):
+    """A non-blocking connection and the parser for its current response"""
+
+    def __init__(self, engine, key):
+        self.engine = engine
+        self.key = key
+        self.sock = None
+        self.exchange = None
+        self.state = None
+        self.reused = False
+        self.deadline = None
+        self._events = 0
+        self._addresses = None
+        self._handshake_start = None
+        self._session_key = None
+
+        # Unparsed bytes are buffer[start:end].
+        self._buffer = bytearray(READ_BUFFER_SIZE)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+
+        self._out = b""
+        self._out_offset = 0
+        self._request_body = None
+        self._body = None
+        self._filled = 0
+        self._remaining = 0
+        self._keep_alive = False
+        self._received = False
+
+    # Connecting
+
+    def connect(self, exchange):
+        self._addresses = list(exchange.addresses)
+        self._connect_next()
+
+    def _connect_next(self, error=None):
+        if not self._addresses:
+            raise error or ExchangeError("Connection refused.", "connect")
+        family, socktype, proto, _, sockaddr = self._addresses.pop(0)
+        sock = socket.socket(family, socktype, proto)
+        sock.setblocking(False)
+        self.sock = sock
+        code = sock.connect_ex(sockaddr)
+        if code not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK,
+                        getattr(errno, "WSAEWOULDBLOCK", -1)):
+            sock.close()
+            self._connect_next(ExchangeError("Connection refused.",
+                                             "connect"))
+            return
+        self.state = "connecting"
+        self._watch(selectors.EVENT_WRITE)
+
+    def _on_connected(self):
+        code = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if code:
+            self.engine.unwatch(self)
+            self.sock.close()
+            self._connect_next(ExchangeError("Connection refused.",
+                                             "connect"))
+            return
+        self.exchange.mark("connect")
+        exchange = self.exchange
+        if exchange.context is None:
+            self._start_sending()
+            return
+        session_key = (self.key[3], exchange.server_hostname, self.key[2])
+        kwargs = {"server_hostname": exchange.server_hostname,
+                  "do_handshake_on_connect": False}
+        session = get_session(session_key)
+        if session is not None:
+            kwargs["session"] = session
+        self.engine.unwatch(self)
+        self.sock = exchange.context.wrap_socket(self.sock, **kwargs)
+        self._session_key = session_key
+        self._handshake_start = time.time()
+        self.state = "handshake"
+        self._handshake()
+
+    def _handshake(self):
+        try:
+            self.sock.do_handshake()
+        except ssl.SSLWantReadError:
+            self._watch(selectors.EVENT_READ)
+            return
+        except ssl.SSLWantWriteError:
+            self._watch(selectors.EVENT_WRITE)
+            return
+        except SSLError as e:
+            raise ExchangeError("TLS handshake failed. " + str(e))
+        self.exchange.tls_handshake_elapsed = \
+            time.time() - self._handshake_start
+        self.exchange.tls_resumed = self.sock.session_reused
+        self.exchange.mark("tls")
+        self._start_sending()
+
+    # Sending
+
+    def start(self, exchange):
+        """Send exchange's request on this connection."""
+        self.exchange = exchange
+        exchange._connection = self
+        self.deadline = None
+        self._touch()
+        if self.sock is None:
+            self.connect(exchange)
+        else:
+            self.reused = True
+            self._start_sending()
+
+    def _start_sending(self):
+        self._out = self.exchange.head
+        self._out_offset = 0
+        # The exchange keeps its body so that it can be sent again.
+        self._request_body = self.exchange.body
+        self._received = False
+        self.state = "sending"
+        self._send()
+
+    def _next_body_chunk(self):
+        # Return the next bytes of the body to send, or None when done.
+        exchange = self.exchange
+        body = self._request_body
+        if body is None:
+            return None
+        if isinstance(body, bytes):
+            self._request_body = None
+            return body or None
+        chunk = body.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            self._request_body = None
+            return b"0\r\n\r\n" if exchange.chunked else None
+        if exchange.chunked:
+            return ("%x\r\n" % len(chunk)).encode("ascii") + chunk + b"\r\n"
+        return chunk
+
+    def _is_stale(self):
+        # True if this reused connection failed before any of the response
+        # arrived, so the server most likely closed it while it was idle.
+        return self.reused and not self._received and \
+            self.exchange.can_retry()
+
+    def _send(self):
+        while True:
+            if self._out_offset >= len(self._out):
+                chunk = self._next_body_chunk()
+                if chunk is None:
+                    break
+                self._out, self._out_offset = chunk, 0
+            try:
+                with memoryview(self._out) as view:
+                    sent = self.sock.send(view[self._out_offset:])
+            except _WOULD_BLOCK:
+                self._watch(selectors.EVENT_WRITE)
+                return
+            except (socket.error, OSError) as e:
+                if e.errno in RETRY_ERRNOS and self._is_stale():
+                    self.engine.retry(self)
+                    return
+                raise
+            self._out_offset += sent
+            self._touch()
+        self._out = b""
+        self.exchange.mark("send")
+        self.state = "status"
+        self._watch(selectors.EVENT_READ)
+        # TLS may already hold decrypted bytes the selector cannot see.
+        self._receive()
+
+    # Receiving
+
+    def _receive(self):
+        while self.exchange is not None and self.state not in (
+                "connecting", "handshake", "sending"):
+            try:
+                if self.state == "length" and self._start == self._end:
+                    # Read the rest of the body straight into place.
+                    with memoryview(self._body) as view:
+                        count = self.sock.recv_into(view[self._filled:])
+                    self._filled += count
+                    self._remaining -= count
+                else:
+                    self._make_room()
+                    count = self.sock.recv_into(self._view[self._end:])
+                    self._end += count
+            except _WOULD_BLOCK:
+                return
+            except (socket.error, OSError) as e:
+                if e.errno in RETRY_ERRNOS and self.state == "status" and \
+                        self._is_stale():
+                    self.engine.retry(self)
+                    return
+                raise
+            if not count:
+                self._on_eof()
+                return
+            self._received = True
+            self._touch()
+            self._parse()
+
+    def _make_room(self):
+        # Move unparsed bytes to the front of the buffer, growing it if a
+        # header does not fit.
+        if self._start == self._end:
+            self._start = self._end = 0
+            return
+        if self._end < len(self._buffer):
+            return
+        if self._start:
+            length = self._end - self._start
+            self._buffer[:length] = self._view[self._start:self._end]
+            self._start, self._end = 0, length
+            return
+        if len(self._buffer) >= MAX_HEADER_SIZE:
+            raise ExchangeError("Response headers are too large.")
+        self._view.release()
+        self._buffer.extend(bytearray(len(self._buffer)))
+        self._view = memoryview(self._buffer)
+
+    def _parse(self):
+        while self.exchange is not None:
+            state = self.state
+            if state == "status":
+                if not self._parse_head():
+                    return
+            elif state == "length":
+                count = min(self._remaining, self._end - self._start)
+                if count:
+                    self._body[self._filled:self._filled + count] = \
+                        self._view[self._start:self._start + count]
+                    self._filled += count
+                    self._remaining -= count
+                    self._start += count
+                if self._remaining:
+                    return
+                self._finish()
+            elif state == "chunk_size":
+                index = self._buffer.find(b"\r\n", self._start, self._end)
+                if index < 0:
+                    return
+                line = bytes(self._view[self._start:index])
+                self._start = index + 2
+                try:
+                    size = int(line.split(b";")[0].strip(), 16)
+                except ValueError:
+                    raise ExchangeError("Invalid chunk size in response.")
+                if size:
+                    self._remaining = size
+                    self.state = "chunk_data"
+                else:
+                    self.state = "trailer"
+            elif state == "chunk_data":
+                count = min(self._remaining, self._end - self._start)
+                if not count:
+                    return
+                self._body += self._view[self._start:self._start + count]
+                self._start += count
+                self._remaining -= count
+                if not self._remaining:
+                    self.state = "chunk_end"
+            elif state == "chunk_end":
+                if self._end - self._start < 2:
+                    return
+                self._start += 2
+                self.state = "chunk_size"
+            elif state == "trailer":
+                index = self._buffer.find(b"\r\n", self._start, self._end)
+                if index < 0:
+                    return
+                blank = index == self._start
+                self._start = index + 2
+                if blank:
+                    self._finish()
+            elif state == "close":
+                if self._start < self._end:
+                    self._body += self._view[self._start:self._end]
+                    self._start = self._end
+                return
+            else:
+                return
+
+    def _parse_head(self):
+        # Parse the status line and headers. Return False if they are not
+        # all in the buffer yet.
+        index = self._buffer.find(b"\r\n\r\n", self._start, self._end)
+        if index < 0:
+            return False
+        head = bytes(self._view[self._start:index]).decode("iso-8859-1")
+        self._start = index + 4
+        lines = head.split("\r\n")
+        parts = lines[0].split(" ", 2)
+        try:
+            version, status = parts[0], int(parts[1])
+        except (IndexError, ValueError):
+            raise ExchangeError("Invalid status line in response.")
+        if 100 <= status < 200 and status != 101:
+            # Skip interim responses such as 100 Continue.
+            return True
+
+        exchange = self.exchange
+        exchange.version = 10 if version == "HTTP/1.0" else 11
+        exchange.status = status
+        exchange.reason = parts[2] if len(parts) > 2 else ""
+        headers = []
+        for line in lines[1:]:
+            if line[:1] in (" ", "\t") and headers:
+                # A folded continuation of the previous header.
+                key, value = headers[-1]
+                headers[-1] = (key, value + " " + line.strip())
+            elif ":" in line:
+                key, value = line.split(":", 1)
+                headers.append((key.strip(), value.strip()))
+        exchange.headers = headers
+        exchange.mark("response_headers")
+
+        values = dict((key.lower(), value) for key, value in headers)
+        connection = values.get("connection", "").lower()
+        if exchange.version == 11:
+            self._keep_alive = "close" not in connection
+        else:
+            self._keep_alive = "keep-alive" in connection
+
+        if exchange.method == "HEAD" or status in (204, 304):
+            self._body = bytearray()
+            self._finish()
+        elif "chunked" in values.get("transfer-encoding", "").lower():
+            self._body = bytearray()
+            self.state = "chunk_size"
+        elif "content-length" in values:
+            # Only ASCII digits: str.isdigit() also accepts characters that
+            # int() refuses.
+            value = values["content-length"].strip()
+            if not RE_CONTENT_LENGTH.match(value):
+                raise ExchangeError("Invalid Content-Length in response.")
+            length = int(value)
+            self._body = bytearray(length)
+            self._filled = 0
+            self._remaining = length
+            self.state = "length"
+            if not length:
+                self._finish()
+        else:
+            # The body ends when the server closes the connection.
+            self._body = bytearray()
+            self._keep_alive = False
+            self.state = "close"
+        return True
+
+    def _on_eof(self):
+        if self.state == "close":
+            self._keep_alive = False
+            self._finish()
+        elif self.state == "status" and self._is_stale():
+            # The server closed the idle connection before we reused it.
+            self.engine.retry(self)
+        else:
+            raise ExchangeError("Connection closed before the response was "
+                                "complete.")
+
+    def _finish(self):
+        exchange = self.exchange
+        exchange.response_body = self._body
+        exchange.mark("read")
+        self._body = None
+        if exchange.context is not None and not self.reused:
+            session = getattr(self.sock, "session", None)
+            if session is not None:
+                store_session(self._session_key, session)
+        reusable = self._keep_alive and self._start == self._end
+        self.exchange = None
+        self.state = None
+        self.engine.complete(self, exchange, reusable)
+
+    # Selector and timeouts
+
+    def _watch(self, events):
+        if events != self._events:
+            self.engine.watch(self, events, bool(self._events))
+            self._events = events
+
+    def unwatched(self):
+        self._events = 0
+
+    def _touch(self):
+        if self.exchange is not None and self.exchange.timeout:
+            self.deadline = _clock() + self.exchange.timeout
+
+    def on_ready(self, events):
+        if self.state == "connecting":
+            self._on_connected()
+        elif self.state == "handshake":
+            self._handshake()
+        elif self.state == "sending":
+            self._send()
+        else:
+            self._receive()
+
+    def close(self):
+        if self.sock is not None:
+            self.engine.unwatch(self)
+            try:
+                self.sock.close()
+            except socket.error:
+                pass
+            self.sock = None
+
+
+class SelectorEngine(object):
+    """An event loop thread that runs Exchanges on non-blocking connections
+    """
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._pending = []
+        self._cancelled = []
+        self._active = set()
+        self._idle = {}
+        self._wake_read, self._wake_write = socket.socketpair()
+        self._wake_read.setblocking(False)
+        self._selector.register(self._wake_read, selectors.EVENT_READ, None)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, exchange):
+        """Start exchange from any thread. exchange.done is set when it
+        completes."""
+        with self._lock:
+            self._pending.append(exchange)
+        self._wake()
+
+    def cancel(self, exchange):
+        """Abort exchange from any thread."""
+        with self._lock:
+            self._cancelled.append(exchange)
+        self._wake()
+
+    def _wake(self):
+        try:
+            self._wake_write.send(b"x")
+        except socket.error:
+            pass
+
+    # Called on the loop thread by connections.
+
+    def watch(self, connection, events, registered):
+        if registered:
+            self._selector.modify(connection.sock, events, connection)
+        else:
+            self._selector.register(connection.sock, events, connection)
+
+    def unwatch(self, connection):
+        try:
+            self._selector.unregister(connection.sock)
+        except (KeyError, ValueError):
+            pass
+        connection.unwatched()
+
+    def complete(self, connection, exchange, reusable):
+        self._active.discard(connection)
+        if reusable:
+            self.unwatch(connection)
+            idle = self._idle.setdefault(connection.key, [])
+            if len(idle) < MAX_IDLE_CONNECTIONS:
+                idle.append(connection)
+            else:
+                connection.close()
+        else:
+            connection.close()
+        exchange._connection = None
+        exchange.done.set()
+
+    def retry(self, connection):
+        exchange = connection.exchange
+        connection.exchange = None
+        connection.close()
+        self._active.discard(connection)
+        exchange.retried = True
+        # Other idle connections to the host are likely stale too.
+        self._start(exchange, fresh=True)
+
+    def _fail(self, connection, exchange, error):
+        self._active.discard(connection)
+        connection.exchange = None
+        connection.close()
+        exchange.error = error
+        exchange._connection = None
+        exchange.done.set()
+
+    def _start(self, exchange, fresh=False):
+        connection = None
+        idle = None if fresh else self._idle.get(exchange.key)
+        while idle and connection is None:
+            connection = idle.pop()
+            if connection.sock is None:
+                connection = None
+        if connection is None:
+            connection = _Connection(self, exchange.key)
+        self._active.add(connection)
+        self._call(connection, exchange, connection.start, exchange)
+
+    def _call(self, connection, exchange, method, *args):
+        # Run a connection step, failing the exchange if it raises.
+        try:
+            method(*args)
+        except ExchangeError as e:
+            self._fail(connection, exchange, e)
+        except SSLError as e:
+            if connection.state == "handshake":
+                message = "TLS handshake failed. "
+            else:
+                message = "Unexpected error making request. "
+            self._fail(connection, exchange, ExchangeError(message + str(e)))
+        except (socket.error, OSError, IOError) as e:
+            self._fail(connection, exchange, ExchangeError(
+                "Unexpected error making request. " + str(e)))
+        except Exception as e:
+            # Never let one exchange stop the loop for all the others.
+            self._fail(connection, exchange, ExchangeError(
+                "Unexpected error making request. " + str(e)))
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def _run(self):
+        while True:
+            try:
+                self._run_once()
+            except Exception as e:
+                print("Selector engine error: %s" % e)
+
+    def _run_once(self):
+        timeout = None
+        if self._active:
+            deadlines = [c.deadline for c in self._active if c.deadline]
+            if deadlines:
+                timeout = max(0, min(deadlines) - _clock())
+        for key, events in self._selector.select(timeout):
+            connection = key.data
+            if connection is None:
+                try:
+                    while self._wake_read.recv(4096):
+                        pass
+                except socket.error:
+                    pass
+                continue
+            exchange = connection.exchange
+            if exchange is None:
+                # An idle connection was closed by the server.
+                self.unwatch(connection)
+                connection.close()
+                continue
+            self._call(connection, exchange, connection.on_ready, events)
+
+        with self._lock:
+            pending, self._pending = self._pending, []
+            cancelled, self._cancelled = self._cancelled, []
+        for exchange in cancelled:
+            connection = exchange._connection
+            if connection is not None and not exchange.done.is_set():
+                self._fail(connection, exchange,
+                           ExchangeError("Request cancelled."))
+            elif not exchange.done.is_set() and exchange in pending:
+                pending.remove(exchange)
+                exchange.error = ExchangeError("Request cancelled.")
+                exchange.done.set()
+        for exchange in pending:
+            self._start(exchange)
+
+        now = _clock()
+        for connection in list(self._active):
+            if connection.deadline and connection.deadline <= now and \
+                    connection.exchange is not None:
+                self._fail(connection, connection.exchange,
+                           ExchangeError("Request timed out.",
+                                         "timeout"))
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """Return the shared SelectorEngine, starting it on first use."""
+    global _engine
+    with _engine_lock:
+        if _engine is None or not _engine.is_alive():
+            _engine = SelectorEngine()
+        return _engine
+
+
+class SelectorRequestThread(HttpClientRequestThread):
+    """Request thread that sends its request on the shared SelectorEngine
+
+    The thread only waits for the exchange to complete; all of the socket
+    I/O happens on the engine's loop thread.
+    """
+
+    def __init__(self, request, settings, **kwargs):
+        HttpClientRequestThread.__init__(self, request, settings, **kwargs)
+        self._exchange = None
+
+    def _abort(self):
+        if self._exchange is not None:
+            get_engine().cancel(self._exchange)
+
+    def run(self):
+
+        if not self._validate_request():
+            return
+
+        if selectors is None:
+            print("The selectors module is not available. Using the Python "
+                  "client.")
+            HttpClientRequestThread.run(self)
+            return
+
+        port = self._get_port()
+        try:
+            if self._dns_cache:
+                addresses = self._dns_cache.resolve(self.request.host, port)
+            else:
+                addresses = socket.getaddrinfo(self.request.host, port, 0,
+                                               socket.SOCK_STREAM)
+        except socket.gaierror:
+            self.message = "Unable to make request. " \
+                           "Make sure the hostname is valid."
+            self.success = False
+            return
+
+        context = None
+        if self.request.protocol == "https":
+            context = get_ssl_context(self._tls_profile)
+            if context is None:
+                self.message = "Unable to make HTTPS requests. " \
+                               "Your Python interpreter does not have SSL."
+                self.success = False
+                return
+
+        body, chunked = self._get_body()
+        exchange = Exchange(
+            (self.request.protocol, self.request.host, port,
+             self._tls_profile),
+            addresses, self._get_head(), body=body, chunked=chunked,
+            method=self.request.method, timeout=self._timeout,
+            context=context, server_hostname=self.request.host,
+            trace=self.trace)
+        self._exchange = exchange
+
+        time_start = time.time()
+        try:
+            if not self.cancelled:
+                engine = get_engine()
+                engine.submit(exchange)
+                while not exchange.done.wait(ENGINE_POLL_INTERVAL):
+                    if not engine.is_alive():
+                        exchange.error = ExchangeError(
+                            "Unexpected error making request. The request "
+                            "loop stopped.")
+                        break
+        finally:
+            if body is not None and not isinstance(body, bytes):
+                body.close()
+        self.elapsed = time.time() - time_start
+        if self.cancelled:
+            return
+
+        if exchange.error is not None:
+            self.message = str(exchange.error)
+            self.failure = exchange.error.failure
+            self.success = False
+            return
+
+        self.tls_resumed = exchange.tls_resumed
+        self.tls_handshake_elapsed = exchange.tls_handshake_elapsed
+        self.response = Response()
+        if exchange.version == 10:
+            self.response.protocol = "HTTP/1.0"
+        self.response.status = exchange.status
+        self.response.reason = exchange.reason
+        self.response.headers = exchange.headers
+        if self._download:
+            self._write_download(exchange.response_body)
+            self.trace.mark("download")
+        else:
+            self._store_body(exchange.response_body)
+        self.success = True
+
+    def _get_body(self):
+        # Return the body as bytes or an open file, adding the headers that
+        # describe it, and whether to send it in chunks.
+        if self.request.body_file:
+            size = self._get_body_file_size()
+            if size is None:
+                if not self.request.get_header("Transfer-Encoding"):
+                    self.request.headers.append(
+                        ("Transfer-Encoding", "chunked"))
+            elif not self.request.get_header("Content-length"):
+                self.request.headers.append(("Content-length", size))
+            return open(self.request.body_file, "rb"), size is None
+        if self.request.body:
+            body = self.request.body.encode(self._encoding)
+            if not self.request.get_header("Content-length"):
+                self.request.headers.append(("Content-length", len(body)))
+            return body, False
+        return None, False
+
+    def _get_head(self):
+        # Return the encoded request line and headers.
+        if not self.request.get_header("host"):
+            host = self.request.host
+            if self.request.port:
+                host += ":" + str(self.request.port)
+            self.request.headers.append(("Host", host))
+        lines = ["%s %s HTTP/1.1" % (self.request.method,
+                                     self.request.full_path)]
+        for key, value in self.request.headers:
+            lines.append("%s: %s" % (key, value))
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("iso-8859-1")
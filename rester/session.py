@@ -0,0 +1,175 @@
+"""
+Session state kept between requests: cookies and OAuth2 tokens
+
+Cookies from Set-Cookie headers are stored in a jar, saved to disk with
+their expiry times, and sent with later requests to matching hosts. OAuth2
+access tokens from a token endpoint are cached until shortly before they
+expire.
+"""
+
+import json
+import os
+import threading
+import time
+
+try:
+    # Python 3
+    from http.cookiejar import LWPCookieJar
+    from http.cookiejar import LoadError
+    from urllib.parse import urlencode
+    from urllib.request import Request as CookieRequest
+except ImportError:
+    # Python 2
+    from cookielib import LWPCookieJar
+    from cookielib import LoadError
+    from urllib import urlencode
+    from urllib2 import Request as CookieRequest
+
+_jars = {}
+_jars_lock = threading.Lock()
+
+_tokens = {}
+_token_locks = {}
+_tokens_lock = threading.Lock()
+
+
+class SessionError(Exception):
+    pass
+
+
+def get_cookie_jar_path(settings):
+    """Return the path of the cookie jar to use, or None if cookies are off.
+
+    The cookies setting turns the jar on. cookie_jar gives its path, so a
+    request file can keep a separate session. By default, the jar is in a
+    directory of the user's own, not in the shared temporary directory.
+    """
+    if not settings.get("cookies", False):
+        return None
+    path = settings.get("cookie_jar", None)
+    if not path:
+        return os.path.join(get_user_directory(), "cookies.txt")
+    return os.path.abspath(os.path.expanduser(path))
+
+
+def get_user_directory():
+    """Return the per-user directory RESTer keeps its state in."""
+    base = os.environ.get("LOCALAPPDATA") or \
+        os.environ.get("XDG_CACHE_HOME") or \
+        os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "RESTer")
+
+
+def get_cookie_jar(path):
+    """Return the shared jar saved at path, loading it on first use."""
+    with _jars_lock:
+        jar = _jars.get(path)
+        if jar is None:
+            jar = LWPCookieJar(path)
+            if os.path.exists(path):
+                try:
+                    jar.load(ignore_discard=True)
+                except (IOError, LoadError):
+                    print("Unable to load cookies from " + path)
+            _jars[path] = jar
+        return jar
+
+
+def add_cookie_header(jar, request):
+    """Add a Cookie header for the jar's cookies that match request."""
+    if request.get_header("Cookie"):
+        return
+    cookie_request = CookieRequest(request.uri)
+    jar.add_cookie_header(cookie_request)
+    cookie = cookie_request.get_header("Cookie")
+    if cookie:
+        request.headers.append(("Cookie", cookie))
+
+
+class _CookieResponse(object):
+    # The interface CookieJar.extract_cookies() needs from a response.
+
+    def __init__(self, headers):
+        from email.message import Message
+        self._message = Message()
+        for key, value in headers:
+            self._message[key] = value
+
+    def info(self):
+        return self._message
+
+
+def extract_cookies(jar, request, response):
+    """Store the response's cookies in the jar, and save it if any were set.
+    """
+    if not any(key.lower() == "set-cookie" for key, _ in response.headers):
+        return
+    jar.extract_cookies(_CookieResponse(response.headers),
+                        CookieRequest(request.uri))
+    with _jars_lock:
+        directory = os.path.dirname(jar.filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        # Cookies are credentials, so only the user may read the jar.
+        # Create it before saving, so it is never readable by others.
+        os.close(os.open(jar.filename, os.O_WRONLY | os.O_CREAT, 0o600))
+        os.chmod(jar.filename, 0o600)
+        jar.save(ignore_discard=True)
+
+
+def get_oauth2_token(config, fetch):
+    """Return an access token for the oauth2 setting, using the cache.
+
+    config is a dict with token_url, client_id, client_secret, and
+    optionally scope, audience, and refresh_margin (seconds before expiry
+    to fetch a new token, default 60). fetch(url, body) must post the form
+    body and return (status, response body text).
+    """
+    key = (config.get("token_url"), config.get("client_id"),
+           config.get("scope"), config.get("audience"))
+    with _tokens_lock:
+        lock = _token_locks.setdefault(key, threading.Lock())
+
+    # Only one thread fetches a token for the key; the others wait for it.
+    with lock:
+        cached = _tokens.get(key)
+        if cached and cached[1] > time.time():
+            return cached[0]
+
+        form = {"grant_type": config.get("grant_type",
+                                         "client_credentials")}
+        for name in ("client_id", "client_secret", "scope", "audience"):
+            if config.get(name):
+                form[name] = config[name]
+        status, body = fetch(config["token_url"], urlencode(form))
+        if status is None or status >= 400:
+            raise SessionError("Token endpoint returned %s." % status)
+        try:
+            data = json.loads(body)
+            token = data["access_token"]
+        except (ValueError, KeyError, TypeError):
+            raise SessionError("Token endpoint did not return an "
+                               "access_token.")
+
+        expires_in = data.get("expires_in")
+        if expires_in:
+            margin = config.get("refresh_margin", 60)
+            expires = time.time() + max(0, float(expires_in) - margin)
+            _tokens[key] = (token, expires)
+        else:
+            # No expiry given, so keep the token until the session is
+            # cleared.
+            _tokens[key] = (token, float("inf"))
+        return token
+
+
+def clear_sessions():
+    """Forget all cookies and cached tokens, and delete saved cookies."""
+    with _jars_lock:
+        for jar in _jars.values():
+            jar.clear()
+            if os.path.exists(jar.filename):
+                os.remove(jar.filename)
+        _jars.clear()
+    with _tokens_lock:
+        _tokens.clear()
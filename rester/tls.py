@@ -0,0 +1,149 @@
+"""
+Shared SSL contexts and TLS session resumption for HTTPS requests
+"""
+
+import threading
+import time
+
+try:
+    import ssl
+except ImportError:
+    # Linux with no SSL support.
+    ssl = None
+
+try:
+    from http.client import HTTPConnection
+    try:
+        from http.client import HTTPSConnection
+    except ImportError:
+        # Linux with no SSL support.
+        HTTPSConnection = None
+except ImportError:
+    # Python 2
+    from httplib import HTTPConnection
+    try:
+        from httplib import HTTPSConnection
+    except ImportError:
+        # Linux with no SSL support.
+        HTTPSConnection = None
+
+# Exception raised for handshake and certificate errors.
+SSLError = ssl.SSLError if ssl is not None else ()
+
+# Maximum number of TLS sessions to keep for resumption.
+MAX_SESSIONS = 128
+
+_contexts = {}
+_sessions = {}
+_lock = threading.Lock()
+
+
+def get_tls_profile(settings):
+    """Return a hashable tuple describing the TLS settings in use."""
+    return (
+        bool(settings.get("ssl_verify", True)),
+        settings.get("ssl_ca_bundle", None),
+        settings.get("ssl_client_cert", None),
+        settings.get("ssl_client_key", None),
+    )
+
+
+def get_ssl_context(profile, alpn_protocols=None):
+    """Return the shared SSLContext for a profile, creating it if needed.
+
+    Contexts that offer ALPN protocols are kept apart from the plain ones so
+    that HTTP/1.1 connections never negotiate another protocol.
+    """
+    if ssl is None:
+        return None
+    key = (profile, tuple(alpn_protocols or ()))
+    with _lock:
+        context = _contexts.get(key)
+        if context is None:
+            context = _create_ssl_context(profile)
+            if alpn_protocols:
+                context.set_alpn_protocols(list(alpn_protocols))
+            _contexts[key] = context
+        return context
+
+
+def _create_ssl_context(profile):
+    verify, ca_bundle, client_cert, client_key = profile
+    context = ssl.create_default_context(cafile=ca_bundle)
+    if not verify:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    if client_cert:
+        context.load_cert_chain(client_cert, client_key)
+    return context
+
+
+def get_curl_tls_args(profile):
+    """Return curl arguments matching the TLS profile."""
+    verify, ca_bundle, client_cert, client_key = profile
+    args = []
+    if not verify:
+        args.append("--insecure")
+    if ca_bundle:
+        args += ["--cacert", ca_bundle]
+    if client_cert:
+        args += ["--cert", client_cert]
+    if client_key:
+        args += ["--key", client_key]
+    return args
+
+
+def get_session(key):
+    with _lock:
+        return _sessions.get(key)
+
+
+def store_session(key, session):
+    with _lock:
+        _sessions.pop(key, None)
+        while len(_sessions) >= MAX_SESSIONS:
+            del _sessions[next(iter(_sessions))]
+        _sessions[key] = session
+
+
+if HTTPSConnection is not None and ssl is not None:
+
+    class ResumingHTTPSConnection(HTTPSConnection):
+        """HTTPSConnection that reuses TLS sessions for the same host
+
+        After connecting, session_reused tells whether the handshake resumed
+        an earlier session and handshake_elapsed holds the handshake time.
+        Call store_session() once the response is read to make the session
+        available to the next connection. Closing the connection stores it
+        too.
+        """
+
+        def __init__(self, host, port=None, timeout=None, profile=None):
+            HTTPSConnection.__init__(self, host, port=port, timeout=timeout,
+                                     context=get_ssl_context(profile))
+            self.session_reused = None
+            self.handshake_elapsed = None
+            self._session_key = (profile, host, port)
+
+        def connect(self):
+            HTTPConnection.connect(self)
+            server_hostname = self._tunnel_host or self.host
+            kwargs = {"server_hostname": server_hostname}
+            session = get_session(self._session_key)
+            if session is not None:
+                kwargs["session"] = session
+            time_start = time.time()
+            self.sock = self._context.wrap_socket(self.sock, **kwargs)
+            self.handshake_elapsed = time.time() - time_start
+            self.session_reused = self.sock.session_reused
+
+        def store_session(self):
+            session = getattr(self.sock, "session", None)
+            if session is not None:
+                store_session(self._session_key, session)
+
+        def close(self):
+            # A response that closes the connection closes it as soon as
+            # its headers are read, so store the session first.
+            self.store_session()
+            HTTPSConnection.close(self)
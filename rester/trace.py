@@ -0,0 +1,98 @@
+"""
+Per-stage timing and profiling for sending a request
+"""
+
+import json
+import os
+import time
+
+# Use a monotonic clock for stage timings when the interpreter has one.
+_clock = getattr(time, "monotonic", time.time)
+
+
+class Trace(object):
+    """Records a monotonic timestamp at the end of each stage of a send
+
+    Each call to mark() ends a stage that began at the previous mark (or
+    when the trace was created). Marks may come from any thread.
+    """
+
+    def __init__(self, name=None):
+        self.name = name
+        self.started = time.time()
+        self._start = _clock()
+        self._marks = []
+
+    def mark(self, stage):
+        self._marks.append((stage, _clock()))
+
+    @property
+    def total(self):
+        if not self._marks:
+            return 0.0
+        return self._marks[-1][1] - self._start
+
+    def stages(self):
+        """Return a list of (stage, seconds since start, stage duration)."""
+        stages = []
+        last = self._start
+        for stage, at in list(self._marks):
+            stages.append((stage, at - self._start, at - last))
+            last = at
+        return stages
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "started": self.started,
+            "total": self.total,
+            "stages": [{"stage": stage, "at": at, "elapsed": elapsed}
+                       for stage, at, elapsed in self.stages()],
+        }
+
+    def format(self):
+        """Return a string with one line per stage for the console."""
+        lines = ["[Trace] %s" % (self.name or "")]
+        for stage, at, elapsed in self.stages():
+            lines.append("%-20s %10.6f %10.6f" % (stage, elapsed, at))
+        lines.append("%-20s %10.6f" % ("total", self.total))
+        return "\n".join(lines)
+
+    def emit(self, settings):
+        """Output the trace as configured by the trace setting.
+
+        "console" prints the stages. "json" appends a line of JSON to the
+        trace_file (by default, rester-trace.jsonl in the temp directory).
+        """
+        mode = settings.get("trace", False)
+        if mode == "console" or mode is True:
+            print("\n" + self.format())
+        elif mode == "json":
+            import tempfile
+            path = settings.get("trace_file", None) or \
+                os.path.join(tempfile.gettempdir(), "rester-trace.jsonl")
+            with open(path, "a") as trace_file:
+                trace_file.write(json.dumps(self.to_dict()) + "\n")
+
+
+def get_profile_path(settings):
+    """Return a new path for a .prof file, or None if profiling is off."""
+    if not settings.get("profile", False):
+        return None
+    import tempfile
+    directory = settings.get("profile_dir", None) or tempfile.gettempdir()
+    filename = "rester-%d-%d.prof" % (int(time.time() * 1000), os.getpid())
+    return os.path.join(directory, filename)
+
+
+def profile_call(fn, path):
+    """Return a function that runs fn under cProfile and dumps to path."""
+    def profiled(*args, **kwargs):
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(fn, *args, **kwargs)
+        finally:
+            profiler.dump_stats(path)
+            print("Profile written to %s" % path)
+    return profiled
@@ -2,10 +2,66 @@
 Utility functions
 """
 
+import codecs
+import json
+import os
 import re
 
 
 RE_ENCODING = """(?:encoding|charset)=['"]*([a-zA-Z0-9\-]+)['"]*"""
+# Leading bytes of common binary formats.
+MAGIC_NUMBERS = (
+    (b"\x89PNG\r\n\x1a\n", "PNG image"),
+    (b"\xff\xd8\xff", "JPEG image"),
+    (b"GIF87a", "GIF image"),
+    (b"GIF89a", "GIF image"),
+    (b"\x00\x00\x01\x00", "ICO image"),
+    (b"%PDF-", "PDF document"),
+    (b"PK\x03\x04", "ZIP archive"),
+    (b"\x1f\x8b", "gzip data"),
+    (b"BZh", "bzip2 data"),
+    (b"\xfd7zXZ\x00", "xz data"),
+    (b"7z\xbc\xaf\x27\x1c", "7-Zip archive"),
+    (b"\x00asm", "WebAssembly module"),
+    (b"wOFF", "WOFF font"),
+    (b"wOF2", "WOFF2 font"),
+    (b"OggS", "Ogg media"),
+    (b"ID3", "MP3 audio"),
+    (b"\x7fELF", "ELF executable"),
+)
+
+# Magic numbers short enough to begin plain text. They count only when the
+# body also has a NUL byte near the start, as these formats' headers do.
+WEAK_MAGIC_NUMBERS = (
+    (b"BM", "BMP image"),
+    (b"MZ", "Windows executable"),
+)
+
+# Content types that are text even though they are not text/*.
+TEXT_CONTENT_TYPES = ("json", "xml", "javascript", "ecmascript", "html",
+                      "x-www-form-urlencoded", "yaml", "csv", "graphql")
+
+# Content types prefixes that are always binary.
+BINARY_CONTENT_TYPES = ("image/", "audio/", "video/", "font/",
+                        "application/octet-stream", "application/pdf",
+                        "application/zip", "application/gzip",
+                        "application/x-protobuf", "application/protobuf",
+                        "application/vnd.google.protobuf", "application/grpc",
+                        "application/x-msgpack", "application/msgpack",
+                        "application/cbor", "application/wasm")
+
+RE_SETTINGS_NOISE = r'("(?:\\.|[^"\\])*")|//[^\n]*|/\*.*?\*/|,(\s*[}\]])'
+
+
+def format_size(size):
+    """Return a human readable string for a number of bytes."""
+    for unit in ("bytes", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            break
+        size /= 1024.0
+    if unit == "bytes":
+        return "%d %s" % (size, unit)
+    return "%.1f %s" % (size, unit)
 
 
 def get_end_of_line_character(view):
@@ -30,6 +86,34 @@ def get_query_string(query_map):
     return None
 
 
+def split_query_string(query_string):
+    """Return a map of the parameters of a query string to lists of values.
+
+    The values are left percent-encoded, as get_query_string expects them.
+    """
+    query = {}
+    for pair in query_string.split("&"):
+        if pair:
+            name, _, value = pair.partition("=")
+            query.setdefault(name, []).append(value)
+    return query
+
+
+def load_settings_file(path):
+    """Return the dictionary in a .sublime-settings file.
+
+    Sublime settings files are JSON that may contain comments and trailing
+    commas, both of which are removed before parsing.
+    """
+    def strip(m):
+        if m.group(1):
+            return m.group(1)
+        return m.group(2) or ""
+    with codecs.open(path, "r", encoding="UTF8") as settings_file:
+        text = settings_file.read()
+    return json.loads(re.sub(RE_SETTINGS_NOISE, strip, text, flags=re.DOTALL))
+
+
 def normalize_line_endings(string, eol):
     """Return a string with consistent line endings."""
     string = string.replace("\r\n", "\n").replace("\r", "\n")
@@ -38,6 +122,103 @@ def normalize_line_endings(string, eol):
     return string
 
 
+def trim_partial_character(bytes_sequence):
+    """Return the bytes without a UTF-8 sequence cut off at the end."""
+    end = len(bytes_sequence)
+    for i in range(end - 1, max(end - 4, -1), -1):
+        byte = bytearray(bytes_sequence[i:i + 1])[0]
+        if byte & 0xC0 == 0x80:
+            # Continuation byte. Keep looking for the lead byte.
+            continue
+        if byte & 0x80:
+            # Lead byte. Count the bytes the sequence needs.
+            if byte & 0xF0 == 0xF0:
+                length = 4
+            elif byte & 0xE0 == 0xE0:
+                length = 3
+            else:
+                length = 2
+            if end - i < length:
+                return bytes_sequence[:i]
+        break
+    return bytes_sequence
+
+
+def replace_file(source, destination):
+    """Rename source to destination, replacing destination if it exists."""
+    if os.name == "nt" and os.path.exists(destination):
+        os.remove(destination)
+    os.rename(source, destination)
+
+
+def sniff_binary(content_type, bytes_sequence):
+    """Return a description of the binary format of a body, or None for text.
+
+    A textual content type is trusted. Otherwise checks, in order: known
+    magic numbers, the content type, and finally looks for NUL bytes near
+    the start of the body.
+    """
+    media_type = None
+    if content_type:
+        media_type = content_type.split(";", 1)[0].strip().lower()
+        if _is_text(media_type) or media_type == "image/svg+xml":
+            return None
+
+    head = bytes_sequence[:1024]
+    for magic, description in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return description
+    if b"\x00" in head:
+        for magic, description in WEAK_MAGIC_NUMBERS:
+            if head.startswith(magic):
+                return description
+
+    if media_type:
+        for prefix in BINARY_CONTENT_TYPES:
+            if media_type.startswith(prefix):
+                return media_type
+
+    if b"\x00" in head:
+        return "binary data"
+    return None
+
+
+def _is_text(content_type):
+    if not content_type:
+        return False
+    content_type = content_type.lower()
+    if content_type.startswith("text/"):
+        return True
+    for text_type in TEXT_CONTENT_TYPES:
+        if text_type in content_type:
+            return True
+    return False
+
+
+def summarize_binary(description, bytes_sequence, preview_size=64):
+    """Return a short text summary of a binary body with a hex preview."""
+    import binascii
+    import hashlib
+
+    lines = [
+        "{Binary body: %s}" % description,
+        "Size: %d bytes (%s)" % (len(bytes_sequence),
+                                 format_size(len(bytes_sequence))),
+        "SHA-256: %s" % hashlib.sha256(bytes_sequence).hexdigest(),
+    ]
+    head = bytearray(bytes_sequence[:preview_size])
+    if head:
+        lines.append("First %d bytes:" % len(head))
+    for offset in range(0, len(head), 16):
+        row = head[offset:offset + 16]
+        hex_bytes = binascii.hexlify(bytes(row)).decode("ascii")
+        hex_bytes = " ".join(hex_bytes[i:i + 2]
+                             for i in range(0, len(hex_bytes), 2))
+        text = "".join(chr(b) if 32 <= b < 127 else "." for b in row)
+        lines.append("%08x  %-47s  |%s|" % (offset, hex_bytes, text))
+    return "\n".join(lines)
+
+
 def scan_string_for_encoding(string):
     """Read a string and return the encoding identified within."""
     m = re.search(RE_ENCODING, string)
@@ -0,0 +1,136 @@
+"""
+Tests for streaming a request body from a file
+
+Run from the repository root:
+
+    python -m unittest discover tests
+"""
+
+import hashlib
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from rester.http import UPLOAD_CHUNK_SIZE  # noqa: E402
+from rester.runner import prepare_request  # noqa: E402
+from rester.runner import run_request  # noqa: E402
+
+try:
+    # Python 3
+    from http.server import BaseHTTPRequestHandler
+    from http.server import HTTPServer
+    from shutil import which
+except ImportError:
+    # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from BaseHTTPServer import HTTPServer
+    which = None
+
+
+class Settings(dict):
+    def get(self, key, default=None):
+        return dict.get(self, key, default)
+
+
+class UploadHandler(BaseHTTPRequestHandler):
+    # Read the body with its Content-Length or as chunks, and respond with
+    # how it was sent.
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        chunks = 0
+        if "chunked" in (self.headers.get("Transfer-Encoding") or ""):
+            body = b""
+            while True:
+                size = int(self.rfile.readline().split(b";")[0], 16)
+                if not size:
+                    self.rfile.readline()
+                    break
+                body += self.rfile.read(size)
+                self.rfile.readline()
+                chunks += 1
+        else:
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+        response = json.dumps({
+            "content_length": self.headers.get("Content-Length"),
+            "chunks": chunks,
+            "sha256": hashlib.sha256(body).hexdigest(),
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+class BodyFileTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(("127.0.0.1", 0), UploadHandler)
+        thread = threading.Thread(target=cls.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        # A file of a few chunks, ending part way through one.
+        cls.directory = tempfile.mkdtemp()
+        rng = random.Random(37)
+        cls.data = bytes(bytearray(rng.randint(0, 255) for _ in
+                                   range(3 * UPLOAD_CHUNK_SIZE + 1234)))
+        with open(os.path.join(cls.directory, "upload.bin"), "wb") as f:
+            f.write(cls.data)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        shutil.rmtree(cls.directory)
+
+    def upload(self, client, headers=""):
+        text = "POST http://127.0.0.1:%d/upload\n%s\n< upload.bin" % (
+            self.server.server_address[1], headers)
+        settings = Settings(default_response_encodings=["utf-8"],
+                            http_client=client, timeout=10)
+        settings, request = prepare_request(text, settings,
+                                            directory=self.directory)
+        result = run_request(request, settings)
+        self.assertTrue(result.passed, result.message)
+        return json.loads(result.response.body)
+
+    def clients(self):
+        clients = ["python"]
+        if which and which("curl"):
+            clients.append("curl")
+        return clients
+
+    def test_content_length_upload(self):
+        for client in self.clients():
+            sent = self.upload(client)
+            self.assertEqual(sent["content_length"], str(len(self.data)),
+                             client)
+            self.assertEqual(sent["chunks"], 0, client)
+            self.assertEqual(sent["sha256"],
+                             hashlib.sha256(self.data).hexdigest(), client)
+
+    def test_chunked_upload(self):
+        for client in self.clients():
+            sent = self.upload(client, "Transfer-Encoding: chunked\n")
+            self.assertIsNone(sent["content_length"], client)
+            self.assertGreater(sent["chunks"], 1, client)
+            self.assertEqual(sent["sha256"],
+                             hashlib.sha256(self.data).hexdigest(), client)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+"""
+Tests for importing and replaying HAR files
+
+Run from the repository root:
+
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import threading
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from rester.har import entry_to_request  # noqa: E402
+from rester.har import import_har  # noqa: E402
+from rester.har import replay_har  # noqa: E402
+from rester.parse import RequestParser  # noqa: E402
+
+try:
+    # Python 3
+    from http.server import BaseHTTPRequestHandler
+    from http.server import HTTPServer
+except ImportError:
+    # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from BaseHTTPServer import HTTPServer
+
+QUERY = "q=hello%20world&x=a%26b&y=1%2B1"
+
+
+class Settings(dict):
+    def get(self, key, default=None):
+        return dict.get(self, key, default)
+
+
+class PathHandler(BaseHTTPRequestHandler):
+    # Respond with the path as it was requested.
+
+    def do_GET(self):
+        body = self.path.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_entry(url):
+    return {
+        "startedDateTime": "2024-01-01T00:00:00.000Z",
+        "request": {"method": "GET", "url": url, "headers": []},
+    }
+
+
+class HarQueryTest(unittest.TestCase):
+
+    def test_entry_keeps_encoded_query(self):
+        request = entry_to_request(make_entry("https://api.example/s?" +
+                                              QUERY))
+        self.assertEqual(request.full_path, "/s?" + QUERY)
+
+    def test_import_round_trip(self):
+        text = import_har([make_entry("https://api.example/s?" + QUERY)])
+        self.assertIn("GET https://api.example/s?" + QUERY, text)
+        block = text.split("\n", 1)[1]
+        request = RequestParser(Settings(), "\n").get_request(block)
+        self.assertEqual(request.full_path, "/s?" + QUERY)
+
+    def test_replay_sends_encoded_query(self):
+        server = HTTPServer(("127.0.0.1", 0), PathHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        url = "http://127.0.0.1:%d/s?%s" % (server.server_address[1], QUERY)
+        replayed = replay_har([make_entry(url)], Settings(
+            default_response_encodings=["utf-8"]))
+        result = replayed[0].result
+        self.assertTrue(result.passed, result.message)
+        self.assertEqual(result.response.body, "/s?" + QUERY)
+
+
+if __name__ == "__main__":
+    unittest.main()
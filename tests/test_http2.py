@@ -0,0 +1,186 @@
+"""
+Tests for the HTTP/2 client
+
+These need the h2 package, and are skipped without it. The servers use the
+self-signed certificate for localhost in tests/data.
+
+Run from the repository root:
+
+    python -m unittest discover tests
+"""
+
+import json
+import os
+import socket
+import ssl
+import sys
+import threading
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from rester.http import get_request_thread_class  # noqa: E402
+from rester.http2 import close_connections  # noqa: E402
+from rester.parse import RequestParser  # noqa: E402
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.events
+except ImportError:
+    h2 = None
+
+CERTIFICATE = os.path.join(ROOT, "tests", "data", "localhost.pem")
+
+
+class Settings(dict):
+    def get(self, key, default=None):
+        return dict.get(self, key, default)
+
+
+class TlsServer(object):
+    """Serves HTTP/2 or HTTP/1.1, whichever ALPN selects
+
+    HTTP/2 responses are held until batch streams are open on the
+    connection, then sent in reverse order, so a client only gets them if
+    it keeps the requests in flight at once.
+    """
+
+    def __init__(self, protocols, batch=1):
+        self.batch = batch
+        self.connections = 0
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(CERTIFICATE)
+        context.set_alpn_protocols(list(protocols))
+        self._context = context
+        self._listener = socket.socket()
+        self._listener.bind(("127.0.0.1", 0))
+        self._listener.listen(16)
+        self.port = self._listener.getsockname()[1]
+        thread = threading.Thread(target=self._accept)
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        self._listener.close()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self._listener.accept()
+                sock = self._context.wrap_socket(sock, server_side=True)
+            except (socket.error, ssl.SSLError):
+                if self._listener.fileno() == -1:
+                    return
+                continue
+            self.connections += 1
+            if sock.selected_alpn_protocol() == "h2":
+                target = self._serve_h2
+            else:
+                target = self._serve_http11
+            thread = threading.Thread(target=target, args=(sock,))
+            thread.daemon = True
+            thread.start()
+
+    def _serve_http11(self, sock):
+        data = b""
+        while b"\r\n\r\n" not in data:
+            data += sock.recv(65536)
+        path = data.split(b" ")[1]
+        body = b"http/1.1 " + path
+        sock.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n"
+                     b"Connection: close\r\n\r\n" % len(body) + body)
+        sock.close()
+
+    def _serve_h2(self, sock):
+        config = h2.config.H2Configuration(client_side=False,
+                                           header_encoding="utf-8")
+        conn = h2.connection.H2Connection(config=config)
+        conn.initiate_connection()
+        sock.sendall(conn.data_to_send())
+        requests = {}
+        ready = []
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            for event in conn.receive_data(data):
+                if isinstance(event, h2.events.RequestReceived):
+                    requests[event.stream_id] = [dict(event.headers), b""]
+                elif isinstance(event, h2.events.DataReceived):
+                    requests[event.stream_id][1] += event.data
+                    conn.acknowledge_received_data(
+                        event.flow_controlled_length, event.stream_id)
+                elif isinstance(event, h2.events.StreamEnded):
+                    ready.append(event.stream_id)
+            if len(ready) >= self.batch:
+                for stream_id in reversed(ready):
+                    headers, body = requests.pop(stream_id)
+                    response = json.dumps({
+                        "path": headers[":path"],
+                        "body": body.decode("utf-8"),
+                        "in_flight": len(ready),
+                    }).encode("utf-8")
+                    conn.send_headers(stream_id, [
+                        (":status", "200"),
+                        ("content-type", "application/json"),
+                        ("content-length", str(len(response)))])
+                    conn.send_data(stream_id, response, end_stream=True)
+                ready = []
+            sock.sendall(conn.data_to_send())
+        sock.close()
+
+
+@unittest.skipIf(h2 is None, "the h2 package is not installed")
+class Http2ClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.settings = Settings(default_response_encodings=["utf-8"],
+                                 ssl_ca_bundle=CERTIFICATE, timeout=5)
+        self.addCleanup(close_connections)
+
+    def send(self, port, text):
+        request = RequestParser(self.settings, "\n").get_request(
+            text.replace("{port}", str(port)))
+        thread = get_request_thread_class("http2")(request, self.settings)
+        thread.start()
+        return thread
+
+    def test_concurrent_streams_share_one_connection(self):
+        count = 8
+        server = TlsServer(("h2",), batch=count)
+        self.addCleanup(server.close)
+        threads = []
+        for index in range(count):
+            if index % 2:
+                text = "POST https://localhost:{port}/items/%d\n\nbody %d" % (
+                    index, index)
+            else:
+                text = "GET https://localhost:{port}/items/%d" % index
+            threads.append(self.send(server.port, text))
+        for index, thread in enumerate(threads):
+            thread.join(10)
+            self.assertTrue(thread.success, thread.message)
+            self.assertEqual(thread.response.protocol, "HTTP/2")
+            data = json.loads(thread.response.body)
+            self.assertEqual(data["path"], "/items/%d" % index)
+            self.assertEqual(data["body"], "body %d" % index if index % 2
+                             else "")
+            self.assertEqual(data["in_flight"], count)
+        self.assertEqual(server.connections, 1)
+
+    def test_falls_back_to_http11_without_alpn_h2(self):
+        server = TlsServer(("http/1.1",))
+        self.addCleanup(server.close)
+        for path in ("/first", "/second"):
+            thread = self.send(server.port,
+                               "GET https://localhost:{port}%s" % path)
+            thread.join(10)
+            self.assertTrue(thread.success, thread.message)
+            self.assertEqual(thread.response.protocol, "HTTP/1.1")
+            self.assertEqual(thread.response.body, "http/1.1 " + path)
+
+
+if __name__ == "__main__":
+    unittest.main()
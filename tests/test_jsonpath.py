@@ -0,0 +1,93 @@
+"""
+Tests for evaluating JSON paths on JSON text read in chunks
+
+Run from the repository root:
+
+    python -m unittest discover tests
+"""
+
+import json
+import os
+import random
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from rester.jsonpath import find  # noqa: E402
+from rester.jsonpath import find_in_stream  # noqa: E402
+
+PATHS = [
+    "$",
+    "$.items[*].id",
+    "$.items[*].price",
+    "$.items[0]",
+    "$.items[-1].tags",
+    "$..id",
+    "$..price",
+    "$.total",
+    "$.next",
+    "$.items[*].flags[*]",
+]
+
+
+def _make_document(rng):
+    # A document with numbers of every shape, so chunk boundaries fall
+    # inside signs, fractions, and exponents.
+    numbers = [0, -1, 7, -300000.5, 1e-07, 2.5e+300, -0.0, 123456789012,
+               3.14159, -42]
+    items = []
+    for index in range(rng.randint(0, 12)):
+        items.append({
+            "id": rng.choice(numbers) if index % 3 else index,
+            "price": rng.choice(numbers),
+            "name": "item \"%d\" é" % index,
+            "tags": ["a", "b,c", "]}"][:rng.randint(0, 3)],
+            "flags": [True, False, None][:rng.randint(0, 3)],
+        })
+    return {"items": items, "total": rng.choice(numbers), "next": None}
+
+
+def _split(text, rng):
+    # Split text into chunks of random sizes, many of a single character.
+    chunks = []
+    position = 0
+    while position < len(text):
+        size = rng.choice([1, 1, 2, 3, 5, 8, 64])
+        chunks.append(text[position:position + size])
+        position += size
+    return chunks
+
+
+class FindInStreamTest(unittest.TestCase):
+
+    def test_numbers_split_at_every_position(self):
+        for value in (-300000.5, 1.5e-10, -12, 123456, 0.25):
+            for text in (json.dumps([value, 1]), json.dumps({"a": value}),
+                         json.dumps(value)):
+                for cut in range(1, len(text)):
+                    chunks = [text[:cut], text[cut:]]
+                    self.assertEqual(
+                        list(find_in_stream(chunks, "$")),
+                        [json.loads(text)], "%r cut at %d" % (text, cut))
+
+    def test_chunk_boundary_fuzz(self):
+        rng = random.Random(1234)
+        for _ in range(300):
+            document = _make_document(rng)
+            text = json.dumps(document, indent=rng.choice([None, 1]))
+            chunks = _split(text, rng)
+            for path in PATHS:
+                self.assertEqual(
+                    list(find_in_stream(chunks, path)),
+                    list(find(document, path)),
+                    "%s in %r split as %r" % (path, text, chunks))
+
+    def test_invalid_number_is_an_error(self):
+        with self.assertRaises(ValueError):
+            list(find_in_stream(["[1.", "x]"], "$[*]"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+"""
+Tests for following paginated responses
+
+Run from the repository root:
+
+    python -m unittest discover tests
+"""
+
+import json
+import os
+import sys
+import threading
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from rester.paginate import PaginationThread  # noqa: E402
+from rester.paginate import get_page_request  # noqa: E402
+from rester.parse import RequestParser  # noqa: E402
+
+try:
+    # Python 3
+    from http.server import BaseHTTPRequestHandler
+    from http.server import HTTPServer
+except ImportError:
+    # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from BaseHTTPServer import HTTPServer
+
+
+class Settings(dict):
+    def get(self, key, default=None):
+        return dict.get(self, key, default)
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    # Each page is a JSON array holding the path it was requested at. Page
+    # 3 is empty.
+
+    def do_GET(self):
+        if "page=3" in self.path:
+            body = b"[]"
+        else:
+            body = json.dumps([self.path]).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def parse(text):
+    return RequestParser(Settings(), "\n").get_request(text)
+
+
+class GetPageRequestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.request = parse("GET http://api.example/items\n"
+                             "?q = hello world\n"
+                             "&x = a&b")
+
+    def test_copy_keeps_encoded_query(self):
+        page = get_page_request(self.request)
+        self.assertEqual(page.full_path, self.request.full_path)
+        self.assertEqual(page.full_path, "/items?q=hello%20world&x=a%26b")
+
+    def test_added_query_values_are_encoded(self):
+        page = get_page_request(self.request, query={"cursor": "a b&c"})
+        self.assertEqual(page.query["q"], ["hello%20world"])
+        self.assertEqual(page.query["cursor"], ["a%20b%26c"])
+
+    def test_next_link_keeps_its_encoding(self):
+        page = get_page_request(
+            self.request, "https://other.example/items?q=a%2Bb&x=c%26d#top")
+        self.assertEqual(page.uri,
+                         "https://other.example/items?q=a%2Bb&x=c%26d")
+
+    def test_relative_query_link(self):
+        page = get_page_request(self.request, "?page=2&q=a%20b")
+        self.assertEqual(page.uri, "http://api.example/items?page=2&q=a%20b")
+
+
+class PaginationThreadTest(unittest.TestCase):
+
+    def test_pages_of_request_with_encoded_query(self):
+        server = HTTPServer(("127.0.0.1", 0), PageHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        settings = Settings(default_response_encodings=["utf-8"],
+                            paginate={"param": "page"}, paginate_jobs=1)
+        request = parse("GET http://127.0.0.1:%d/items\n?q = hello world"
+                        % server.server_address[1])
+        pages = PaginationThread(request, settings)
+        pages.run()
+        self.assertTrue(pages.success, pages.message)
+        self.assertEqual(sorted(json.loads(pages.response.body)),
+                         ["/items?q=hello%20world&page=1",
+                          "/items?q=hello%20world&page=2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+"""
+Tests for running requests without Sublime Text
+
+Run from the repository root:
+
+    python -m unittest discover tests
+"""
+
+import os
+import socket
+import sys
+import threading
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from rester.parse import RequestParser  # noqa: E402
+from rester.runner import run_request  # noqa: E402
+
+
+class Settings(dict):
+    def get(self, key, default=None):
+        return dict.get(self, key, default)
+
+
+def start_server(respond):
+    # Start a server that calls respond(connection, request) for each
+    # connection. Return the port.
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(5)
+
+    def serve():
+        while True:
+            connection, _ = listener.accept()
+            data = b""
+            while b"\r\n\r\n" not in data:
+                data += connection.recv(65536)
+            respond(connection, data)
+
+    thread = threading.Thread(target=serve)
+    thread.daemon = True
+    thread.start()
+    return listener.getsockname()[1]
+
+
+def stall_body(connection, request):
+    # Send the headers and part of the body, then nothing more.
+    connection.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: 100\r\n\r\n"
+                       b"half")
+    threading.Timer(5, connection.close).start()
+
+
+def redirect_once(connection, request):
+    if request.startswith(b"GET /start "):
+        response = b"HTTP/1.1 302 Found\r\nLocation: /end\r\n"
+    else:
+        response = b"HTTP/1.1 200 OK\r\n"
+    connection.sendall(response + b"Content-Length: 2\r\nConnection: close"
+                       b"\r\n\r\nok")
+    connection.close()
+
+
+def make_request(settings, port, path):
+    return RequestParser(settings, "\n").get_request(
+        "GET http://127.0.0.1:%d%s" % (port, path))
+
+
+class FailingExecutor(object):
+    def send(self, make_thread, policy=None, trace=None):
+        raise RuntimeError("worker failed")
+
+
+class RunRequestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.settings = Settings(default_response_encodings=["utf-8"],
+                                 timeout=0.5, retry_backoff=0)
+
+    def test_body_read_timeout_is_a_failed_result(self):
+        port = start_server(stall_body)
+        for client in ("python", "http2"):
+            self.settings["http_client"] = client
+            result = run_request(make_request(self.settings, port, "/"),
+                                 self.settings)
+            self.assertFalse(result.success, client)
+            self.assertIsNone(result.response, client)
+            self.assertIn("timed out", result.message)
+
+    def test_body_read_timeout_is_retried(self):
+        port = start_server(stall_body)
+        self.settings["retries"] = 1
+        result = run_request(make_request(self.settings, port, "/"),
+                             self.settings)
+        self.assertEqual(len(result.attempts), 2)
+        self.assertEqual(result.attempts[0].failure, "timeout")
+        self.assertEqual(result.retries, 1)
+        self.assertIn("[1 retry]", result.summary())
+
+    def test_unexpected_error_is_a_failed_result(self):
+        result = run_request(make_request(self.settings, 1, "/"),
+                             self.settings, executor=FailingExecutor())
+        self.assertFalse(result.success)
+        self.assertIn("worker failed", result.message)
+
+    def test_redirect_is_not_a_retry(self):
+        port = start_server(redirect_once)
+        self.settings["follow_redirect_status_codes"] = [302]
+        result = run_request(make_request(self.settings, port, "/start"),
+                             self.settings)
+        self.assertTrue(result.passed)
+        self.assertEqual(result.redirects, 1)
+        self.assertEqual(result.retries, 0)
+        self.assertNotIn("[", result.summary())
+
+
+if __name__ == "__main__":
+    unittest.main()
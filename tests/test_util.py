@@ -0,0 +1,60 @@
+"""
+Tests for the utility functions
+
+Run from the repository root:
+
+    python -m unittest discover tests
+"""
+
+import os
+import struct
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from rester.util import sniff_binary  # noqa: E402
+
+
+def make_bmp():
+    # A 1x1 pixel, 24-bit BMP.
+    pixels = b"\xff\x00\x00\x00"
+    header = struct.pack("<2sIHHI", b"BM", 54 + len(pixels), 0, 0, 54)
+    info = struct.pack("<IiiHHIIiiII", 40, 1, 1, 1, 24, 0, len(pixels),
+                       2835, 2835, 0, 0)
+    return header + info + pixels
+
+
+def make_exe():
+    # The DOS header of a PE file, pointing at the PE signature.
+    header = bytearray(128)
+    header[0:2] = b"MZ"
+    header[0x3c:0x40] = struct.pack("<I", 64)
+    header[64:68] = b"PE\x00\x00"
+    return bytes(header)
+
+
+class SniffBinaryTest(unittest.TestCase):
+
+    def test_text_starting_like_short_magic_numbers(self):
+        for text in (b"BMW dealers near you\n", b"MZ-based list\n"):
+            self.assertIsNone(sniff_binary(None, text))
+            self.assertIsNone(sniff_binary("text/plain", text))
+            self.assertNotIn(sniff_binary("application/octet-stream", text),
+                             ("BMP image", "Windows executable"))
+
+    def test_short_magic_numbers_of_binary_bodies(self):
+        self.assertEqual(sniff_binary(None, make_bmp()), "BMP image")
+        self.assertEqual(sniff_binary("application/octet-stream",
+                                      make_exe()), "Windows executable")
+
+    def test_textual_content_type_is_trusted(self):
+        for magic in (b"ID3", b"BZh", b"OggS"):
+            self.assertIsNone(sniff_binary("text/plain; charset=utf-8",
+                                           magic + b" is how it starts"))
+            self.assertIsNotNone(sniff_binary(None, magic + b"\x00\x01"))
+
+
+if __name__ == "__main__":
+    unittest.main()